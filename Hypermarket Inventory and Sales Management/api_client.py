@@ -0,0 +1,167 @@
+# HTTP client for the Streamlit UI (restaurant_ui.py)
+#
+# Streamlit reruns the whole script on every widget interaction, so:
+#
+#   - one requests.Session per process (st.cache_resource) keeps pooled
+#     keep-alive connections to the API across reruns and browser sessions
+#   - get_frame / get_json are cached with st.cache_data for CACHE_TTL
+#     seconds; failed requests raise APIError and are never cached
+#   - send() is the only way the UI writes, and it clears both caches so the
+#     next read sees the change
+#   - every request that reaches the API is counted for the current rerun
+#     (begin_rerun / calls), and the sidebar shows the tally
+#   - LiveEvents reads the GET /live event stream on a background thread,
+#     so the dashboard can wait on it and still notice widget changes
+#
+#   UI_CACHE_TTL=30        seconds a cached GET is reused
+#   UI_HTTP_POOL=10        keep-alive connections per API host
+#   UI_HTTP_TIMEOUT=30     seconds before a request is abandoned
+
+import json
+import os
+import queue
+import socket
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+
+CACHE_TTL = float(os.getenv("UI_CACHE_TTL", "30"))
+POOL_SIZE = int(os.getenv("UI_HTTP_POOL", "10"))
+TIMEOUT = float(os.getenv("UI_HTTP_TIMEOUT", "30"))
+# The API sends a heartbeat every 15 s; this much silence means it is gone
+LIVE_READ_TIMEOUT = 60
+
+
+class APIError(Exception):
+    def __init__(self, resp):
+        super().__init__(f"{resp.request.method} {resp.url} -> {resp.status_code}")
+        self.status_code = resp.status_code
+        self.resp = resp
+
+
+@st.cache_resource
+def session():
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def begin_rerun():
+    """Start counting this rerun's backend calls; call once at the top of the script."""
+    st.session_state["api_calls"] = []
+
+
+def calls():
+    """[(method, path, status)] for every request this rerun sent to the API."""
+    return st.session_state.get("api_calls", [])
+
+
+def request(method, base_url, path, **kwargs):
+    resp = session().request(method, f"{base_url}{path}", timeout=TIMEOUT, **kwargs)
+    st.session_state.setdefault("api_calls", []).append((method, path, resp.status_code))
+    return resp
+
+
+def arrow_frame(resp):
+    # Arrow IPC straight into pandas: no JSON parsing, and the Arrow buffers
+    # are released column by column as the DataFrame takes them over
+    table = pa.ipc.open_stream(pa.py_buffer(resp.content)).read_all()
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_frame(base_url, path, params=None) -> pd.DataFrame:
+    """GET an Arrow IPC response as a DataFrame (pass format=arrow in params)."""
+    resp = request("GET", base_url, path, params=params)
+    if resp.status_code != 200:
+        raise APIError(resp)
+    return arrow_frame(resp)
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_json(base_url, path, params=None):
+    resp = request("GET", base_url, path, params=params)
+    if resp.status_code != 200:
+        raise APIError(resp)
+    return resp.json()
+
+
+def clear_cache():
+    get_frame.clear()
+    get_json.clear()
+
+
+def send(method, base_url, path, **kwargs):
+    """POST / PUT / PATCH / DELETE; cached reads are dropped whatever the outcome."""
+    try:
+        return request(method, base_url, path, **kwargs)
+    finally:
+        clear_cache()
+
+
+class LiveEvents:
+    """GET /live; iterate for (event, data), or None every `tick` seconds without one."""
+
+    _CLOSED = object()
+
+    def __init__(self, base_url, tick=0.5):
+        self.tick = tick
+        self.resp = session().get(f"{base_url}/live", stream=True, timeout=(TIMEOUT, LIVE_READ_TIMEOUT))
+        st.session_state.setdefault("api_calls", []).append(("GET", "/live", self.resp.status_code))
+        if self.resp.status_code != 200:
+            self.resp.close()
+            raise APIError(self.resp)
+        self._queue = queue.Queue()
+        threading.Thread(target=self._read, name="live-events", daemon=True).start()
+
+    def _read(self):
+        event = None
+        try:
+            for line in self.resp.iter_lines(chunk_size=None, decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:") and event:
+                    self._queue.put((event, json.loads(line[5:])))
+                    event = None
+        except Exception:
+            # Closed by close(), or the API went away: either way the stream is over
+            pass
+        finally:
+            self._queue.put(self._CLOSED)
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.tick)
+            except queue.Empty:
+                yield None
+                continue
+            if item is self._CLOSED:
+                return
+            yield item
+
+    def close(self):
+        # The reader thread is blocked on the socket and holds its buffer, so
+        # shut the socket down first or resp.close() would wait for the next
+        # event to arrive
+        conn = getattr(self.resp.raw, "connection", None)
+        sock = getattr(conn, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.resp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
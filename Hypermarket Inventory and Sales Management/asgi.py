@@ -0,0 +1,16 @@
+# uvicorn asgi:app
+#
+# API_MODE=sync  (default) -> backend.py, def handlers on the threadpool
+# API_MODE=async           -> backend_async.py, async def handlers on asyncpg/aiosqlite
+
+import os
+
+
+API_MODE = os.getenv("API_MODE", "sync").lower()
+
+if API_MODE == "async":
+    from backend_async import app
+elif API_MODE == "sync":
+    from backend import app
+else:
+    raise RuntimeError(f"API_MODE must be 'sync' or 'async', not {API_MODE!r}")
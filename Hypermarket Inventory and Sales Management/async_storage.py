@@ -0,0 +1,334 @@
+# asyncio counterpart of storage.py, used by backend_async.py
+#
+#   Postgres -> asyncpg (its own pool, "?" rewritten to $1, $2, ...)
+#   SQLite   -> aiosqlite connections in a bounded asyncio pool
+#
+# Connections behave like storage.Connection: statements open a transaction
+# implicitly, commit() runs after_commit callbacks, rollback() drops them,
+# and rows come back as dicts.
+
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+
+import storage
+from storage import DB_NAME, POOL_HEALTH_CHECK, POOL_SIZE, POOL_TIMEOUT, PoolTimeout
+
+
+_PLACEHOLDER = re.compile(r"\?")
+
+
+class AsyncSQLiteBackend:
+    name = "sqlite"
+    for_update = ""
+
+    def __init__(self, path=DB_NAME):
+        self.path = path
+
+    async def connect(self):
+        import aiosqlite
+
+        conn = await aiosqlite.connect(self.path, timeout=POOL_TIMEOUT)
+        conn.row_factory = lambda cursor, row: {
+            col[0]: row[i] for i, col in enumerate(cursor.description)
+        }
+        await conn.execute("PRAGMA foreign_keys = ON")
+        await conn.execute("PRAGMA journal_mode = WAL")
+        await conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def timestamp(self, value):
+        return value.isoformat()
+
+
+class AsyncPostgresBackend:
+    name = "postgres"
+    for_update = " FOR UPDATE"
+
+    def __init__(self, url):
+        self.url = url
+
+    def timestamp(self, value):
+        # asyncpg wants datetime objects for TIMESTAMP parameters
+        return value
+
+
+class AsyncConnection:
+    def __init__(self, raw, backend):
+        self.raw = raw
+        self.backend = backend
+        self.last_used = time.monotonic()
+        self._tx = None
+        self._after_commit = []
+
+    async def _begin_implicit(self):
+        if self.backend.name == "postgres" and self._tx is None:
+            self._tx = self.raw.transaction()
+            await self._tx.start()
+
+    async def begin(self):
+        if self.backend.name == "postgres":
+            await self._begin_implicit()
+        else:
+            if self.raw.in_transaction:
+                await self.raw.commit()
+            await self.raw.execute("BEGIN IMMEDIATE")
+
+    async def fetchall(self, sql, params=()):
+        await self._begin_implicit()
+        start = time.perf_counter()
+        if self.backend.name == "postgres":
+            rows = [dict(r) for r in await self.raw.fetch(_numbered(sql), *params)]
+        else:
+            async with self.raw.execute(sql, tuple(params)) as cur:
+                rows = await cur.fetchall()
+        _observe(sql, start, len(rows))
+        return rows
+
+    async def fetchone(self, sql, params=()):
+        await self._begin_implicit()
+        start = time.perf_counter()
+        if self.backend.name == "postgres":
+            row = await self.raw.fetchrow(_numbered(sql), *params)
+            row = dict(row) if row is not None else None
+        else:
+            async with self.raw.execute(sql, tuple(params)) as cur:
+                row = await cur.fetchone()
+        _observe(sql, start, row is not None)
+        return row
+
+    async def execute(self, sql, params=()):
+        """Run a statement and return the number of affected rows."""
+        await self._begin_implicit()
+        start = time.perf_counter()
+        if self.backend.name == "postgres":
+            status = await self.raw.execute(_numbered(sql), *params)
+            tail = status.rsplit(" ", 1)[-1]
+            count = int(tail) if tail.isdigit() else 0
+        else:
+            async with self.raw.execute(sql, tuple(params)) as cur:
+                count = cur.rowcount
+        _observe(sql, start, max(count, 0))
+        return count
+
+    async def executemany(self, sql, seq_of_params):
+        await self._begin_implicit()
+        seq_of_params = [tuple(p) for p in seq_of_params]
+        start = time.perf_counter()
+        if self.backend.name == "postgres":
+            await self.raw.executemany(_numbered(sql), seq_of_params)
+        else:
+            await self.raw.executemany(sql, seq_of_params)
+        _observe(sql, start, len(seq_of_params))
+
+    async def stream(self, sql, params=(), chunk_size=1000):
+        """Yield lists of at most chunk_size rows without loading the whole result."""
+        await self._begin_implicit()
+        if self.backend.name == "postgres":
+            cur = await self.raw.cursor(_numbered(sql), *params)
+            while True:
+                start = time.perf_counter()
+                rows = await cur.fetch(chunk_size)
+                _observe(sql, start, len(rows), fetch=True)
+                if not rows:
+                    break
+                yield [dict(r) for r in rows]
+            return
+        async with self.raw.execute(sql, tuple(params)) as cur:
+            while True:
+                start = time.perf_counter()
+                rows = await cur.fetchmany(chunk_size)
+                _observe(sql, start, len(rows), fetch=True)
+                if not rows:
+                    break
+                yield rows
+
+    def after_commit(self, callback):
+        self._after_commit.append(callback)
+
+    async def commit(self):
+        start = time.perf_counter()
+        if self.backend.name == "postgres":
+            if self._tx is not None:
+                tx, self._tx = self._tx, None
+                await tx.commit()
+        else:
+            await self.raw.commit()
+        _observe("COMMIT", start, 0)
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            callback()
+
+    async def rollback(self):
+        self._after_commit = []
+        if self.backend.name == "postgres":
+            if self._tx is not None:
+                tx, self._tx = self._tx, None
+                await tx.rollback()
+        else:
+            await self.raw.rollback()
+
+    async def ping(self):
+        try:
+            await self.fetchone("SELECT 1")
+            await self.rollback()
+            return True
+        except Exception:
+            return False
+
+
+def _observe(sql, start, rows, fetch=False):
+    # Same hook as the sync layer; the async calls execute and fetch in one go
+    observer = storage.observer
+    if observer is None:
+        return
+    if fetch:
+        observer.fetched(sql, time.perf_counter() - start, int(rows))
+    else:
+        observer.statement(sql, time.perf_counter() - start, int(rows))
+
+
+def _numbered(sql):
+    counter = iter(range(1, 10**6))
+    return _PLACEHOLDER.sub(lambda _: f"${next(counter)}", sql)
+
+
+class AsyncSQLitePool:
+    """Bounded pool of aiosqlite connections with the same knobs as storage.ConnectionPool."""
+
+    def __init__(self, backend, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 health_check=POOL_HEALTH_CHECK):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self.health_check = health_check
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(
+                f"no database connection available within {self.timeout}s (pool size {self.size})"
+            ) from None
+        try:
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None and time.monotonic() - conn.last_used > self.health_check:
+                if not await conn.ping():
+                    await conn.raw.close()
+                    conn = None
+            if conn is None:
+                conn = AsyncConnection(await self.backend.connect(), self.backend)
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    async def release(self, conn):
+        try:
+            await conn.rollback()
+            conn.last_used = time.monotonic()
+            self._idle.append(conn)
+        except Exception:
+            await conn.raw.close()
+        finally:
+            self._slots.release()
+
+    async def warm(self, count):
+        # Connect concurrently rather than one after another
+        conns = await asyncio.gather(*(self.acquire() for _ in range(min(count, self.size))))
+        for conn in conns:
+            await self.release(conn)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.raw.close()
+
+
+class AsyncPostgresPool:
+    def __init__(self, backend, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 health_check=POOL_HEALTH_CHECK):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self.health_check = health_check
+        self._min_size = 1
+        self._pool = None
+
+    async def _ensure(self):
+        if self._pool is None:
+            import asyncpg
+
+            self._pool = await asyncpg.create_pool(
+                self.backend.url, min_size=self._min_size, max_size=self.size,
+                max_inactive_connection_lifetime=max(self.health_check, 1.0),
+            )
+        return self._pool
+
+    async def acquire(self):
+        pool = await self._ensure()
+        try:
+            raw = await pool.acquire(timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(
+                f"no database connection available within {self.timeout}s (pool size {self.size})"
+            ) from None
+        return AsyncConnection(raw, self.backend)
+
+    async def release(self, conn):
+        try:
+            await conn.rollback()
+        finally:
+            # asyncpg resets and health-checks connections on release
+            await self._pool.release(conn.raw)
+
+    async def warm(self, count):
+        # asyncpg opens min_size connections concurrently when the pool is created
+        if self._pool is None:
+            self._min_size = max(1, min(count, self.size))
+        await self._ensure()
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+def pool_from_url(url, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+    if url and url.startswith(("postgres://", "postgresql://")):
+        return AsyncPostgresPool(AsyncPostgresBackend(url), size, timeout)
+    if url and url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return AsyncSQLitePool(AsyncSQLiteBackend(url or DB_NAME), size, timeout)
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = pool_from_url(os.getenv("DATABASE_URL"))
+    return _pool
+
+
+def set_pool(pool):
+    global _pool
+    _pool = pool
+
+
+@asynccontextmanager
+async def get_conn():
+    pool = get_pool()
+    start = time.perf_counter()
+    conn = await pool.acquire()
+    if storage.observer is not None:
+        storage.observer.acquired(time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
@@ -1,56 +1,42 @@
 # cd .\project
 # uvicorn backend:app --reload
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import List, Optional
+from contextlib import asynccontextmanager
+import tempfile
+
+from datetime import date, datetime, time, timedelta
+
+# DATABASE_URL (set on Render) picks Postgres; without it we run on restaurant.db
+from storage import get_conn, get_pool
+from migrations import migrate
+from catalog_cache import catalog, Entry, respond
+from catalog_events import publish
+import catalog_events
+import fast_json
+import live_feed
+import metrics
+import product_search
+import reorder
+import rollup
+import sales_archive
+import sales_buffer
+import sales_changes
+import startup
+import stock_shards
+from stock_shards import PRODUCT_COLUMNS, TOTAL_STOCK
 
-from datetime import datetime
-import psycopg2
-import os
 
 
 
-
-DB_NAME = "restaurant.db"
-
-def get_conn():
-    # Use the DATABASE_URL environment variable from Render
-    database_url = os.getenv("DATABASE_URL")
-    conn = psycopg2.connect(database_url)
-    return conn
-
-
 def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL,
-            price REAL NOT NULL,
-            stock INTEGER NOT NULL,
-            category TEXT
-        )
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS sales (
-            id SERIAL PRIMARY KEY,
-            product_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL,
-            total_amount REAL NOT NULL,
-            sale_date TEXT NOT NULL,
-            FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
-        )
-    """)
-
-    conn.commit()
-    conn.close()
-
-
-
-init_db()
+    # Scripts that call the handlers directly; the app itself checks the
+    # schema in lifespan (startup.py), so importing this module stays cheap
+    with get_conn() as conn:
+        migrate(conn)
 
 
 
@@ -70,37 +56,85 @@ class ProductUpdate(BaseModel):
 class ProductRead(ProductBase):
     id: int
 
+class ProductChange(ProductUpdate):
+    id: int
+
 class SaleBase(BaseModel):
     product_id: int
-    quantity: int
+    # A zero or negative sale would raise stock through the guarded decrement
+    quantity: int = Field(gt=0)
 
 class SaleRead(BaseModel):
     id: int
     product_id: int
     quantity: int
     total_amount: float
-    sale_date: str
+    sale_date: datetime
+
+class SalesSummary(BaseModel):
+    total_sales: float
+    total_quantity: int
+    sale_count: int
+    total_products: int
+    total_categories: int
+
+class LowStockItem(BaseModel):
+    id: int
+    name: str
+    category: Optional[str] = None
+    stock: int
+    reorder_level: int
+    since: datetime
+    daily_sales: Optional[float] = None
+    days_left: Optional[float] = None
+
+class ReorderLevel(BaseModel):
+    reorder_level: int = Field(ge=0)
+
+class ProductSales(BaseModel):
+    product_id: Optional[int] = None
+    name: str
+    total_amount: float
+    quantity: int
+
+
+MAX_BASKET_LINES = 1000
+MAX_BULK_CHANGES = 100000
+BULK_CHUNK_ROWS = 1000
+BULK_EVENT_LIMIT = 100
+MAX_PAGE_SIZE = 10000
+STREAM_CHUNK_SIZE = 1000
+
 
+@asynccontextmanager
+async def lifespan(app):
+    await startup.run()
+    yield
+    await startup.stop()
 
-app = FastAPI()
 
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 
+
+INSERT_PRODUCT_SQL = """
+    INSERT INTO products (name, price, stock, category)
+    VALUES (?, ?, ?, ?)
+    RETURNING *
+"""
+
+
 @app.post("/products")
 def create_product(product: ProductBase):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO products (name, price, stock, category)
-        VALUES (?, ?, ?, ?)
-    """, (product.name, product.price, product.stock, product.category))
-    
-    conn.commit()
-    pid = cur.lastrowid
-    cur.execute("SELECT * FROM products WHERE id=?", (pid,))
-    row = cur.fetchone()
-    conn.close()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(INSERT_PRODUCT_SQL, (product.name, product.price, product.stock, product.category))
+        row = cur.fetchone()
+        reorder.record_stock(cur, [(row["id"], row["stock"], row["reorder_level"])])
+        publish(conn, "added", row["id"], row["category"], stock=row["stock"])
+        conn.commit()
 
     return {
         "message": "Product created successfully.",
@@ -110,54 +144,381 @@ def create_product(product: ProductBase):
     # return ProductRead(**row)
 
 
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
 
 
-@app.get("/products")
-def list_products(category: Optional[str] = Query(None, alias="category")):
-    conn = get_conn()
-    cur = conn.cursor()
+@app.post("/products/import")
+async def import_products(request: Request,
+                          fmt: Optional[str] = Query(None, alias="format", pattern="^(csv|parquet)$")):
+    # async only to read the upload: the body is spooled (to disk past
+    # IMPORT_SPOOL_BYTES) and the import itself runs on the threadpool
+    import bulk_import
 
-    if category:
-        cur.execute("SELECT * FROM products WHERE category=?", (category,))
+    if fmt is None:
+        fmt = "parquet" if "parquet" in request.headers.get("content-type", "") else "csv"
+
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as upload:
+        async for chunk in request.stream():
+            upload.write(chunk)
+        upload.seek(0)
+
+        def run():
+            with get_conn() as conn:
+                return bulk_import.import_products(
+                    conn, bulk_import.iter_records(upload, fmt), ProductBase
+                )
+
+        try:
+            summary = await run_in_threadpool(run)
+        except (ValueError, UnicodeDecodeError, OSError) as exc:
+            raise HTTPException(400, f"Could not read {fmt} upload: {exc}")
+
+    return {
+        "message": (f"Import finished: {summary['inserted']} inserted, "
+                    f"{summary['updated']} updated, {summary['rejected']} rejected."),
+        **summary
+    }
+
+
+
+
+PRODUCT_SQL = f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id=?"
+
+
+def keyset_query(table, filters, after, limit, columns=None, conditions=()):
+    # Pages are keyed on id, so page N costs the same as page 1
+    clauses, params = [], []
+    for column, value in filters.items():
+        if value is not None:
+            clauses.append(f"{column}=?")
+            params.append(value)
+    for clause, value in conditions:
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+    if after is not None:
+        clauses.append("id > ?")
+        params.append(after)
+
+    if table == "products":
+        # Stock is summed over any stock shards
+        select = ", ".join(stock_shards.select_columns(columns)) if columns else PRODUCT_COLUMNS
     else:
-        cur.execute("SELECT * FROM products")
+        select = ", ".join(columns) if columns else "*"
+    sql = f"SELECT {select} FROM {table}"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+def page_response(response, rows, limit, model):
+    headers = {}
+    if limit is not None and len(rows) == limit:
+        headers["X-Next-After"] = str(rows[-1]["id"])
+    if fast_json.ENABLED:
+        # Rows were selected in the model's field order (fast_json.columns)
+        return Response(content=fast_json.dumps(rows), media_type="application/json",
+                        headers=headers)
+    response.headers.update(headers)
+    return [model(**row) for row in rows]
+
+
+def fetch_page(response, sql, params, limit, model, archive=None):
+    with get_conn() as conn:
+        rows = conn.execute(sql, params).fetchall()
+        if archive is not None:
+            rows = archive.page(sales_archive.load_manifest(conn), rows, limit)
+    return page_response(response, rows, limit, model)
+
+
+def ndjson_lines(rows, model):
+    if fast_json.ENABLED:
+        return fast_json.ndjson(rows)
+    return "".join(model(**row).model_dump_json() + "\n" for row in rows)
+
+
+def archive_chunks(conn, chunks, archive):
+    if archive is None:
+        return chunks
+    return archive.stream(lambda: sales_archive.load_manifest(conn),
+                          chunks, STREAM_CHUNK_SIZE)
+
+
+def stream_ndjson(sql, params, model, archive=None):
+    def body():
+        # The connection stays checked out only while the client is reading
+        with get_conn() as conn:
+            for rows in archive_chunks(conn, conn.stream(sql, params, STREAM_CHUNK_SIZE), archive):
+                yield ndjson_lines(rows, model)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+def date_range(column, start, end):
+    # Inclusive calendar-day bounds as keyset_query conditions
+    return [
+        (f"{column} >= ?", datetime.combine(start, time.min) if start else None),
+        (f"{column} < ?", datetime.combine(end + timedelta(days=1), time.min) if end else None),
+    ]
+
+
+def columnar_columns(table, fmt, columns, limit):
+    """Resolve ?columns= for arrow/parquet; returns (output columns, SQL columns)."""
+    if fmt == "json":
+        if columns:
+            raise HTTPException(400, "columns= needs format=arrow or format=parquet.")
+        return None, None
+
+    import arrow_export
+
+    try:
+        names = arrow_export.project(table, columns)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc))
+    # The page cursor needs the id even when it isn't requested
+    return names, names if "id" in names or limit is None else names + ["id"]
+
+
+def columnar_response(table, fmt, names, sql, params, limit, archive=None):
+    import arrow_export
+
+    schema = arrow_export.schema(table, names)
+    media_type = arrow_export.MEDIA_TYPES[fmt]
+
+    if limit is not None:
+        with get_conn() as conn:
+            rows = conn.execute(sql, params).fetchall()
+            if archive is not None:
+                rows = archive.page(sales_archive.load_manifest(conn), rows, limit)
+        headers = {}
+        if len(rows) == limit:
+            headers["X-Next-After"] = str(rows[-1]["id"])
+        body = b"".join(arrow_export.encode(fmt, schema, [rows]))
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    def body():
+        with get_conn() as conn:
+            chunks = archive_chunks(conn, conn.stream(sql, params, STREAM_CHUNK_SIZE), archive)
+            yield from arrow_export.encode(fmt, schema, chunks)
+
+    return StreamingResponse(body(), media_type=media_type)
+
+
+product_list_json = TypeAdapter(List[ProductRead])
+
+
+def product_list_entry(rows, category, limit):
+    headers = {}
+    if limit is not None and len(rows) == limit:
+        headers["X-Next-After"] = str(rows[-1]["id"])
+    if fast_json.ENABLED:
+        body = fast_json.dumps(rows)
+    else:
+        body = product_list_json.dump_json([ProductRead(**row) for row in rows])
+    return Entry(body, [row["id"] for row in rows], category=category, headers=headers)
+
+FORMAT_PATTERN = "^(json|arrow|parquet)$"
 
-    rows = cur.fetchall()
-    conn.close()
 
+@app.get("/products")
+def list_products(response: Response,
+                  category: Optional[str] = Query(None, alias="category"),
+                  limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                  after: Optional[int] = None,
+                  stream: bool = False,
+                  fmt: str = Query("json", alias="format", pattern=FORMAT_PATTERN),
+                  columns: Optional[str] = None,
+                  if_none_match: Optional[str] = Header(None)):
+    category = category or None
+    names, select = columnar_columns("products", fmt, columns, limit)
+    sql, params = keyset_query("products", {"category": category}, after, limit,
+                               select or fast_json.columns(ProductRead))
+
+    if names:
+        return columnar_response("products", fmt, names, sql, params, limit)
+    if stream:
+        return stream_ndjson(sql, params, ProductRead)
+
+    key = ("list", category, after, limit)
+    entry = catalog.get(key)
+    if entry is None:
+        generation = catalog.generation()
+        with get_conn() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        entry = product_list_entry(rows, category, limit)
+        catalog.put(key, entry, generation)
+
+    return respond(entry, if_none_match)
+
+
+# Declared before /products/{pid} so "search" is not parsed as a product id
+@app.get("/products/search", response_model=List[ProductRead])
+def search_products(q: str = Query(..., min_length=1, max_length=100),
+                    limit: int = Query(product_search.DEFAULT_RESULTS, ge=1,
+                                       le=product_search.MAX_RESULTS)):
+    if not q.strip():
+        return []
+    with get_conn() as conn:
+        sql, params = product_search.search_query(conn.backend.name, q, limit)
+        rows = conn.execute(sql, params).fetchall()
     return [ProductRead(**row) for row in rows]
 
 
+# Declared before /products/{pid} so "low-stock" is not parsed as a product id
+@app.get("/products/low-stock", response_model=List[LowStockItem])
+def low_stock_products(category: Optional[str] = None,
+                       limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                       days: Optional[int] = Query(None, ge=1, le=365)):
+    # Read from the low_stock index (reorder.py); days= ranks by days of stock left
+    with get_conn() as conn:
+        rows = reorder.low_stock(conn, category or None, limit, days)
+    return [LowStockItem(**row) for row in rows]
+
+
 @app.get("/products/{pid}")
-def get_product(pid: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM products WHERE id=?", (pid,))
-    row = cur.fetchone()
-    conn.close()
+def get_product(pid: int, if_none_match: Optional[str] = Header(None)):
+    key = ("product", pid)
+    entry = catalog.get(key)
+    if entry is None:
+        generation = catalog.generation()
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(PRODUCT_SQL, (pid,))
+            row = cur.fetchone()
     
-    if not row:
-        raise HTTPException(404, "Product not found")
-    return ProductRead(**row)
-
+        if not row:
+            raise HTTPException(404, "Product not found")
+        entry = Entry(ProductRead(**row).model_dump_json().encode(), [pid])
+        catalog.put(key, entry, generation)
+
+    return respond(entry, if_none_match)
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    events = catalog_events.start(catalog)
+    return {"catalog": catalog.stats(), "events_received": events.received}
+
+
+@app.get("/live")
+async def live_updates():
+    # Server-sent events: stock levels and sales as they commit (see live_feed.py)
+    return live_feed.get().response()
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+BULK_UPDATE_SQL = """
+    WITH changes (id, name, price, stock, category, set_category) AS (VALUES {values})
+    UPDATE products SET
+        name = COALESCE(c.name, products.name),
+        price = COALESCE(c.price, products.price),
+        stock = COALESCE(c.stock, products.stock),
+        category = CASE WHEN c.set_category = 1 THEN c.category ELSE products.category END
+    FROM changes c
+    WHERE products.id = c.id
+    RETURNING products.id
+"""
+BULK_UPDATE_ROW = ("(CAST(? AS INTEGER), CAST(? AS TEXT), CAST(? AS REAL), "
+                   "CAST(? AS INTEGER), CAST(? AS TEXT), CAST(? AS INTEGER))")
+
+
+# Declared before /products/{pid} so "bulk" is not parsed as a product id
+@app.patch("/products/bulk")
+def bulk_patch_products(changes: List[ProductChange]):
+    if len(changes) > MAX_BULK_CHANGES:
+        raise HTTPException(413, f"At most {MAX_BULK_CHANGES} changes per request.")
+
+    # Several changes for one id are merged in order, later fields winning
+    merged = {}
+    for change in changes:
+        merged.setdefault(change.id, {}).update(change.model_dump(exclude_unset=True, exclude={"id"}))
+
+    rows = [(pid, fields.get("name"), fields.get("price"), fields.get("stock"),
+             fields.get("category"), 1 if "category" in fields else 0)
+            for pid, fields in merged.items()]
+    recategorized = [row[0] for row in rows if row[5]]
+    restocked = [row[0] for row in rows if row[3] is not None]
+
+    updated = set()
+    with get_conn() as conn:
+        conn.begin()
+        cur = conn.cursor()
+        # A new stock figure replaces whatever was spread over stock shards
+        for i in range(0, len(restocked), BULK_CHUNK_ROWS):
+            chunk = restocked[i:i + BULK_CHUNK_ROWS]
+            cur.execute(f"UPDATE stock_shards SET stock = 0 WHERE product_id IN ({', '.join('?' * len(chunk))})",
+                        chunk)
+
+        # name, price and stock cannot be NULL, so None there means "leave as is"
+        for i in range(0, len(rows), BULK_CHUNK_ROWS):
+            chunk = rows[i:i + BULK_CHUNK_ROWS]
+            cur.execute(BULK_UPDATE_SQL.format(values=", ".join([BULK_UPDATE_ROW] * len(chunk))),
+                        [value for row in chunk for value in row])
+            updated.update(r["id"] for r in cur.fetchall())
+        reorder.sync_many(cur, restocked)
+
+        for i in range(0, len(recategorized), BULK_CHUNK_ROWS):
+            chunk = recategorized[i:i + BULK_CHUNK_ROWS]
+            cur.execute(f"""
+                UPDATE daily_product_sales
+                SET category = (SELECT category FROM products p
+                                WHERE p.id = daily_product_sales.product_id)
+                WHERE product_id IN ({", ".join("?" * len(chunk))})
+            """, chunk)
+
+        if len(updated) > BULK_EVENT_LIMIT:
+            publish(conn, "reset", None)
+        else:
+            for pid in updated:
+                stock = merged[pid].get("stock")
+                if "category" in merged[pid]:
+                    publish(conn, "moved", pid, merged[pid]["category"], stock=stock)
+                else:
+                    publish(conn, "changed", pid, stock=stock)
+        conn.commit()
+
+    not_found = [pid for pid in merged if pid not in updated]
+    return {
+        "message": f"{len(updated)} product(s) updated.",
+        "requested": len(changes),
+        "updated": len(updated),
+        "not_found": not_found[:MAX_BASKET_LINES],
+        "not_found_count": len(not_found),
+    }
 
-@app.put("/products/{pid}")
-def update_product(pid: int, data: ProductBase):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM products WHERE id=?", (pid,))
-    if not cur.fetchone():
-        raise HTTPException(404, "Product not found")
 
-    cur.execute("""
+def update_query(pid, data):
+    """(SQL, params) for a PUT: every field is replaced."""
+    return f"""
         UPDATE products SET name=?, price=?, stock=?, category=?
         WHERE id=?
-    """, (data.name, data.price, data.stock, data.category, pid))
+        RETURNING {PRODUCT_COLUMNS}
+    """, (data.name, data.price, data.stock, data.category, pid)
+
 
-    conn.commit()
-    cur.execute("SELECT * FROM products WHERE id=?", (pid,))
-    row = cur.fetchone()
-    conn.close()
+@app.put("/products/{pid}")
+def update_product(pid: int, data: ProductBase):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        stock_shards.reset(cur, pid)
+        cur.execute(*update_query(pid, data))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(404, "Product not found")
+
+        rollup.set_category(cur, pid, data.category)
+        reorder.sync(cur, pid)
+        publish(conn, "moved", pid, data.category, stock=row["stock"])
+        conn.commit()
     return {
         "message": f"Product with ID {pid} has been updated successfully.",
         "product": ProductRead(**row)
@@ -165,28 +526,46 @@ def update_product(pid: int, data: ProductBase):
 
     # return ProductRead(**row)
 
-@app.patch("/products/{pid}")
-def patch_product(pid: int, data: ProductUpdate):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM products WHERE id=?", (pid,))
-    row = cur.fetchone()
-    if not row:
-        raise HTTPException(404, "Product not found")
-
-    updated = dict(row)
-    payload = data.model_dump(exclude_unset=True)
-    updated.update(payload)
-
-    cur.execute("""
-        UPDATE products SET name=?, price=?, stock=?, category=?
+def patch_query(pid, data):
+    """(payload, SQL, params) for a PATCH: only the fields sent are SET.
+
+    Columns left out keep whatever is committed when the UPDATE runs, so a
+    rename can't write back a stock level that sales have moved on from.
+    name, price and stock cannot be NULL, so None there means "leave as is",
+    as in bulk_patch_products.
+    """
+    payload = {column: value for column, value in data.model_dump(exclude_unset=True).items()
+               if value is not None or column == "category"}
+    if not payload:
+        return payload, PRODUCT_SQL, [pid]
+    assignments = ", ".join(f"{column}=?" for column in payload)
+    return payload, f"""
+        UPDATE products SET {assignments}
         WHERE id=?
-    """, (updated["name"], updated["price"], updated["stock"], updated["category"], pid))
+        RETURNING {PRODUCT_COLUMNS}
+    """, [*payload.values(), pid]
+
 
-    conn.commit()
-    cur.execute("SELECT * FROM products WHERE id=?", (pid,))
-    row = cur.fetchone()
-    conn.close()
+@app.patch("/products/{pid}")
+def patch_product(pid: int, data: ProductUpdate):
+    payload, sql, params = patch_query(pid, data)
+    with get_conn() as conn:
+        cur = conn.cursor()
+        if "stock" in payload:
+            stock_shards.reset(cur, pid)
+        cur.execute(sql, params)
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(404, "Product not found")
+        if "stock" in payload:
+            reorder.sync(cur, pid)
+
+        if "category" in payload:
+            rollup.set_category(cur, pid, payload["category"])
+            publish(conn, "moved", pid, payload["category"], stock=row["stock"])
+        else:
+            publish(conn, "changed", pid, stock=row["stock"])
+        conn.commit()
     return {
         "message": f"✅ Product with ID {pid} has been partially updated successfully.",
         "product": ProductRead(**row)
@@ -194,89 +573,366 @@ def patch_product(pid: int, data: ProductUpdate):
 
     # return ProductRead(**row)
 
-@app.delete("/products/{pid}")
-def delete_product(pid: int):
-    conn = get_conn()
-    cur = conn.cursor()
+@app.put("/products/{pid}/reorder-level")
+def set_reorder_level(pid: int, data: ReorderLevel):
+    with get_conn() as conn:
+        low = reorder.set_level(conn, pid, data.reorder_level)
+    if low is None:
+        raise HTTPException(404, "Product not found")
+    return {
+        "message": f"Reorder level of product {pid} set to {data.reorder_level}.",
+        "product_id": pid,
+        "reorder_level": data.reorder_level,
+        "low_stock": low,
+    }
 
-    cur.execute("SELECT * FROM products WHERE id=?", (pid,))
-    product = cur.fetchone()
-    
-    if not product:
-        raise HTTPException(404, detail="Product not found")
+DELETE_SALES_SQL = "DELETE FROM sales WHERE product_id=?"
+DELETE_PRODUCT_SQL = "DELETE FROM products WHERE id=?"
 
-    cur.execute("DELETE FROM products WHERE id=?", (pid,))
-    conn.commit()
-    cur.execute("DELETE FROM sales WHERE product_id=?", (pid,))
-    conn.commit()
-    
-    conn.close()
-    
-    return {"message": f"Product with id {pid} and its related sales have been deleted."}
 
+@app.delete("/products/{pid}")
+def delete_product(pid: int):
+    with get_conn() as conn:
+        cur = conn.cursor()
+
+        # Sales go first so the foreign key never sees an orphan, and both
+        # deletes land in one commit; /sales/changes reports them from the log.
+        # Archived sales are logged too, and hidden until the archiver purges them
+        conn.begin()
+        sales_changes.record_product_deletion(cur, pid)
+        cur.execute(DELETE_SALES_SQL, (pid,))
+        sales_changes.record_archived_deletion(cur, sales_archive.forget_product(conn, pid))
+        rollup.forget_product(cur, pid)
+        cur.execute(DELETE_PRODUCT_SQL, (pid,))
+
+        if cur.rowcount == 0:
+            raise HTTPException(404, detail="Product not found")
+
+        publish(conn, "removed", pid)
+        conn.commit()
+    return {"message": f"Product with id {pid} and its related sales have been deleted."}
 
 
 
-@app.post("/sales")
-def create_sale(sale: SaleBase):
-    conn = get_conn()
-    cur = conn.cursor()
 
-    cur.execute("SELECT * FROM products WHERE id=?", (sale.product_id,))
+def stock_error(cur, product_id, quantity):
+    # Only reached when the guarded decrement matched no row, so the
+    # extra round trip is off the happy path
+    cur.execute(stock_shards.STOCK_SQL, (product_id,))
     product = cur.fetchone()
 
     if not product:
-        raise HTTPException(404, "Product not found")
+        return HTTPException(404, "Product not found")
 
 
     if product["stock"] == 0:
-        raise HTTPException(
+        return HTTPException(
             status_code=400,
             detail="Product is out of stock."
         )
 
-    # if product["stock"] < sale.quantity:
-        # raise HTTPException(400, "Not enough stock")
-
-    if sale.quantity > product["stock"]:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Not enough stock. Available: {product['stock']}, requested: {sale.quantity}"
-        )
-
+    return HTTPException(
+        status_code=400,
+        detail=f"Not enough stock. Available: {product['stock']}, requested: {quantity}"
+    )
 
-    total = product["price"] * sale.quantity
 
-    cur.execute("""
-        INSERT INTO sales (product_id, quantity, total_amount, sale_date)
-        VALUES (?, ?, ?, ?)
-    """, (sale.product_id, sale.quantity, total, datetime.now().isoformat()))
+INSERT_SALE_SQL = """
+    INSERT INTO sales (product_id, quantity, total_amount, sale_date)
+    VALUES (?, ?, ?, ?)
+    RETURNING *
+"""
 
-    cur.execute("""
-        UPDATE products SET stock = stock - ?
-        WHERE id = ?
-    """, (sale.quantity, sale.product_id))
 
-    conn.commit()
+@app.post("/sales")
+def create_sale(sale: SaleBase):
+    buffer = sales_buffer.get()
+    if buffer is not None:
+        # SALES_WRITE_MODE=buffered: answered once the group flush holding
+        # this sale has committed (see sales_buffer.py)
+        try:
+            row, remaining = buffer.submit(sale.product_id, sale.quantity, stock_error)
+        except (sales_buffer.FlushFailed, sales_buffer.BufferClosed) as exc:
+            raise HTTPException(503, str(exc))
+        return {
+            "message": f"✅ Transaction successful.",
+            "product": SaleRead(**row),
+            "remaining_stock": remaining
+        }
+
+    with get_conn() as conn:
+        conn.begin()
+        cur = conn.cursor()
+
+        # Check and decrement in one guarded statement: the row lock taken
+        # by the UPDATE means two tills can never both sell the last unit
+        # (sharded products guard each counter the same way)
+        product = stock_shards.take(cur, sale.product_id, sale.quantity)
+
+        if not product:
+            raise stock_error(cur, sale.product_id, sale.quantity)
+
+
+        total = product["price"] * sale.quantity
+
+        cur.execute(INSERT_SALE_SQL, (sale.product_id, sale.quantity, total, datetime.now().isoformat()))
+        row = cur.fetchone()
+
+        rollup.record_sales(cur, [
+            (row["sale_date"], sale.product_id, product["category"], sale.quantity, total)
+        ])
+        reorder.record_stock(cur, [(sale.product_id, product["stock"], product["reorder_level"])])
+        publish(conn, "changed", sale.product_id, product["category"],
+                stock=product["stock"], sold=[1, sale.quantity, total])
+        conn.commit()
 
-    sid = cur.lastrowid
-    cur.execute("SELECT * FROM sales WHERE id=?", (sid,))
-    row = cur.fetchone()
-    conn.close()
     return{
         "message": f"✅ Transaction successful.",
-        "product":SaleRead(**row)
+        "product":SaleRead(**row),
+        "remaining_stock": product["stock"]
     }
 
-@app.get("/sales")
-def list_sales():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM sales")
-    rows = cur.fetchall()
-    conn.close()
-    return [SaleRead(**row) for row in rows]
-
+@app.post("/sales/batch")
+def create_sales_batch(lines: List[SaleBase]):
+    if not lines:
+        raise HTTPException(400, "Basket is empty.")
+    if len(lines) > MAX_BASKET_LINES:
+        raise HTTPException(400, f"Basket has {len(lines)} lines, the limit is {MAX_BASKET_LINES}.")
+
+    wanted = {}
+    for line in lines:
+        wanted[line.product_id] = wanted.get(line.product_id, 0) + line.quantity
+    pids = sorted(wanted)
+
+    with get_conn() as conn:
+        conn.begin()
+        cur = conn.cursor()
+
+        # Lock in id order so two baskets sharing products cannot deadlock
+        marks = ", ".join("?" * len(pids))
+        cur.execute(
+            f"SELECT id, price, {TOTAL_STOCK} AS stock, category, shard_count, reorder_level "
+            f"FROM products WHERE id IN ({marks}) ORDER BY id"
+            + conn.backend.for_update,
+            pids,
+        )
+        products = {row["id"]: row for row in cur.fetchall()}
+
+        errors = []
+        demand = {}
+        for i, line in enumerate(lines):
+            product = products.get(line.product_id)
+            demand[line.product_id] = demand.get(line.product_id, 0) + line.quantity
+            if not product:
+                detail = "Product not found"
+            elif product["stock"] == 0:
+                detail = "Product is out of stock."
+            elif demand[line.product_id] > product["stock"]:
+                detail = (f"Not enough stock. Available: {product['stock']}, "
+                          f"requested: {demand[line.product_id]}")
+            else:
+                continue
+            errors.append({"line": i, "product_id": line.product_id, "detail": detail})
+
+        if errors:
+            raise HTTPException(
+                status_code=400,
+                detail={"message": "Basket rejected, nothing was sold.", "errors": errors}
+            )
+
+        plain = [pid for pid in pids if not products[pid]["shard_count"]]
+        remaining = {pid: products[pid]["stock"] - wanted[pid] for pid in plain}
+        if plain:
+            cases = " ".join("WHEN ? THEN ?" for _ in plain)
+            cur.execute(
+                f"UPDATE products SET stock = stock - CASE id {cases} END "
+                f"WHERE id IN ({', '.join('?' * len(plain))})",
+                [v for pid in plain for v in (pid, wanted[pid])] + plain,
+            )
+        # Sharded products are not covered by the row lock above: their
+        # counters are guarded one by one and the basket fails if one moved
+        for pid in pids:
+            if not products[pid]["shard_count"]:
+                continue
+            taken = stock_shards.take(cur, pid, wanted[pid])
+            if taken:
+                remaining[pid] = taken["stock"]
+            else:
+                raise HTTPException(
+                    status_code=400,
+                    detail={"message": "Basket rejected, nothing was sold.", "errors": [
+                        {"line": next(i for i, line in enumerate(lines) if line.product_id == pid),
+                         "product_id": pid, "detail": "Stock changed during checkout, please retry."}
+                    ]}
+                )
+
+        now = datetime.now().isoformat()
+        values = ", ".join("(?, ?, ?, ?)" for _ in lines)
+        params = []
+        for line in lines:
+            params += [line.product_id, line.quantity,
+                       products[line.product_id]["price"] * line.quantity, now]
+        cur.execute(f"""
+            INSERT INTO sales (product_id, quantity, total_amount, sale_date)
+            VALUES {values}
+            RETURNING *
+        """, params)
+        rows = sorted(cur.fetchall(), key=lambda row: row["id"])
+
+        rollup.record_sales(cur, [
+            (row["sale_date"], row["product_id"], products[row["product_id"]]["category"],
+             row["quantity"], row["total_amount"])
+            for row in rows
+        ])
+        reorder.record_stock(cur, [(pid, remaining[pid], products[pid]["reorder_level"]) for pid in pids])
+        sold = {pid: [0, 0, 0.0] for pid in pids}
+        for row in rows:
+            totals = sold[row["product_id"]]
+            totals[0] += 1
+            totals[1] += row["quantity"]
+            totals[2] += row["total_amount"]
+        for pid in pids:
+            publish(conn, "changed", pid, products[pid]["category"], stock=remaining[pid], sold=sold[pid])
+        conn.commit()
+
+    sales = [SaleRead(**row) for row in rows]
+    return {
+        "message": f"✅ Transaction successful. {len(sales)} items sold.",
+        "total_amount": sum(s.total_amount for s in sales),
+        "sales": sales
+    }
 
+def sales_query_archive(select, after, product_id, start, end, backend_name):
+    """(SQL columns, ArchiveQuery) for a GET /sales read; archived months are merged in by id."""
+    select = list(select or sales_archive.COLUMNS)
+    if "id" not in select:
+        select.insert(0, "id")
+    return select, sales_archive.ArchiveQuery(select, after=after, product_id=product_id, start=start,
+                                              end=end, text_dates=backend_name == "sqlite")
 
 
+@app.get("/sales")
+def list_sales(response: Response,
+               limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+               after: Optional[int] = None,
+               stream: bool = False,
+               product_id: Optional[int] = None,
+               start: Optional[date] = None,
+               end: Optional[date] = None,
+               fmt: str = Query("json", alias="format", pattern=FORMAT_PATTERN),
+               columns: Optional[str] = None):
+    names, select = columnar_columns("sales", fmt, columns, limit)
+    select, archive = sales_query_archive(select or fast_json.columns(SaleRead), after, product_id,
+                                          start, end, get_pool().backend.name)
+    sql, params = keyset_query("sales", {"product_id": product_id}, after, limit, select,
+                               date_range("sale_date", start, end))
+
+    if names:
+        return columnar_response("sales", fmt, names, sql, params, limit, archive)
+    if stream:
+        return stream_ndjson(sql, params, SaleRead, archive)
+    return fetch_page(response, sql, params, limit, SaleRead, archive)
+
+
+@app.get("/sales/changes")
+def sales_changes_since(since: str = "0", limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    # Delta sync: pass back "next" as since= until "more" is false
+    try:
+        cursor = sales_changes.parse_since(since)
+    except ValueError:
+        raise HTTPException(400, "since must be a cursor from a previous response, a sale id "
+                                 "or an ISO timestamp.")
+
+    with get_conn() as conn:
+        delta = sales_changes.changes(conn, cursor, limit)
+
+    if fast_json.ENABLED:
+        return Response(content=fast_json.dumps(delta), media_type="application/json")
+    delta["sales"] = [SaleRead(**row) for row in delta["sales"]]
+    return delta
+
+
+
+
+def sales_filters(category, start, end):
+    # Filters shared by the analytics endpoints; they read the daily rollup,
+    # so the cost is days x products rather than the number of sales
+    clauses, params = [], []
+    if category:
+        clauses.append("r.category=?")
+        params.append(category)
+    if start:
+        clauses.append("r.day >= ?")
+        params.append(start.isoformat())
+    if end:
+        clauses.append("r.day <= ?")
+        params.append(end.isoformat())
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    return where, params
+
+
+def summary_query(category, start, end):
+    where, params = sales_filters(category, start, end)
+    return f"""
+        SELECT COALESCE(SUM(r.total_amount), 0) AS total_sales,
+               COALESCE(SUM(r.quantity), 0) AS total_quantity,
+               COALESCE(SUM(r.sale_count), 0) AS sale_count
+        FROM daily_product_sales r
+        {where}
+    """, params
+
+
+@app.get("/analytics/summary")
+def analytics_summary(category: Optional[str] = None,
+                      start: Optional[date] = None,
+                      end: Optional[date] = None):
+    with get_conn() as conn:
+        totals = conn.execute(*summary_query(category, start, end)).fetchone()
+
+        if category:
+            category_rows = conn.execute("""
+                SELECT COUNT(*) AS total_products, COUNT(DISTINCT category) AS total_categories
+                FROM products WHERE category=?
+            """, (category,)).fetchone()
+        else:
+            category_rows = conn.execute("""
+                SELECT COUNT(*) AS total_products, COUNT(DISTINCT category) AS total_categories
+                FROM products
+            """).fetchone()
+
+    return SalesSummary(**totals, **category_rows)
+
+
+def sales_by_product_query(top, category, start, end):
+    where, params = sales_filters(category, start, end)
+    # Everything past the top N products is folded into one "Others" row
+    cutoff = top or 2**31 - 1
+    return f"""
+        WITH ranked AS (
+            SELECT r.product_id, p.name,
+                   SUM(r.total_amount) AS total_amount,
+                   SUM(r.quantity) AS quantity,
+                   ROW_NUMBER() OVER (ORDER BY SUM(r.total_amount) DESC, r.product_id) AS sales_rank
+            FROM daily_product_sales r JOIN products p ON p.id = r.product_id
+            {where}
+            GROUP BY r.product_id, p.name
+        )
+        SELECT CASE WHEN sales_rank <= ? THEN product_id END AS product_id,
+               CASE WHEN sales_rank <= ? THEN name ELSE 'Others' END AS name,
+               SUM(total_amount) AS total_amount,
+               SUM(quantity) AS quantity
+        FROM ranked
+        GROUP BY 1, 2
+        ORDER BY MIN(sales_rank)
+    """, params + [cutoff, cutoff]
+
+
+@app.get("/analytics/sales-by-product")
+def analytics_sales_by_product(top: Optional[int] = Query(None, ge=1),
+                               category: Optional[str] = None,
+                               start: Optional[date] = None,
+                               end: Optional[date] = None):
+    with get_conn() as conn:
+        rows = conn.execute(*sales_by_product_query(top, category, start, end)).fetchall()
+
+    return [ProductSales(**row) for row in rows]
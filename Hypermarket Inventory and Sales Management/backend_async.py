@@ -0,0 +1,343 @@
+# async def version of the API
+#
+# The product CRUD, create_sale and the list endpoints run on an asyncio
+# driver (asyncpg / aiosqlite, see async_storage.py) so a slow query parks a
+# coroutine instead of one of the threadpool's workers. Every other route is
+# shared with backend.py unchanged. Pick the version with API_MODE:
+#
+#   uvicorn asgi:app                     # sync, same as backend:app
+#   API_MODE=async uvicorn asgi:app      # this module
+
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import List, Optional
+
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+import backend
+from backend import (
+    DELETE_PRODUCT_SQL, DELETE_SALES_SQL, FORMAT_PATTERN, INSERT_PRODUCT_SQL, INSERT_SALE_SQL,
+    MAX_PAGE_SIZE, PRODUCT_SQL, STREAM_CHUNK_SIZE, ProductBase, ProductRead, ProductUpdate, SaleBase,
+    SaleRead, columnar_columns, date_range, keyset_query, ndjson_lines, page_response, patch_query,
+    product_list_entry, sales_query_archive, update_query,
+)
+from async_storage import get_conn, get_pool
+from catalog_cache import catalog, Entry, respond
+from catalog_events import publish_async
+import fast_json
+import metrics
+import reorder
+import rollup
+import sales_archive
+import sales_buffer
+import sales_changes
+import startup
+import stock_shards
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await startup.run(async_pool=get_pool())
+    yield
+    await startup.stop()
+    await get_pool().close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+# The statements come from reorder.py, as in reorder.record_stock / sync
+
+async def record_stock(conn, product_id, stock, reorder_level):
+    rows = reorder.added_rows([(product_id, stock, reorder_level)], reorder.now())
+    if rows:
+        await conn.executemany(reorder.ADD_SQL, rows)
+
+
+async def sync_low_stock(conn, product_id):
+    for sql, params in reorder.sync_statements(product_id):
+        await conn.execute(sql, params)
+
+
+
+
+@app.post("/products")
+async def create_product(product: ProductBase):
+    async with get_conn() as conn:
+        row = await conn.fetchone(INSERT_PRODUCT_SQL,
+                                  (product.name, product.price, product.stock, product.category))
+        await record_stock(conn, row["id"], row["stock"], row["reorder_level"])
+        await publish_async(conn, "added", row["id"], row["category"], stock=row["stock"])
+        await conn.commit()
+
+    return {
+        "message": "Product created successfully.",
+        "product": ProductRead(**row)
+    }
+
+
+async def archive_page(conn, rows, limit, archive):
+    if archive is None:
+        return rows
+    manifest = await sales_archive.load_manifest_async(conn)
+    if not archive.entries(manifest):
+        return rows
+    # Parquet is read on a worker thread
+    return await run_in_threadpool(archive.page, manifest, rows, limit)
+
+
+def archive_chunks(conn, chunks, archive):
+    if archive is None:
+        return chunks
+    return archive.stream_async(lambda: sales_archive.load_manifest_async(conn), chunks, STREAM_CHUNK_SIZE)
+
+
+async def fetch_page(response, sql, params, limit, model, archive=None):
+    async with get_conn() as conn:
+        rows = await archive_page(conn, await conn.fetchall(sql, params), limit, archive)
+    return page_response(response, rows, limit, model)
+
+
+def stream_ndjson(sql, params, model, archive=None):
+    async def body():
+        async with get_conn() as conn:
+            async for rows in archive_chunks(conn, conn.stream(sql, params, STREAM_CHUNK_SIZE), archive):
+                yield ndjson_lines(rows, model)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+async def columnar_response(table, fmt, names, sql, params, limit, archive=None):
+    import arrow_export
+
+    schema = arrow_export.schema(table, names)
+    media_type = arrow_export.MEDIA_TYPES[fmt]
+
+    if limit is not None:
+        async with get_conn() as conn:
+            rows = await archive_page(conn, await conn.fetchall(sql, params), limit, archive)
+        headers = {}
+        if len(rows) == limit:
+            headers["X-Next-After"] = str(rows[-1]["id"])
+        body = b"".join(arrow_export.encode(fmt, schema, [rows]))
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    async def body():
+        async with get_conn() as conn:
+            chunks = archive_chunks(conn, conn.stream(sql, params, STREAM_CHUNK_SIZE), archive)
+            async for data in arrow_export.encode_async(fmt, schema, chunks):
+                yield data
+
+    return StreamingResponse(body(), media_type=media_type)
+
+
+@app.get("/products")
+async def list_products(response: Response,
+                        category: Optional[str] = Query(None, alias="category"),
+                        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                        after: Optional[int] = None,
+                        stream: bool = False,
+                        fmt: str = Query("json", alias="format", pattern=FORMAT_PATTERN),
+                        columns: Optional[str] = None,
+                        if_none_match: Optional[str] = Header(None)):
+    category = category or None
+    names, select = columnar_columns("products", fmt, columns, limit)
+    sql, params = keyset_query("products", {"category": category}, after, limit,
+                               select or fast_json.columns(ProductRead))
+
+    if names:
+        return await columnar_response("products", fmt, names, sql, params, limit)
+    if stream:
+        return stream_ndjson(sql, params, ProductRead)
+
+    key = ("list", category, after, limit)
+    entry = catalog.get(key)
+    if entry is None:
+        generation = catalog.generation()
+        async with get_conn() as conn:
+            rows = await conn.fetchall(sql, params)
+
+        entry = product_list_entry(rows, category, limit)
+        catalog.put(key, entry, generation)
+
+    return respond(entry, if_none_match)
+
+
+@app.get("/products/{pid}")
+async def get_product(pid: int, if_none_match: Optional[str] = Header(None)):
+    key = ("product", pid)
+    entry = catalog.get(key)
+    if entry is None:
+        generation = catalog.generation()
+        async with get_conn() as conn:
+            row = await conn.fetchone(PRODUCT_SQL, (pid,))
+
+        if not row:
+            raise HTTPException(404, "Product not found")
+        entry = Entry(ProductRead(**row).model_dump_json().encode(), [pid])
+        catalog.put(key, entry, generation)
+
+    return respond(entry, if_none_match)
+
+
+@app.put("/products/{pid}")
+async def update_product(pid: int, data: ProductBase):
+    async with get_conn() as conn:
+        await conn.execute(stock_shards.RESET_SQL, (pid,))
+        row = await conn.fetchone(*update_query(pid, data))
+        if not row:
+            raise HTTPException(404, "Product not found")
+
+        await conn.execute(rollup.SET_CATEGORY_SQL, rollup.set_category_params(pid, data.category))
+        await sync_low_stock(conn, pid)
+        await publish_async(conn, "moved", pid, data.category, stock=row["stock"])
+        await conn.commit()
+    return {
+        "message": f"Product with ID {pid} has been updated successfully.",
+        "product": ProductRead(**row)
+    }
+
+
+@app.patch("/products/{pid}")
+async def patch_product(pid: int, data: ProductUpdate):
+    payload, sql, params = patch_query(pid, data)
+    async with get_conn() as conn:
+        if "stock" in payload:
+            await conn.execute(stock_shards.RESET_SQL, (pid,))
+        row = await conn.fetchone(sql, params)
+        if not row:
+            raise HTTPException(404, "Product not found")
+        if "stock" in payload:
+            await sync_low_stock(conn, pid)
+
+        if "category" in payload:
+            category = payload["category"]
+            await conn.execute(rollup.SET_CATEGORY_SQL, rollup.set_category_params(pid, category))
+            await publish_async(conn, "moved", pid, category, stock=row["stock"])
+        else:
+            await publish_async(conn, "changed", pid, stock=row["stock"])
+        await conn.commit()
+    return {
+        "message": f"✅ Product with ID {pid} has been partially updated successfully.",
+        "product": ProductRead(**row)
+    }
+
+
+@app.delete("/products/{pid}")
+async def delete_product(pid: int):
+    async with get_conn() as conn:
+        await conn.begin()
+        deleted_at = conn.backend.timestamp(datetime.now())
+        await conn.execute(sales_changes.RECORD_SQL, (deleted_at, pid))
+        await conn.execute(DELETE_SALES_SQL, (pid,))
+        archived = await sales_archive.forget_product_async(conn, pid, deleted_at)
+        if archived:
+            await conn.executemany(sales_changes.RECORD_ARCHIVED_SQL,
+                                   sales_changes.archived_deletion_rows(archived, deleted_at))
+        await conn.execute(rollup.FORGET_SQL, (pid,))
+        if await conn.execute(DELETE_PRODUCT_SQL, (pid,)) == 0:
+            raise HTTPException(404, detail="Product not found")
+
+        await publish_async(conn, "removed", pid)
+        await conn.commit()
+
+    return {"message": f"Product with id {pid} and its related sales have been deleted."}
+
+
+
+
+async def stock_error(conn, product_id, quantity):
+    product = await conn.fetchone(stock_shards.STOCK_SQL, (product_id,))
+
+    if not product:
+        return HTTPException(404, "Product not found")
+    if product["stock"] == 0:
+        return HTTPException(status_code=400, detail="Product is out of stock.")
+    return HTTPException(
+        status_code=400,
+        detail=f"Not enough stock. Available: {product['stock']}, requested: {quantity}"
+    )
+
+
+@app.post("/sales")
+async def create_sale(sale: SaleBase):
+    if sales_buffer.enabled():
+        # The group-commit buffer owns its own sync writer connection
+        return await run_in_threadpool(backend.create_sale, sale)
+
+    async with get_conn() as conn:
+        await conn.begin()
+
+        product = await conn.fetchone(stock_shards.TAKE_SQL,
+                                      stock_shards.take_params(sale.product_id, sale.quantity))
+
+        if product:
+            return await record_sale(conn, sale, product)
+        sharding = await conn.fetchone(stock_shards.SHARDING_SQL, (sale.product_id,))
+        if not sharding or not sharding["shard_count"]:
+            raise await stock_error(conn, sale.product_id, sale.quantity)
+
+    # Hot products with sharded stock go through the sync handler
+    return await run_in_threadpool(backend.create_sale, sale)
+
+
+async def record_sale(conn, sale, product):
+    total = product["price"] * sale.quantity
+
+    row = await conn.fetchone(INSERT_SALE_SQL, (sale.product_id, sale.quantity, total,
+                                                conn.backend.timestamp(datetime.now())))
+
+    await conn.executemany(rollup.RECORD_SQL, rollup.rollup_rows([
+        (row["sale_date"], sale.product_id, product["category"], sale.quantity, total)
+    ]))
+    await record_stock(conn, sale.product_id, product["stock"], product["reorder_level"])
+    await publish_async(conn, "changed", sale.product_id, product["category"],
+                        stock=product["stock"], sold=[1, sale.quantity, total])
+    await conn.commit()
+
+    return {
+        "message": f"✅ Transaction successful.",
+        "product": SaleRead(**row),
+        "remaining_stock": product["stock"]
+    }
+
+
+@app.get("/sales")
+async def list_sales(response: Response,
+                     limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                     after: Optional[int] = None,
+                     stream: bool = False,
+                     product_id: Optional[int] = None,
+                     start: Optional[date] = None,
+                     end: Optional[date] = None,
+                     fmt: str = Query("json", alias="format", pattern=FORMAT_PATTERN),
+                     columns: Optional[str] = None):
+    names, select = columnar_columns("sales", fmt, columns, limit)
+    select, archive = sales_query_archive(select or fast_json.columns(SaleRead), after, product_id,
+                                          start, end, get_pool().backend.name)
+    sql, params = keyset_query("sales", {"product_id": product_id}, after, limit, select,
+                               date_range("sale_date", start, end))
+
+    if names:
+        return await columnar_response("sales", fmt, names, sql, params, limit, archive)
+    if stream:
+        return stream_ndjson(sql, params, SaleRead, archive)
+    return await fetch_page(response, sql, params, limit, SaleRead, archive)
+
+
+# Everything not converted above (basket checkout, bulk edits, analytics,
+# cache stats) is served by the sync handlers from backend.py. They go first
+# so fixed paths like /products/bulk win over /products/{pid}.
+_async_routes = {(route.path, method) for route in app.routes
+                 for method in getattr(route, "methods", None) or ()}
+_shared = []
+for route in backend.app.routes:
+    methods = getattr(route, "methods", None) or ()
+    if route.path.startswith(("/docs", "/redoc", "/openapi")):
+        continue
+    if not any((route.path, method) in _async_routes for method in methods):
+        _shared.append(route)
+app.router.routes[:0] = _shared
@@ -0,0 +1,156 @@
+# Side-by-side benchmark of the sync and async API
+#
+#   python bench_async.py                          # 50, 500 and 5000 clients
+#   python bench_async.py --clients 50 200 --duration 5
+#   python bench_async.py --database-url postgresql://...   # throwaway DB only!
+#
+# For each API_MODE a uvicorn server is started on a scratch copy of the
+# database, then N concurrent clients run a read-heavy mix (product lookups,
+# a page of sales, a sale) for a fixed time. Reports throughput and p50/p99
+# latency per mode and concurrency level.
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def client(http, deadline, product_ids, latencies, errors):
+    while time.perf_counter() < deadline:
+        roll = random.random()
+        pid = random.choice(product_ids)
+        start = time.perf_counter()
+        try:
+            if roll < 0.6:
+                resp = await http.get(f"/products/{pid}")
+            elif roll < 0.9:
+                resp = await http.get("/sales", params={"limit": 50})
+            else:
+                resp = await http.post("/sales", json={"product_id": pid, "quantity": 1})
+            if resp.status_code >= 500:
+                errors.append(resp.status_code)
+        except httpx.HTTPError as exc:
+            errors.append(type(exc).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def drive(base_url, clients, duration, product_ids):
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+        latencies, errors = [], []
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http, deadline, product_ids, latencies, errors)
+                               for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "errors": len(errors),
+    }
+
+
+def seed(url, products):
+    import storage
+    from migrations import migrate
+
+    pool = storage.ConnectionPool(storage.backend_from_url(url), size=1)
+    with pool.connection() as conn:
+        migrate(conn)
+        conn.executemany(
+            "INSERT INTO products (name, price, stock, category) VALUES (?, ?, ?, ?)",
+            [(f"bench-{i}", 1.0 + i % 50, 10**9, f"cat-{i % 20}") for i in range(products)],
+        )
+        conn.commit()
+        ids = [row["id"] for row in
+               conn.execute("SELECT id FROM products WHERE name LIKE 'bench-%'").fetchall()]
+    pool.close()
+    return ids
+
+
+def wait_until_up(base_url, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if httpx.get(f"{base_url}/cache/stats", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError("uvicorn did not come up in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API_MODE=sync against API_MODE=async")
+    parser.add_argument("--clients", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--pool-size", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    if args.database_url:
+        url = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        if os.path.exists(os.path.join(HERE, "restaurant.db")):
+            shutil.copy(os.path.join(HERE, "restaurant.db"), path)
+        url = "sqlite:///" + path
+    product_ids = seed(url, args.products)
+
+    results = []
+    for mode in ("sync", "async"):
+        env = dict(os.environ, DATABASE_URL=url, API_MODE=mode, DB_POOL_SIZE=str(args.pool_size))
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(args.port),
+             "--log-level", "warning", "--backlog", "8192"],
+            cwd=HERE, env=env,
+        )
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            wait_until_up(base_url, proc)
+            for clients in args.clients:
+                result = asyncio.run(drive(base_url, clients, args.duration, product_ids))
+                results.append((mode, clients, result))
+                print(f"{mode:>5} {clients:>5} clients: {result['rps']:9.0f} req/s  "
+                      f"p50 {result['p50_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+                      f"errors {result['errors']}")
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    print()
+    print(f"{'clients':>7} {'sync req/s':>11} {'async req/s':>12} {'sync p99':>10} {'async p99':>10}")
+    by_key = {(mode, clients): r for mode, clients, r in results}
+    for clients in args.clients:
+        s, a = by_key[("sync", clients)], by_key[("async", clients)]
+        print(f"{clients:>7} {s['rps']:>11.0f} {a['rps']:>12.0f} "
+              f"{s['p99_ms']:>8.1f}ms {a['p99_ms']:>8.1f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
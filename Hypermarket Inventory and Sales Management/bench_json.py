@@ -0,0 +1,97 @@
+# Microbenchmark: list responses through pydantic models vs fast_json
+#
+#   python bench_json.py                          # 1k, 100k and 1M rows
+#   python bench_json.py --rows 1000 50000 --repeat 5
+#
+# Encodes synthetic pages shaped like the GET /products and GET /sales
+# queries (row dicts in the models' field order) two ways:
+#
+#   models  ProductRead per row + TypeAdapter.dump_json (the catalog cache
+#           path), SaleRead per row + jsonable_encoder + JSONResponse (what
+#           FastAPI does with a returned list of models)
+#   fast    fast_json.dumps on the rows as they come from the driver
+#
+# and reports the best time of --repeat runs, the speed-up, and whether both
+# produced the same bytes. No database is needed.
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SIZES = (1000, 100000, 1000000)
+
+
+def product_rows(n, rng):
+    return [{"name": f"product {i}", "price": round(rng.uniform(0.5, 200), 2),
+             "stock": rng.randrange(0, 500), "category": rng.choice(["fruit", "dairy", "bakery", None]),
+             "id": i + 1} for i in range(n)]
+
+
+def sale_rows(n, rng):
+    start = datetime(2025, 1, 1)
+    # SQLite hands sale_date back as ISO-8601 text
+    return [{"id": i + 1, "product_id": rng.randrange(1, 5000), "quantity": rng.randrange(1, 10),
+             "total_amount": round(rng.uniform(0.5, 500), 2),
+             "sale_date": (start + timedelta(seconds=i * 37, microseconds=rng.randrange(10**6))).isoformat()}
+            for i in range(n)]
+
+
+def best_of(repeat, fn):
+    best, result = None, None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark list response serialization")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    import fast_json
+    from backend import ProductRead, SaleRead, product_list_json
+
+    if fast_json.orjson is None:
+        print("orjson is not installed; pip install orjson")
+        return 1
+
+    encoders = {
+        "products": (product_rows, lambda rows: product_list_json.dump_json(
+            [ProductRead(**row) for row in rows])),
+        "sales": (sale_rows, lambda rows: JSONResponse(jsonable_encoder(
+            [SaleRead(**row) for row in rows])).body),
+    }
+
+    print(f"{'rows':>9}  {'endpoint':<9} {'models ms':>10} {'fast ms':>9} {'speed-up':>9}  output")
+    same = True
+    for n in args.rows:
+        for endpoint, (make_rows, via_models) in encoders.items():
+            rows = make_rows(n, random.Random(args.seed))
+            slow, expected = best_of(args.repeat, lambda: via_models(rows))
+            fast, body = best_of(args.repeat, lambda: fast_json.dumps(rows))
+            identical = body == expected
+            same = same and identical
+            print(f"{n:>9}  {endpoint:<9} {slow * 1000:>10.1f} {fast * 1000:>9.1f} "
+                  f"{slow / max(fast, 1e-9):>8.1f}x  {'identical' if identical else 'DIFFERS'}")
+            del rows, expected, body
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# Throughput of POST /sales with and without the group-commit buffer
+#
+#   python bench_sales_buffer.py                        # scratch SQLite file
+#   python bench_sales_buffer.py --workers 32 --duration 10 --flush-ms 2
+#   python bench_sales_buffer.py --database-url postgresql://...   # throwaway DB only!
+#
+# Runs the create_sale handler from a thread pool for a fixed time, first
+# with SALES_WRITE_MODE=sync (one commit per sale) and then buffered (one
+# commit per flush), and reports sales/s and p50/p99 latency for each. The
+# run ends by checking that every unit of stock sold has a committed sale.
+#
+# SQLite runs with synchronous=NORMAL, so commits there are cheaper than a
+# real fsync; the gap is larger on Postgres or a synchronous=FULL disk.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STOCK = 10**9
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(mode, args, product_ids):
+    import backend
+    import sales_buffer
+
+    sales_buffer.WRITE_MODE = mode
+    sales_buffer.FLUSH_ROWS = args.flush_rows
+    sales_buffer.FLUSH_MS = args.flush_ms
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(n):
+        done, mine = 0, []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                backend.create_sale(backend.SaleBase(
+                    product_id=product_ids[(n + done) % len(product_ids)], quantity=1))
+            except Exception as exc:
+                with lock:
+                    errors.append(repr(exc))
+                continue
+            mine.append(time.perf_counter() - start)
+            done += 1
+        with lock:
+            latencies.extend(mine)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.workers) as pool:
+        list(pool.map(worker, range(args.workers)))
+    elapsed = time.perf_counter() - start
+    stats = sales_buffer.get().stats() if mode == "buffered" else None
+    sales_buffer.stop()
+
+    latencies.sort()
+    return {
+        "sales": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "errors": len(errors),
+        "flushes": stats["flushes"] if stats else len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync vs buffered sale ingestion")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per mode")
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--flush-rows", type=int, default=500)
+    parser.add_argument("--flush-ms", type=float, default=0)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        if os.path.exists(os.path.join(HERE, "restaurant.db")):
+            shutil.copy(os.path.join(HERE, "restaurant.db"), path)
+        os.environ["DATABASE_URL"] = "sqlite:///" + path
+    os.environ.setdefault("DB_POOL_SIZE", str(args.workers))
+
+    sys.path.insert(0, HERE)
+    import backend
+    from storage import get_conn
+
+    backend.init_db()
+    with get_conn() as conn:
+        ids = [conn.execute("""
+            INSERT INTO products (name, price, stock, category) VALUES (?, ?, ?, ?) RETURNING id
+        """, (f"bench-buffer-{i}", 1.0, STOCK, "bench")).fetchone()["id"]
+            for i in range(args.products)]
+        conn.commit()
+
+    results = {}
+    for mode in ("sync", "buffered"):
+        results[mode] = r = run(mode, args, ids)
+        print(f"{mode:>8}: {r['rps']:8.0f} sales/s  p50 {r['p50_ms']:6.2f} ms  "
+              f"p99 {r['p99_ms']:6.2f} ms  commits {r['flushes']:>7}  errors {r['errors']}")
+    print(f"speed-up: {results['buffered']['rps'] / max(results['sync']['rps'], 1e-9):.1f}x")
+
+    marks = ", ".join("?" * len(ids))
+    with get_conn() as conn:
+        sold = conn.execute(f"SELECT SUM(?) - SUM(stock) AS n FROM products WHERE id IN ({marks})",
+                            [STOCK] + ids).fetchone()["n"]
+        rows = conn.execute(f"SELECT COALESCE(SUM(quantity), 0) AS n FROM sales "
+                            f"WHERE product_id IN ({marks})", ids).fetchone()["n"]
+    ok = sold == rows == results["sync"]["sales"] + results["buffered"]["sales"]
+    print(f"stock sold {sold}, sale rows {rows}: {'consistent' if ok else 'MISMATCH'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
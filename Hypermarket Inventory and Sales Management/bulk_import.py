@@ -0,0 +1,208 @@
+# Bulk catalog import: CSV or Parquet -> staging table -> products
+#
+#   python bulk_import.py supplier.csv
+#   python bulk_import.py supplier.parquet --batch-size 20000
+#
+# Rows are validated against ProductBase as they are read and copied into a
+# temporary staging table in fixed-size batches (COPY on Postgres,
+# executemany on SQLite), so memory stays flat whatever the file size. One
+# upsert then moves the staged rows into products: rows with an id replace
+# that product, rows without one are added as new products. The whole
+# import is a single transaction.
+
+import argparse
+import csv
+import io
+import sys
+
+from pydantic import ValidationError
+
+from catalog_events import publish
+import reorder
+
+
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+COLUMNS = ("line", "id", "name", "price", "stock", "category")
+
+
+def iter_csv(binary):
+    text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+    for line, record in enumerate(csv.DictReader(text), start=2):
+        yield line, record
+
+
+def iter_parquet(binary, batch_size=BATCH_SIZE):
+    import pyarrow.parquet as pq
+
+    line = 0
+    for batch in pq.ParquetFile(binary).iter_batches(batch_size=batch_size):
+        for record in batch.to_pylist():
+            line += 1
+            yield line, record
+
+
+def iter_records(binary, fmt):
+    if fmt == "csv":
+        return iter_csv(binary)
+    if fmt == "parquet":
+        return iter_parquet(binary)
+    raise ValueError(f"Unsupported import format {fmt!r}; use csv or parquet")
+
+
+def _blank_to_none(value):
+    return None if value is None or (isinstance(value, str) and not value.strip()) else value
+
+
+def validate(line, record, model):
+    """Return a staging row for a valid record, or raise ValidationError / ValueError."""
+    pid = _blank_to_none(record.get("id"))
+    if pid is not None:
+        try:
+            pid = int(pid)
+        except (TypeError, ValueError):
+            raise ValueError(f"id must be an integer, got {record.get('id')!r}")
+    product = model(
+        name=record.get("name"),
+        price=record.get("price"),
+        stock=record.get("stock"),
+        category=_blank_to_none(record.get("category")),
+    )
+    return (line, pid, product.name, product.price, product.stock, product.category)
+
+
+def _stage(conn, rows):
+    if conn.backend.name == "postgres":
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        buf.seek(0)
+        with conn.raw.cursor() as cur:
+            cur.copy_expert(
+                f"COPY products_import ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf
+            )
+    else:
+        conn.executemany(
+            f"INSERT INTO products_import ({', '.join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+
+
+def import_products(conn, records, model, batch_size=BATCH_SIZE):
+    """Validate, stage and upsert (line, record) pairs; returns a summary dict."""
+    conn.begin()
+    if conn.backend.name != "postgres":
+        conn.execute("DROP TABLE IF EXISTS temp.products_import")
+    conn.execute(f"""
+        CREATE TEMP TABLE products_import (
+            line INTEGER, id INTEGER, name TEXT, price REAL, stock INTEGER, category TEXT
+        ){" ON COMMIT DROP" if conn.backend.name == "postgres" else ""}
+    """)
+
+    errors, rejected, staged, batch = [], 0, 0, []
+    for line, record in records:
+        try:
+            batch.append(validate(line, record, model))
+        except (ValidationError, ValueError) as exc:
+            rejected += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                detail = ([f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors()]
+                          if isinstance(exc, ValidationError) else [str(exc)])
+                errors.append({"line": line, "errors": detail})
+            continue
+        if len(batch) >= batch_size:
+            _stage(conn, batch)
+            staged += len(batch)
+            batch = []
+    if batch:
+        _stage(conn, batch)
+        staged += len(batch)
+
+    # Several rows for the same id: the last one in the file wins
+    keyed = """
+        SELECT * FROM products_import
+        WHERE line IN (SELECT MAX(line) FROM products_import WHERE id IS NOT NULL GROUP BY id)
+    """
+    updated = conn.execute(
+        f"SELECT COUNT(*) AS n FROM ({keyed}) i JOIN products p ON p.id = i.id"
+    ).fetchone()["n"]
+    counts = conn.execute("""
+        SELECT COUNT(DISTINCT id) AS keyed, COUNT(*) - COUNT(id) AS unkeyed
+        FROM products_import
+    """).fetchone()
+
+    conn.execute(f"""
+        INSERT INTO products (id, name, price, stock, category)
+        SELECT id, name, price, stock, category FROM ({keyed}) i WHERE true
+        ON CONFLICT (id) DO UPDATE SET
+            name = excluded.name,
+            price = excluded.price,
+            stock = excluded.stock,
+            category = excluded.category
+    """)
+    imported = [row["id"] for row in conn.execute(
+        "SELECT DISTINCT id FROM products_import WHERE id IS NOT NULL").fetchall()]
+    imported += [row["id"] for row in conn.execute("""
+        INSERT INTO products (name, price, stock, category)
+        SELECT name, price, stock, category FROM products_import
+        WHERE id IS NULL ORDER BY line
+        RETURNING id
+    """).fetchall()]
+    conn.execute("""
+        UPDATE stock_shards SET stock = 0
+        WHERE product_id IN (SELECT id FROM products_import WHERE id IS NOT NULL)
+    """)
+    conn.execute("""
+        UPDATE daily_product_sales
+        SET category = (SELECT category FROM products p WHERE p.id = daily_product_sales.product_id)
+        WHERE product_id IN (SELECT id FROM products_import WHERE id IS NOT NULL)
+    """)
+    if conn.backend.name == "postgres":
+        # Explicit ids bypass the SERIAL sequence; move it past them
+        conn.execute("""
+            SELECT setval(pg_get_serial_sequence('products', 'id'),
+                          GREATEST((SELECT MAX(id) FROM products), 1))
+        """)
+    else:
+        conn.execute("DROP TABLE temp.products_import")
+    # Only the imported products can have crossed their reorder level
+    reorder.sync_many(conn.cursor(), imported)
+
+    # Too many products may have changed to invalidate them one by one
+    publish(conn, "reset", None)
+    conn.commit()
+
+    return {
+        "rows_read": staged + rejected,
+        "inserted": counts["keyed"] - updated + counts["unkeyed"],
+        "updated": updated,
+        "superseded": staged - counts["keyed"] - counts["unkeyed"],
+        "rejected": rejected,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import products from CSV or Parquet")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "parquet"], default=None,
+                        help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or ("parquet" if args.path.endswith(".parquet") else "csv")
+
+    from backend import ProductBase, init_db
+    from storage import get_conn
+
+    init_db()
+    with open(args.path, "rb") as f, get_conn() as conn:
+        summary = import_products(conn, iter_records(f, fmt), ProductBase, args.batch_size)
+
+    for error in summary["errors"]:
+        print(f"line {error['line']}: {'; '.join(error['errors'])}")
+    print(f"read {summary['rows_read']}, inserted {summary['inserted']}, "
+          f"updated {summary['updated']}, rejected {summary['rejected']}")
+    return 1 if summary["rejected"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
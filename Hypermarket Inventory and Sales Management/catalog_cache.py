@@ -0,0 +1,155 @@
+# In-process read cache for the product catalog
+#
+# get_product and list_products store their encoded JSON here, keyed by
+# ("product", id) and ("list", category, after, limit). Every handler that
+# writes to products invalidates exactly the entries it could have changed:
+# the product itself, every cached list that contains it, and (when list
+# membership can change) the lists for its category and the full catalog.
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from fastapi import Response
+
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "10000"))
+
+
+class Entry:
+    __slots__ = ("body", "etag", "headers", "members", "category")
+
+    def __init__(self, body, members, category=None, headers=None):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.headers = headers or {}
+        self.members = frozenset(members)
+        self.category = category
+
+
+class CatalogCache:
+    def __init__(self, max_entries=CATALOG_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_product = {}   # product id -> keys of entries that include it
+        self._by_category = {}  # category (None = whole catalog) -> list keys
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self):
+        # Taken before a DB read; put() refuses the result if any write
+        # invalidated the cache in between, so a slow read can't resurrect
+        # stale data
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry, generation):
+        with self._lock:
+            if generation != self._generation or self.max_entries <= 0:
+                return
+            self._drop(key)
+            self._entries[key] = entry
+            for pid in entry.members:
+                self._by_product.setdefault(pid, set()).add(key)
+            if key[0] == "list":
+                self._by_category.setdefault(entry.category, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for pid in entry.members:
+            keys = self._by_product.get(pid)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_product[pid]
+        if key[0] == "list":
+            keys = self._by_category.get(entry.category)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_category[entry.category]
+
+    def _invalidate(self, pid, categories=(), added=False):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            keys = set(self._by_product.get(pid, ()))
+            keys.add(("product", pid))
+            for category in categories:
+                keys |= self._by_category.get(category, set())
+            if added:
+                keys |= self._by_category.get(None, set())
+            for key in keys:
+                self._drop(key)
+
+    def product_changed(self, pid):
+        """Fields such as price or stock changed; list membership did not."""
+        self._invalidate(pid)
+
+    def product_moved(self, pid, category):
+        """The product may now belong to `category` (PUT/PATCH)."""
+        self._invalidate(pid, categories=(category,))
+
+    def product_added(self, pid, category):
+        self._invalidate(pid, categories=(category,), added=True)
+
+    def product_removed(self, pid):
+        self._invalidate(pid)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_product.clear()
+            self._by_category.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in tags or "W/" + etag in tags
+
+
+def respond(entry, if_none_match=None):
+    headers = {"ETag": entry.etag, **entry.headers}
+    if etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+catalog = CatalogCache()
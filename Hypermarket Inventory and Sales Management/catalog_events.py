@@ -0,0 +1,202 @@
+# Catalog change events shared between uvicorn workers
+#
+# Every product write calls publish() inside its transaction. Once the
+# transaction commits the local catalog cache is invalidated, and the event
+# goes out on a channel that every other worker listens on:
+#
+#   PostgresChannel  NOTIFY/LISTEN on "catalog_changes". The NOTIFY is part
+#                    of the write transaction, so it is only delivered if
+#                    the write commits.
+#   LocalChannel     in-memory fan-out within one process; used with SQLite
+#                    and in tests to stand in for several workers.
+#
+# Stock writes and sales also attach stock= (the product's new total stock)
+# and sold= ([sales, quantity, amount] in this commit). The cache ignores
+# them; listeners registered with listen() (the live feed) get every
+# committed event, local or remote, with those fields included.
+
+import json
+import logging
+import os
+import select
+import threading
+import uuid
+
+from catalog_cache import catalog
+
+
+CHANNEL = "catalog_changes"
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+log = logging.getLogger(__name__)
+
+
+def apply(cache, event):
+    kind, pid, category = event["kind"], event["pid"], event.get("category")
+    if kind == "changed":
+        cache.product_changed(pid)
+    elif kind == "moved":
+        cache.product_moved(pid, category)
+    elif kind == "added":
+        cache.product_added(pid, category)
+    elif kind == "removed":
+        cache.product_removed(pid)
+    elif kind == "reset":
+        cache.clear()
+
+
+class LocalChannel:
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def send(self, conn, payload):
+        conn.after_commit(lambda: self.deliver(payload))
+
+    async def send_async(self, conn, payload):
+        self.send(conn, payload)
+
+    def deliver(self, payload):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(payload)
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def close(self):
+        with self._lock:
+            self._subscribers = []
+
+
+class PostgresChannel:
+    def __init__(self, url, reconnect_delay=1.0):
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self._callbacks = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def send(self, conn, payload):
+        conn.execute("SELECT pg_notify(?, ?)", (CHANNEL, payload))
+
+    async def send_async(self, conn, payload):
+        await conn.execute("SELECT pg_notify(?, ?)", (CHANNEL, payload))
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name="catalog-listen", daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        import psycopg2
+
+        while not self._stop.is_set():
+            try:
+                conn = psycopg2.connect(self.url)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CHANNEL}")
+                # Anything sent while we were disconnected is lost
+                self._dispatch(json.dumps({"origin": None, "kind": "reset", "pid": None}))
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self._dispatch(conn.notifies.pop(0).payload)
+                conn.close()
+            except Exception:
+                log.exception("catalog listener lost its connection; retrying")
+                self._stop.wait(self.reconnect_delay)
+
+    def _dispatch(self, payload):
+        for callback in self._callbacks:
+            callback(payload)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+class CatalogEvents:
+    def __init__(self, cache, channel, worker_id=WORKER_ID):
+        self.cache = cache
+        self.channel = channel
+        self.worker_id = worker_id
+        self.received = 0
+        self._listeners = []
+        channel.subscribe(self._receive)
+
+    def listen(self, callback):
+        """Call callback(event) after each committed event, from whichever thread delivers it."""
+        self._listeners.append(callback)
+
+    def _event(self, kind, pid, category, stock, sold):
+        event = {"kind": kind, "pid": pid, "category": category}
+        if stock is not None:
+            event["stock"] = stock
+        if sold is not None:
+            event["sold"] = sold
+        return event
+
+    def publish(self, conn, kind, pid, category=None, stock=None, sold=None):
+        event = self._event(kind, pid, category, stock, sold)
+        conn.after_commit(lambda: self._apply(event))
+        self.channel.send(conn, json.dumps({"origin": self.worker_id, **event}))
+
+    async def publish_async(self, conn, kind, pid, category=None, stock=None, sold=None):
+        event = self._event(kind, pid, category, stock, sold)
+        conn.after_commit(lambda: self._apply(event))
+        await self.channel.send_async(conn, json.dumps({"origin": self.worker_id, **event}))
+
+    def _apply(self, event):
+        apply(self.cache, event)
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                log.exception("catalog event listener failed")
+
+    def _receive(self, payload):
+        event = json.loads(payload)
+        if event.get("origin") == self.worker_id:
+            return
+        self.received += 1
+        self._apply(event)
+
+    def close(self):
+        self.channel.close()
+
+
+def channel_from_url(url):
+    if url and url.startswith(("postgres://", "postgresql://")):
+        return PostgresChannel(url)
+    return LocalChannel()
+
+
+_events = None
+
+
+def start(cache=catalog, url=None):
+    global _events
+    if _events is None:
+        _events = CatalogEvents(cache, channel_from_url(url or os.getenv("DATABASE_URL")))
+    return _events
+
+
+def stop():
+    global _events
+    if _events is not None:
+        _events.close()
+        _events = None
+
+
+def publish(conn, kind, pid, category=None, stock=None, sold=None):
+    start().publish(conn, kind, pid, category, stock, sold)
+
+
+async def publish_async(conn, kind, pid, category=None, stock=None, sold=None):
+    await start().publish_async(conn, kind, pid, category, stock, sold)
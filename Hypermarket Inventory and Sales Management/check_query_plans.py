@@ -0,0 +1,135 @@
+# Query-plan regression check for the main endpoints
+#
+#   python check_query_plans.py                              # scratch SQLite file
+#   python check_query_plans.py --database-url postgresql://...
+#
+# Runs EXPLAIN on the statements behind the hot endpoints and fails if any
+# of them falls back to a full scan of a table that should be indexed. On
+# Postgres sequential scans are disabled for the session so the planner
+# reports whether a usable index exists even on a near-empty database.
+
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, datetime
+
+import backend
+import fast_json
+import product_search
+import reorder
+import rollup
+import sales_changes
+import stock_shards
+
+
+# Every statement is built by the helper or constant its endpoint uses, so a
+# change there is what gets checked
+
+START, END = date(2025, 1, 1), date(2025, 1, 31)
+
+
+def _products(category=None, after=None, limit=None):
+    return backend.keyset_query("products", {"category": category}, after, limit)
+
+
+def _sales(backend_name, after=None, product_id=None, start=None, end=None, limit=100):
+    # As list_sales builds it
+    select, _ = backend.sales_query_archive(fast_json.columns(backend.SaleRead), after, product_id,
+                                            start, end, backend_name)
+    return backend.keyset_query("sales", {"product_id": product_id}, after, limit, select,
+                                backend.date_range("sale_date", start, end))
+
+
+def _patch(**fields):
+    _, sql, params = backend.patch_query(1, backend.ProductUpdate(**fields))
+    return sql, params
+
+
+NOW = datetime(2025, 1, 31).isoformat()
+
+# (endpoint, backend name -> (SQL, params), table that must not be scanned;
+# add its alias when the statement names one, as SQLite reports that)
+PLANS = [
+    ("GET /products?category=", lambda b: _products(category="fruit"), "products"),
+    ("GET /products?after=", lambda b: _products(after=1, limit=100), "products"),
+    ("GET /products/{pid}", lambda b: (backend.PRODUCT_SQL, (1,)), "products"),
+    ("PUT /products/{pid}",
+     lambda b: backend.update_query(1, backend.ProductBase(name="x", price=1, stock=3)), "products"),
+    ("PATCH /products/{pid}", lambda b: _patch(name="x", stock=3), "products"),
+    ("GET /sales?after=", lambda b: _sales(b, after=1), "sales"),
+    ("GET /sales?product_id=", lambda b: _sales(b, product_id=1), "sales"),
+    ("GET /sales?start=&end=", lambda b: _sales(b, start=START, end=END), "sales"),
+    ("POST /sales", lambda b: (stock_shards.TAKE_SQL, (1, 1, 1)), "products"),
+    ("POST /sales (sharded stock)",
+     lambda b: (stock_shards.TAKE_FULLEST_SQL, (1, 1, 1, 1, 1)), "stock_shards"),
+    ("DELETE /products/{pid} (deletion log)",
+     lambda b: (sales_changes.RECORD_SQL, (NOW, 1)), "sales"),
+    ("DELETE /products/{pid} (sales)", lambda b: (backend.DELETE_SALES_SQL, (1,)), "sales"),
+    ("DELETE /products/{pid} (rollup)", lambda b: (rollup.FORGET_SQL, (1,)), "daily_product_sales"),
+    ("GET /sales/changes (sales)", lambda b: (sales_changes.SALES_SQL, (1, 100, 100)), "sales"),
+    ("GET /sales/changes (deletions)",
+     lambda b: (sales_changes.DELETIONS_SQL, (1, 100, 100)), "sale_deletions"),
+    ("GET /sales/changes (bare sale id)",
+     lambda b: (sales_changes.BOUNDED_DELETIONS_SQL, (1, 100, 50, 10, 100)), "sale_deletions"),
+    ("GET /sales/changes?since=<time>", lambda b: (sales_changes.SALES_AT_SQL, (NOW,)), "sales"),
+    ("GET /sales/changes (horizon)",
+     lambda b: sales_changes.horizon_query(b, "sales", "sale_date"), "sales"),
+    ("GET /analytics/summary",
+     lambda b: backend.summary_query(None, START, END), ("daily_product_sales", "r")),
+    ("GET /analytics/sales-by-product",
+     lambda b: backend.sales_by_product_query(10, None, START, END), ("daily_product_sales", "r")),
+    ("GET /products/search (short)", lambda b: product_search.search_query(b, "ma"), "products"),
+    ("GET /products/search", lambda b: product_search.search_query(b, "mango"), "products"),
+    ("PUT /products/{pid} (low stock)", lambda b: (reorder.MARK_SQL, (NOW, 1)), "products"),
+    ("GET /products/low-stock", lambda b: reorder.low_stock_query(), "products"),
+    ("GET /products/low-stock?days=",
+     lambda b: reorder.velocity_query([1, 2, 3], 14), "daily_product_sales"),
+]
+
+
+def full_scans(conn, sql, params, table):
+    table, *aliases = (table,) if isinstance(table, str) else table
+    if conn.backend.name == "postgres":
+        conn.execute("SET LOCAL enable_seqscan = off")
+        plan = [row["QUERY PLAN"] for row in conn.execute("EXPLAIN " + sql, params).fetchall()]
+        conn.rollback()
+        bad = [line for line in plan if f"Seq Scan on {table}" in line]
+    else:
+        plan = [row["detail"] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+        bad = [line for line in plan if line.split(" USING ")[0] in
+               [f"SCAN {name}" for name in [table] + aliases]]
+    return plan, bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that hot queries use indexes")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "plans.db")
+
+    import storage
+    from migrations import migrate
+
+    storage.set_pool(storage.ConnectionPool(storage.backend_from_url(url), size=1))
+
+    failed = 0
+    with storage.get_conn() as conn:
+        migrate(conn)
+        for endpoint, build, table in PLANS:
+            sql, params = build(conn.backend.name)
+            plan, bad = full_scans(conn, sql, params, table)
+            status = "FULL SCAN" if bad else "ok"
+            failed += bool(bad)
+            print(f"{status:<10} {endpoint}")
+            if bad:
+                for line in plan:
+                    print(f"             {line}")
+
+    storage.get_pool().close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# Live stock and sales updates over server-sent events (GET /live)
+#
+# Store floor screens subscribe once instead of polling /products and
+# /sales. Product writes and sales already publish catalog events, which
+# reach every worker (catalog_events.py), and those events carry the new
+# stock level and what was sold. Each worker's LiveFeed fans them out to its
+# own SSE clients as:
+#
+#   event: stock  data: [{"id": 7, "stock": 41}, ...]   latest level per product;
+#                                                      "stock": null = deleted
+#   event: sales  data: {"count": 3, "quantity": 5, "amount": 61.5,
+#                        "categories": {"fruit": [3, 5, 61.5]}}
+#                                                      sold since the last message
+#   event: reset  data: {}                             updates were lost: refetch
+#
+# Subscribe first, then load /products or /analytics/summary, and apply the
+# messages on top.
+#
+# Coalescing: a client holds at most one pending stock value per product and
+# one running sales total, and messages go out at most every LIVE_INTERVAL_MS.
+# A burst of a thousand sales of one item becomes one stock message and one
+# sales message. Backpressure: while a slow client's socket is full, its
+# updates keep coalescing instead of queueing. If more than LIVE_MAX_PENDING
+# products are pending, they are dropped and the client gets a reset.
+# A comment line every LIVE_HEARTBEAT_SECONDS keeps idle connections open.
+#
+# An event stream never ends by itself, and uvicorn waits for open responses
+# before it runs the lifespan shutdown, so the app's lifespan (startup.py)
+# also has the feed end its streams as soon as the server gets SIGINT /
+# SIGTERM. Browsers reconnect after RETRY_MS.
+#
+# Events cross workers only on Postgres; with SQLite the channel is
+# in-process, so a client sees the writes made by its own worker. Run a
+# single worker there if the floor screens need every update.
+
+import asyncio
+import json
+import os
+import signal
+import threading
+
+from fastapi.responses import StreamingResponse
+
+import catalog_events
+
+
+INTERVAL = float(os.getenv("LIVE_INTERVAL_MS", "250")) / 1000
+HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+MAX_PENDING = int(os.getenv("LIVE_MAX_PENDING", "10000"))
+# How long a browser EventSource waits before reconnecting
+RETRY_MS = 2000
+
+
+def _message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Subscriber:
+    """One SSE client's pending updates; offer() may be called from any thread."""
+
+    def __init__(self, loop, max_pending=MAX_PENDING):
+        self.loop = loop
+        self.max_pending = max_pending
+        self.wake = asyncio.Event()
+        self.resets = 0
+        self._lock = threading.Lock()
+        self._stock = {}
+        self._sales = {}
+        self._reset = False
+        self._signalled = False
+
+    def offer(self, event):
+        kind, pid = event["kind"], event["pid"]
+        with self._lock:
+            if kind == "reset":
+                self._drop()
+            elif kind == "removed":
+                self._put(pid, None)
+            elif "stock" in event:
+                self._put(pid, event["stock"])
+
+            sold = event.get("sold")
+            if sold and not self._reset:
+                totals = self._sales.setdefault(event.get("category"), [0, 0, 0.0])
+                for i in range(3):
+                    totals[i] += sold[i]
+
+            if self._signalled or not (self._stock or self._sales or self._reset):
+                return
+            self._signalled = True
+        self.loop.call_soon_threadsafe(self.wake.set)
+
+    def _put(self, pid, stock):
+        if pid not in self._stock and len(self._stock) >= self.max_pending:
+            self._drop()
+        elif not self._reset:
+            self._stock[pid] = stock
+
+    def _drop(self):
+        # Too far behind (or the event stream broke): start over from a refetch
+        self._stock.clear()
+        self._sales.clear()
+        self._reset = True
+        self.resets += 1
+
+    def take(self):
+        """Everything pending, as SSE text (empty when nothing is)."""
+        with self._lock:
+            stock, self._stock = self._stock, {}
+            sales, self._sales = self._sales, {}
+            reset, self._reset = self._reset, False
+            self._signalled = False
+            self.wake.clear()
+
+        if reset:
+            return _message("reset", {})
+        parts = []
+        if stock:
+            parts.append(_message("stock", [{"id": pid, "stock": n} for pid, n in stock.items()]))
+        if sales:
+            parts.append(_message("sales", {
+                "count": sum(t[0] for t in sales.values()),
+                "quantity": sum(t[1] for t in sales.values()),
+                "amount": sum(t[2] for t in sales.values()),
+                "categories": sales,
+            }))
+        return "".join(parts)
+
+
+class LiveFeed:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def offer(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(event)
+
+    def subscribe(self):
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": len(self._subscribers)}
+
+    def reopen(self):
+        """Accept streams again after close(), for an app started anew in this process."""
+        self.closed = False
+
+    def close(self):
+        """End every stream; runs on the event loop."""
+        self.closed = True
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.wake.set()
+
+    async def stream(self, subscriber):
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while not self.closed:
+                try:
+                    await asyncio.wait_for(subscriber.wake.wait(), HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                # Let a burst pile up into one message
+                await asyncio.sleep(INTERVAL)
+                body = subscriber.take()
+                if body:
+                    # Blocks while the client's socket is full; offer() keeps coalescing
+                    yield body
+        finally:
+            self.unsubscribe(subscriber)
+
+    def response(self):
+        subscriber = self.subscribe()
+        return StreamingResponse(self.stream(subscriber), media_type="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            # Stop nginx-style proxies from buffering the stream
+            "X-Accel-Buffering": "no",
+        })
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def get():
+    global _feed
+    if _feed is None:
+        with _feed_lock:
+            if _feed is None:
+                _feed = LiveFeed()
+                catalog_events.start().listen(_feed.offer)
+    return _feed
+
+
+def reopen():
+    """Undo close() at lifespan startup, so a restarted app's streams stay open."""
+    if _feed is not None:
+        _feed.reopen()
+
+
+def close():
+    """End every open /live stream; runs on the event loop."""
+    if _feed is not None:
+        _feed.close()
+
+
+def close_on_signals(loop):
+    """Run close() on SIGINT / SIGTERM, then the server's own handler.
+
+    Called from the lifespan startup, after the server has installed its
+    handlers; without a server (scripts, tests) or off the main thread
+    there is nothing to chain onto.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(close)
+            previous(signum, frame)
+
+        signal.signal(sig, handler)
@@ -0,0 +1,360 @@
+# Load test / benchmark suite for the API
+#
+#   python loadtest.py                                   # in-process, scratch SQLite
+#   python loadtest.py --target http --api-mode async    # uvicorn on a scratch copy
+#   python loadtest.py --products 100000 --sales 1000000 --clients 64 --duration 30
+#   python loadtest.py --database-url postgresql://...   # throwaway DB only!
+#   python loadtest.py --url http://127.0.0.1:8000       # a server that is already up
+#
+#   python loadtest.py --output baseline.json            # save a run
+#   python loadtest.py --baseline baseline.json          # exit 1 on regression
+#
+# Seeds a fresh database with --products products (over --categories
+# categories) and --sales historical sales spread over --days days, then
+# runs --clients concurrent clients for --duration seconds. Each client picks
+# from a fixed traffic mix: product lookups, typeahead searches, catalog and
+# sales pages, single sales, baskets and dashboard refreshes. Everything is
+# driven by --seed, so two runs of the same revision see the same data and
+# the same request sequence per client.
+#
+# "inprocess" calls the ASGI app through httpx without a socket, which
+# isolates handler and database cost. "http" goes through uvicorn (or --url)
+# and includes the server and network stack.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from bench_async import percentile, wait_until_up
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STOCK = 10**9
+SEED_BATCH = 10000
+
+# (operation, weight)
+MIX = [
+    ("product", 30),
+    ("search", 10),
+    ("products_page", 10),
+    ("sales_page", 10),
+    ("sale", 20),
+    ("basket", 5),
+    ("dashboard", 10),
+    ("export", 5),
+]
+
+SEARCH_TERMS = ["rice", "milk", "tea", "oil", "so", "ap", "bread", "item 1", "cat-1", "sugar"]
+WORDS = ["rice", "milk", "tea", "oil", "soap", "apple", "bread", "sugar", "salt", "juice",
+         "flour", "eggs", "butter", "coffee", "honey"]
+
+
+def seed(url, products, sales, categories, days, rng):
+    import storage
+    from migrations import migrate
+    import rollup
+
+    pool = storage.ConnectionPool(storage.backend_from_url(url), size=1)
+    with pool.connection() as conn:
+        migrate(conn)
+        for start in range(0, products, SEED_BATCH):
+            conn.executemany(
+                "INSERT INTO products (name, price, stock, category) VALUES (?, ?, ?, ?)",
+                [(f"{rng.choice(WORDS)} item {i}", round(rng.uniform(5, 500), 2), STOCK,
+                  f"cat-{i % categories}")
+                 for i in range(start, min(start + SEED_BATCH, products))],
+            )
+            conn.commit()
+        catalog = conn.execute("SELECT id, price, category FROM products").fetchall()
+        conn.commit()
+
+        now = datetime.now()
+        for start in range(0, sales, SEED_BATCH):
+            rows = []
+            for _ in range(min(SEED_BATCH, sales - start)):
+                product = rng.choice(catalog)
+                quantity = rng.randint(1, 5)
+                sold = now - timedelta(seconds=rng.uniform(0, days * 86400))
+                rows.append((product["id"], quantity, product["price"] * quantity, sold))
+            conn.executemany(
+                "INSERT INTO sales (product_id, quantity, total_amount, sale_date) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+        rollup.rebuild(conn)
+
+        categories = sorted({row["category"] for row in catalog if row["category"]})
+        max_sale = conn.execute("SELECT COALESCE(MAX(id), 0) AS n FROM sales").fetchone()["n"]
+    pool.close()
+    return [row["id"] for row in catalog], categories, max_sale
+
+
+def discover(http_url):
+    # --url: read the ids off the running server instead of seeding
+    products = httpx.get(f"{http_url}/products", timeout=60).json()
+    summary = httpx.get(f"{http_url}/analytics/summary", timeout=60).json()
+    categories = sorted({p["category"] for p in products if p["category"]})
+    # Sale ids are only used as page cursors, so the count is close enough
+    return [p["id"] for p in products], categories, summary["sale_count"]
+
+
+class Workload:
+    def __init__(self, product_ids, categories, max_sale, days):
+        self.product_ids = product_ids
+        self.categories = categories or [None]
+        self.max_sale = max_sale
+        self.days = days
+        self.ops, weights = zip(*MIX)
+        total = sum(weights)
+        self.cumulative = [sum(weights[:i + 1]) / total for i in range(len(weights))]
+
+    def pick(self, rng):
+        roll = rng.random()
+        for op, edge in zip(self.ops, self.cumulative):
+            if roll <= edge:
+                return op
+        return self.ops[-1]
+
+    def requests(self, op, rng):
+        """(endpoint label, method, path, params, json body) for one operation."""
+        pid = rng.choice(self.product_ids)
+        if op == "product":
+            return [("GET /products/{pid}", "GET", f"/products/{pid}", None, None)]
+        if op == "search":
+            return [("GET /products/search", "GET", "/products/search",
+                     {"q": rng.choice(SEARCH_TERMS), "limit": 20}, None)]
+        if op == "products_page":
+            after = rng.choice(self.product_ids)
+            return [("GET /products?limit", "GET", "/products", {"limit": 100, "after": after}, None)]
+        if op == "sales_page":
+            return [("GET /sales?limit", "GET", "/sales",
+                     {"limit": 100, "after": rng.randint(0, max(self.max_sale - 100, 0))}, None)]
+        if op == "sale":
+            return [("POST /sales", "POST", "/sales", None, {"product_id": pid, "quantity": 1})]
+        if op == "basket":
+            lines = [{"product_id": rng.choice(self.product_ids), "quantity": rng.randint(1, 3)}
+                     for _ in range(rng.randint(3, 8))]
+            return [("POST /sales/batch", "POST", "/sales/batch", None, lines)]
+        if op == "dashboard":
+            end = datetime.now().date()
+            params = {"start": (end - timedelta(days=rng.choice([7, 30, self.days]))).isoformat(),
+                      "end": end.isoformat()}
+            category = rng.choice(self.categories + [None])
+            if category:
+                params["category"] = category
+            return [
+                ("GET /analytics/summary", "GET", "/analytics/summary", params, None),
+                ("GET /analytics/sales-by-product", "GET", "/analytics/sales-by-product",
+                 {**params, "top": 10}, None),
+            ]
+        # export: one category of the catalog as Arrow, as the dashboard table loads it
+        return [("GET /products?format=arrow", "GET", "/products",
+                 {"format": "arrow", "category": rng.choice(self.categories)}, None)]
+
+
+async def client(http, workload, rng, deadline, samples):
+    while time.perf_counter() < deadline:
+        for label, method, path, params, body in workload.requests(workload.pick(rng), rng):
+            start = time.perf_counter()
+            try:
+                resp = await http.request(method, path, params=params, json=body)
+                ok = resp.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            samples.setdefault(label, []).append((time.perf_counter() - start, ok))
+
+
+async def drive(http, workload, clients, duration, seed_value):
+    samples = {}
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(client(http, workload, random.Random(seed_value * 1000 + n), deadline, samples)
+                           for n in range(clients)))
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for label, values in sorted(samples.items()):
+        latencies = sorted(seconds for seconds, _ in values)
+        endpoints[label] = {
+            "count": len(values),
+            "rps": len(values) / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "errors": sum(1 for _, ok in values if not ok),
+        }
+    everything = sorted(seconds for values in samples.values() for seconds, _ in values)
+    total = {
+        "count": len(everything),
+        "rps": len(everything) / elapsed,
+        "p50_ms": percentile(everything, 50) * 1000,
+        "p95_ms": percentile(everything, 95) * 1000,
+        "p99_ms": percentile(everything, 99) * 1000,
+        "errors": sum(e["errors"] for e in endpoints.values()),
+    }
+    return endpoints, total
+
+
+def print_report(endpoints, total):
+    print(f"{'endpoint':<32} {'count':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'errors':>7}")
+    for label, e in list(endpoints.items()) + [("TOTAL", total)]:
+        print(f"{label:<32} {e['count']:>8} {e['rps']:>9.1f} {e['p50_ms']:>9.2f} "
+              f"{e['p95_ms']:>9.2f} {e['p99_ms']:>9.2f} {e['errors']:>7}")
+
+
+def compare(result, baseline, threshold, floor_ms):
+    """Regressions against a saved run: slower p95 or lower throughput beyond threshold."""
+    problems = []
+    pairs = [("TOTAL", result["total"], baseline["total"])]
+    pairs += [(label, e, baseline["endpoints"][label])
+              for label, e in result["endpoints"].items() if label in baseline["endpoints"]]
+    for label, now, before in pairs:
+        if now["p95_ms"] > before["p95_ms"] * (1 + threshold) and now["p95_ms"] - before["p95_ms"] > floor_ms:
+            problems.append(f"{label}: p95 {before['p95_ms']:.2f} -> {now['p95_ms']:.2f} ms")
+        if now["rps"] < before["rps"] * (1 - threshold):
+            problems.append(f"{label}: throughput {before['rps']:.1f} -> {now['rps']:.1f} req/s")
+        if now["errors"] > before["errors"]:
+            problems.append(f"{label}: errors {before['errors']} -> {now['errors']}")
+    return problems
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a database and load-test the API")
+    parser.add_argument("--target", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--api-mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--url", default=None, help="benchmark a running server (no seeding)")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--sales", type=int, default=50000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of unmeasured load first")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON from an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed relative slowdown before flagging (default 0.2 = 20%%)")
+    parser.add_argument("--floor-ms", type=float, default=1.0,
+                        help="ignore p95 changes smaller than this many ms")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    proc = None
+    if args.url:
+        product_ids, categories, max_sale = discover(args.url)
+        base_url = args.url
+    else:
+        if args.database_url:
+            url = args.database_url
+        else:
+            url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "loadtest.db")
+        started = time.perf_counter()
+        product_ids, categories, max_sale = seed(url, args.products, args.sales, args.categories,
+                                                 args.days, rng)
+        print(f"Seeded {len(product_ids)} products and {args.sales} sales "
+              f"in {time.perf_counter() - started:.1f}s")
+        os.environ["DATABASE_URL"] = url
+        os.environ["API_MODE"] = args.api_mode
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    workload = Workload(product_ids, categories, max_sale, args.days)
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+
+    try:
+        if args.target == "http" and not args.url:
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(args.port),
+                 "--log-level", "warning"],
+                cwd=HERE, env=dict(os.environ),
+            )
+            wait_until_up(base_url, proc)
+
+        if args.target == "inprocess" and not args.url:
+            sys.path.insert(0, HERE)
+            from asgi import app
+
+            transport = httpx.ASGITransport(app=app)
+        else:
+            transport = None
+
+        async def run():
+            async with httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits,
+                                         timeout=60) as http:
+                if args.warmup > 0:
+                    await drive(http, workload, args.clients, args.warmup, args.seed + 1)
+                return await drive(http, workload, args.clients, args.duration, args.seed)
+
+        samples, elapsed = asyncio.run(run())
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    endpoints, total = summarize(samples, elapsed)
+    print_report(endpoints, total)
+
+    result = {
+        "meta": {
+            "revision": git_revision(),
+            "when": datetime.now().isoformat(timespec="seconds"),
+            "target": "url" if args.url else args.target,
+            "api_mode": args.api_mode,
+            "backend": "postgres" if (args.database_url or "").startswith("postgres") else "sqlite",
+            "products": len(product_ids),
+            "sales": args.sales,
+            "clients": args.clients,
+            "duration": args.duration,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "endpoints": endpoints,
+        "total": total,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("target", "api_mode", "backend", "products", "sales", "clients", "cpus"):
+            if baseline["meta"].get(key) != result["meta"][key]:
+                print(f"warning: baseline {key}={baseline['meta'].get(key)!r}, "
+                      f"this run {result['meta'][key]!r}; numbers may not be comparable")
+        problems = compare(result, baseline, args.threshold, args.floor_ms)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            return 1
+        print(f"No regressions against {args.baseline} (revision {baseline['meta'].get('revision')}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
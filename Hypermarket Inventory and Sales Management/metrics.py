@@ -0,0 +1,208 @@
+# Prometheus instrumentation for the API (served at GET /metrics)
+#
+#   http_requests_total{method,route,status}
+#   http_request_duration_seconds{method,route}      histogram, whole response
+#   http_request_phase_seconds{route,phase}          pool wait / db / app
+#   http_requests_in_flight
+#   db_statement_duration_seconds{operation}         execute / commit time
+#   db_fetch_seconds_total{operation}                time spent fetching rows
+#   db_rows_total{operation}                         rows returned, or affected
+#                                                    when nothing is returned
+#   db_pool_acquire_seconds                          waiting for a connection
+#   db_pool_connections{state}                       size / open / idle / in_use
+#   app_startup_seconds{phase}                       this worker's cold start
+#                                                    (see startup.py)
+#
+# The "app" phase is everything that is neither waiting for a connection nor
+# talking to the database: request parsing, pydantic model building and JSON
+# encoding. Route labels are path templates ("/products/{pid}"), so label
+# cardinality stays fixed.
+#
+# Slow-request log (off by default):
+#
+#   SLOW_REQUEST_MS=250 uvicorn backend:app
+#
+# logs every request slower than the threshold to the "slow_requests" logger
+# with its pool/db/app split and the SQL it ran (statement text only, never
+# parameters). Under several worker processes set PROMETHEUS_MULTIPROC_DIR
+# and /metrics aggregates all of them.
+
+import contextvars
+import logging
+import os
+import re
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+import storage
+
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0")) or None
+# Statements kept per request for the slow log
+MAX_LOGGED_STATEMENTS = 50
+MAX_LOGGED_SQL = 500
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COMMIT", "BEGIN"}
+
+log = logging.getLogger("slow_requests")
+
+REQUESTS = Counter("http_requests", "HTTP requests served", ["method", "route", "status"])
+LATENCY = Histogram("http_request_duration_seconds", "Time to serve a request, body included",
+                    ["method", "route"])
+PHASES = Histogram("http_request_phase_seconds", "Per-request time split into pool wait, db and app",
+                   ["route", "phase"])
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being served", multiprocess_mode="livesum")
+STATEMENTS = Histogram("db_statement_duration_seconds", "Statement execute and commit time",
+                       ["operation"],
+                       buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+FETCH = Counter("db_fetch_seconds", "Time spent fetching result rows", ["operation"])
+ROWS = Counter("db_rows", "Rows returned, or affected when nothing is returned", ["operation"])
+POOL_WAIT = Histogram("db_pool_acquire_seconds", "Time waiting for a pooled connection",
+                      buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 30))
+# Kept per process under PROMETHEUS_MULTIPROC_DIR, so every worker's cold start shows
+STARTUP = Gauge("app_startup_seconds", "Worker startup time by phase; ready is process start to serving",
+                ["phase"], multiprocess_mode="all")
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    __slots__ = ("pool", "db", "statements")
+
+    def __init__(self, trace):
+        self.pool = 0.0
+        self.db = 0.0
+        self.statements = [] if trace else None
+
+
+def operation(sql):
+    word = sql.lstrip().split(None, 1)[0].upper() if sql and sql.strip() else ""
+    return word if word in OPERATIONS else "OTHER"
+
+
+class _Observer:
+    # Installed into storage; called from request threads and background threads alike
+
+    def statement(self, sql, seconds, rows):
+        op = operation(sql)
+        STATEMENTS.labels(op).observe(seconds)
+        if rows:
+            ROWS.labels(op).inc(rows)
+        stats = _current.get()
+        if stats is not None:
+            stats.db += seconds
+            if stats.statements is not None and len(stats.statements) < MAX_LOGGED_STATEMENTS:
+                stats.statements.append([sql, seconds, rows])
+
+    def fetched(self, sql, seconds, rows):
+        op = operation(sql)
+        FETCH.labels(op).inc(seconds)
+        if rows:
+            ROWS.labels(op).inc(rows)
+        stats = _current.get()
+        if stats is not None:
+            stats.db += seconds
+            # Fold fetch time into the statement it belongs to
+            if stats.statements and stats.statements[-1][0] is sql:
+                stats.statements[-1][1] += seconds
+                stats.statements[-1][2] += rows
+
+    def acquired(self, seconds):
+        POOL_WAIT.observe(seconds)
+        stats = _current.get()
+        if stats is not None:
+            stats.pool += seconds
+
+
+class PoolCollector:
+    def collect(self):
+        family = GaugeMetricFamily("db_pool_connections", "Sync connection pool", labels=["state"])
+        for state, value in storage.get_pool().stats().items():
+            family.add_metric([state], value)
+        yield family
+
+
+_installed = False
+
+
+def install():
+    """Hook the storage layer (idempotent)."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    storage.set_observer(_Observer())
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        REGISTRY.register(PoolCollector())
+
+
+def render():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def _one_line(sql):
+    sql = re.sub(r"\s+", " ", sql).strip()
+    return sql if len(sql) <= MAX_LOGGED_SQL else sql[:MAX_LOGGED_SQL] + "..."
+
+
+def _log_slow(method, route, path, status, elapsed, stats):
+    lines = [f"  {seconds * 1000:8.2f} ms {rows:>7} rows  {_one_line(sql)}"
+             for sql, seconds, rows in stats.statements]
+    log.warning(
+        "slow request %s %s (%s) -> %s in %.1f ms: pool %.1f ms, db %.1f ms, app %.1f ms\n%s",
+        method, path, route, status, elapsed * 1000, stats.pool * 1000, stats.db * 1000,
+        max(elapsed - stats.pool - stats.db, 0.0) * 1000, "\n".join(lines) or "  (no SQL)",
+    )
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware, so streaming responses are timed to their last byte."""
+
+    def __init__(self, app):
+        self.app = app
+        install()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(trace=SLOW_REQUEST_MS is not None)
+        token = _current.set(stats)
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec()
+            _current.reset(token)
+
+            # The router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", "<unmatched>")
+            method = scope["method"]
+            REQUESTS.labels(method, route, str(status)).inc()
+            LATENCY.labels(method, route).observe(elapsed)
+            PHASES.labels(route, "pool").observe(stats.pool)
+            PHASES.labels(route, "db").observe(stats.db)
+            PHASES.labels(route, "app").observe(max(elapsed - stats.pool - stats.db, 0.0))
+            if SLOW_REQUEST_MS is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+                _log_slow(method, route, scope.get("path", ""), status, elapsed, stats)
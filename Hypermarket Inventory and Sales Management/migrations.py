@@ -0,0 +1,207 @@
+# Versioned schema migrations
+#
+# Each migration runs once, in order, and is recorded in schema_migrations.
+# Add new steps to the end of MIGRATIONS; never edit one that has shipped.
+#
+#   python migrations.py            # apply pending migrations
+#   python migrations.py --status   # show applied / pending versions
+
+import argparse
+import sys
+from datetime import datetime
+
+import product_search
+import reorder
+import rollup
+import sales_archive
+import sales_changes
+import stock_shards
+
+
+# Rows converted per transaction by the online sale_date backfill
+BACKFILL_BATCH = 5000
+
+
+def base_tables(conn):
+    serial_pk = conn.backend.serial_pk
+
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS products (
+            id {serial_pk},
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            stock INTEGER NOT NULL,
+            category TEXT
+        )
+    """)
+
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS sales (
+            id {serial_pk},
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            total_amount REAL NOT NULL,
+            sale_date TEXT NOT NULL,
+            FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+        )
+    """)
+
+
+def sale_date_timestamp(conn):
+    # SQLite has no timestamp type; ISO-8601 text already sorts by time, so
+    # the index added below serves range queries there as-is
+    if conn.backend.name != "postgres":
+        return
+
+    conn.execute("ALTER TABLE sales ADD COLUMN IF NOT EXISTS sold_at TIMESTAMP")
+    conn.commit()
+
+    # Backfill in small committed batches so sales keep flowing meanwhile
+    while True:
+        cur = conn.execute("""
+            UPDATE sales SET sold_at = sale_date::timestamp
+            WHERE id IN (SELECT id FROM sales WHERE sold_at IS NULL LIMIT ?)
+        """, (BACKFILL_BATCH,))
+        conn.commit()
+        if cur.rowcount < BACKFILL_BATCH:
+            break
+
+    # Catch rows written during the backfill, then swap the columns
+    conn.execute("LOCK TABLE sales IN SHARE ROW EXCLUSIVE MODE")
+    conn.execute("UPDATE sales SET sold_at = sale_date::timestamp WHERE sold_at IS NULL")
+    conn.execute("ALTER TABLE sales DROP COLUMN sale_date")
+    conn.execute("ALTER TABLE sales RENAME COLUMN sold_at TO sale_date")
+    conn.execute("ALTER TABLE sales ALTER COLUMN sale_date SET NOT NULL")
+
+
+def indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_products_category ON products (category)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_sales_product_id ON sales (product_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_sales_sale_date ON sales (sale_date)")
+
+
+def daily_rollup(conn):
+    rollup.create_table(conn)
+    if rollup.needs_backfill(conn):
+        rollup.fill(conn)
+
+
+def sharded_stock(conn):
+    stock_shards.create_table(conn)
+
+
+def search_index(conn):
+    product_search.create_index(conn)
+
+
+def sale_deletions(conn):
+    sales_changes.create_table(conn)
+
+
+def low_stock_index(conn):
+    reorder.create_table(conn)
+    reorder.fill(conn)
+
+
+def archive_forgotten_products(conn):
+    sales_archive.create_forgotten_table(conn)
+
+
+def sales_archive_tables(conn):
+    # Partitioning sales rewrites the whole table under an exclusive lock, so
+    # it is an explicit maintenance command (sales_archive.py partition)
+    sales_archive.create_table(conn)
+
+
+MIGRATIONS = [
+    (1, "base tables", base_tables),
+    (2, "sale_date as timestamp", sale_date_timestamp),
+    (3, "indexes on category, product_id and sale_date", indexes),
+    (4, "daily_product_sales rollup", daily_rollup),
+    (5, "stock_shards counters for hot products", sharded_stock),
+    (6, "trigram / prefix search index on products", search_index),
+    (7, "sale_deletions log for /sales/changes", sale_deletions),
+    (8, "sales_archive manifest for archived months of sales", sales_archive_tables),
+    (9, "products.reorder_level and low_stock index", low_stock_index),
+    (10, "sales_archive product ranges; deleted products awaiting purge", archive_forgotten_products),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _has_table(conn, name):
+    if conn.backend.name == "postgres":
+        row = conn.execute("SELECT to_regclass(?) IS NOT NULL AS found", (name,)).fetchone()
+        return row["found"]
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                        (name,)).fetchone() is not None
+
+
+def pending_versions(conn):
+    """Versions not applied yet, read without running any DDL (cheap enough for every startup)."""
+    done = set()
+    if _has_table(conn, "schema_migrations"):
+        done = {row["version"] for row in conn.execute("SELECT version FROM schema_migrations").fetchall()}
+    conn.commit()
+    return [version for version, _, _ in MIGRATIONS if version not in done]
+
+
+def applied_versions(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+    return {row["version"] for row in conn.execute("SELECT version FROM schema_migrations").fetchall()}
+
+
+def migrate(conn):
+    """Apply every pending migration; returns the versions that ran."""
+    ran = []
+    conn.backend.lock_migrations(conn.raw)
+    try:
+        done = applied_versions(conn)
+        for version, name, step in MIGRATIONS:
+            if version in done:
+                continue
+            conn.begin()
+            # Another worker may have got here first
+            if conn.execute("SELECT 1 FROM schema_migrations WHERE version=?", (version,)).fetchone():
+                conn.commit()
+                continue
+            step(conn)
+            conn.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.now().isoformat()),
+            )
+            conn.commit()
+            ran.append(version)
+    finally:
+        conn.backend.unlock_migrations(conn.raw)
+    return ran
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument("--status", action="store_true", help="list versions without applying")
+    args = parser.parse_args()
+
+    from storage import get_conn
+
+    with get_conn() as conn:
+        if args.status:
+            pending = pending_versions(conn)
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:>4}  {'pending' if version in pending else 'applied':<8} {name}")
+            return 0
+
+        ran = migrate(conn)
+    print(f"Applied migrations: {ran}" if ran else "Schema is up to date.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# Typeahead search over product name and category (GET /products/search)
+#
+#   Postgres -> pg_trgm GIN indexes on name and category; ILIKE '%q%' is
+#               answered from the index and ranked by similarity()
+#   SQLite   -> an FTS5 trigram table kept in sync by triggers for queries of
+#               3+ characters, and a NOCASE index on name for shorter ones
+#               (name prefix only: one or two letters make no trigram)
+#
+# Either way exact and prefix matches on the name rank first, and results
+# are capped at MAX_RESULTS.
+
+from stock_shards import PRODUCT_COLUMNS
+
+
+DEFAULT_RESULTS = 20
+MAX_RESULTS = 100
+# Shortest query the SQLite trigram table can answer
+MIN_TRIGRAM = 3
+
+
+def create_index(conn):
+    if conn.backend.name == "postgres":
+        conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_products_name_trgm "
+                     "ON products USING gin (name gin_trgm_ops)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_products_category_trgm "
+                     "ON products USING gin (category gin_trgm_ops)")
+        return
+
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_products_name_nocase ON products (name COLLATE NOCASE)")
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, category, content='products', content_rowid='id', tokenize='trigram'
+        )
+    """)
+    conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+    # Only name/category changes touch the index, so stock updates stay cheap
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, category) VALUES (new.id, new.name, new.category);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, category)
+            VALUES ('delete', old.id, old.name, old.category);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, category ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, category)
+            VALUES ('delete', old.id, old.name, old.category);
+            INSERT INTO products_fts (rowid, name, category) VALUES (new.id, new.name, new.category);
+        END
+    """)
+
+
+def _like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_query(backend_name, q, limit=DEFAULT_RESULTS):
+    """SQL and params for the top `limit` products matching q."""
+    q = q.strip()
+    prefix = _like(q) + "%"
+
+    if backend_name == "postgres":
+        contains = "%" + _like(q) + "%"
+        return f"""
+            SELECT {PRODUCT_COLUMNS} FROM products
+            WHERE name ILIKE ? ESCAPE '\\' OR category ILIKE ? ESCAPE '\\'
+            ORDER BY CASE WHEN lower(name) = lower(?) THEN 0
+                          WHEN name ILIKE ? ESCAPE '\\' THEN 1 ELSE 2 END,
+                     similarity(name, ?) DESC, id
+            LIMIT ?
+        """, [contains, contains, q, prefix, q, limit]
+
+    if len(q) < MIN_TRIGRAM:
+        return f"""
+            SELECT {PRODUCT_COLUMNS} FROM products
+            WHERE name LIKE ? ESCAPE '\\'
+            ORDER BY name COLLATE NOCASE, id
+            LIMIT ?
+        """, [prefix, limit]
+
+    return f"""
+        SELECT {PRODUCT_COLUMNS} FROM products_fts
+        JOIN products ON products.id = products_fts.rowid
+        WHERE products_fts MATCH ?
+        ORDER BY CASE WHEN products.name = ? COLLATE NOCASE THEN 0
+                      WHEN products.name LIKE ? ESCAPE '\\' THEN 1 ELSE 2 END,
+                 products_fts.rank, products.id
+        LIMIT ?
+    """, ['"' + q.replace('"', '""') + '"', q, prefix, limit]
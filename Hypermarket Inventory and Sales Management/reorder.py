@@ -0,0 +1,263 @@
+# Reorder levels and the low-stock index behind GET /products/low-stock
+#
+#   python reorder.py set 42 --level 10
+#   python reorder.py rebuild
+#   python reorder.py check
+#
+# products.reorder_level is each product's threshold (default 0: flagged once
+# it is out of stock). low_stock holds exactly the products whose total
+# stock, shards included, is at or below it, so the endpoint reads as many
+# rows as it returns instead of scanning the catalog.
+#
+# Every write that moves stock keeps the index current inside its own
+# transaction:
+#
+#   sales (single, basket, buffered)   only ever lower stock, so they add the
+#                                      product once it reaches its level and
+#                                      otherwise touch nothing (ADD_SQL)
+#   PUT / PATCH / bulk edits / import  may raise stock too, so they re-test
+#   / new reorder level                the product (CLEAR_SQL + MARK_SQL)
+#   delete_product                     the row goes with the product (cascade)
+#
+# On Postgres two sales of a sharded product on different shards each see
+# the other's decrement only after it commits, so a product can reach its
+# level without either of them noticing; the shard rebalancer re-tests
+# sharded products, which bounds that gap to STOCK_REBALANCE_SECONDS.
+#
+# ?days=N adds a sales-velocity estimate: average units sold per day over the
+# last N days, read from the daily rollup for just the low-stock products,
+# and days of stock left at that rate, which then orders the list.
+
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+
+from stock_shards import TOTAL_STOCK
+
+
+def create_table(conn):
+    # since is ISO-8601 text on both backends: MARK_SQL selects it as a bare
+    # parameter, which asyncpg would otherwise have to guess a type for
+    conn.execute("ALTER TABLE products ADD COLUMN reorder_level INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS low_stock (
+            product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+            since TEXT NOT NULL
+        )
+    """)
+
+
+# The statements are exposed so backend_async.py can run them on its own
+# connections; the helpers below are for DB-API cursors
+
+# A product that just fell to its level; params (product_id, since)
+ADD_SQL = """
+    INSERT INTO low_stock (product_id, since) VALUES (?, ?)
+    ON CONFLICT (product_id) DO NOTHING
+"""
+
+
+def _clear_sql(condition):
+    return f"""
+        DELETE FROM low_stock WHERE product_id IN (
+            SELECT id FROM products WHERE {condition} AND {TOTAL_STOCK} > products.reorder_level
+        )
+    """
+
+
+def _mark_sql(condition):
+    # "since" is kept for products that were already low
+    return f"""
+        INSERT INTO low_stock (product_id, since)
+        SELECT id, ? FROM products WHERE {condition} AND {TOTAL_STOCK} <= products.reorder_level
+        ON CONFLICT (product_id) DO NOTHING
+    """
+
+
+# Re-test one product; params (product_id,) and (since, product_id)
+CLEAR_SQL = _clear_sql("products.id = ?")
+MARK_SQL = _mark_sql("products.id = ?")
+
+SYNC_CHUNK_ROWS = 1000
+
+
+def now():
+    return datetime.now().isoformat()
+
+
+def added_rows(products, since):
+    """(product_id, stock, reorder_level) after a sale -> ADD_SQL rows for those now low."""
+    return [(pid, since) for pid, stock, level in products if stock <= level]
+
+
+def record_stock(cur, products):
+    """Stock only went down (a sale) or the product is new: add those at their level."""
+    rows = added_rows(products, now())
+    if rows:
+        cur.executemany(ADD_SQL, rows)
+
+
+def sync_statements(product_id):
+    """(SQL, params) pairs that re-test one product, in order."""
+    return [(CLEAR_SQL, (product_id,)), (MARK_SQL, (now(), product_id))]
+
+
+def sync(cur, product_id):
+    """Re-test one product after its stock or reorder level was set outright."""
+    for sql, params in sync_statements(product_id):
+        cur.execute(sql, params)
+
+
+def sync_many(cur, product_ids):
+    product_ids = list(product_ids)
+    since = now()
+    for i in range(0, len(product_ids), SYNC_CHUNK_ROWS):
+        chunk = product_ids[i:i + SYNC_CHUNK_ROWS]
+        condition = f"products.id IN ({', '.join('?' * len(chunk))})"
+        cur.execute(_clear_sql(condition), chunk)
+        cur.execute(_mark_sql(condition), [since] + chunk)
+
+
+def fill(conn):
+    # Re-test every product; for migrations and rebuild()
+    conn.execute(_clear_sql("true"))
+    return conn.execute(_mark_sql("true"), (now(),)).rowcount
+
+
+def rebuild(conn):
+    conn.begin()
+    fill(conn)
+    count = conn.execute("SELECT COUNT(*) AS n FROM low_stock").fetchone()["n"]
+    conn.commit()
+    return count
+
+
+def set_level(conn, product_id, level):
+    """Set a product's reorder level; returns whether it is now low, or None if it doesn't exist."""
+    conn.begin()
+    cur = conn.cursor()
+    cur.execute("UPDATE products SET reorder_level=? WHERE id=?", (level, product_id))
+    if cur.rowcount == 0:
+        conn.rollback()
+        return None
+    sync(cur, product_id)
+    low = cur.execute("SELECT 1 FROM low_stock WHERE product_id=?", (product_id,)).fetchone()
+    conn.commit()
+    return low is not None
+
+
+# TOTAL_STOCK names the products table, so it is not aliased here. CROSS
+# JOIN keeps SQLite's planner from scanning products and probing the index
+# for each one; Postgres treats it as the plain join it is
+LIST_SQL = f"""
+    SELECT products.id, products.name, products.category, {TOTAL_STOCK} AS stock,
+           products.reorder_level, low_stock.since
+    FROM low_stock CROSS JOIN products
+    WHERE products.id = low_stock.product_id
+"""
+
+
+def low_stock_query(category=None, limit=None):
+    """SQL for the index joined to its products, lowest stock first."""
+    sql, params = LIST_SQL, []
+    if category:
+        sql += " AND products.category = ?"
+        params.append(category)
+    sql += " ORDER BY stock, products.id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+def velocity_query(product_ids, days, today=None):
+    """Units sold per product over the last `days` days (today included), from the rollup."""
+    first = (today or date.today()) - timedelta(days=days - 1)
+    sql = f"""
+        SELECT product_id, SUM(quantity) AS quantity FROM daily_product_sales
+        WHERE product_id IN ({", ".join("?" * len(product_ids))}) AND day >= ?
+        GROUP BY product_id
+    """
+    return sql, list(product_ids) + [first.isoformat()]
+
+
+def with_velocity(rows, sold, days, limit=None):
+    """Add daily_sales and days_left to low-stock rows and order them by days_left.
+
+    Products that sold nothing in the window have no estimate and go last.
+    """
+    ranked = []
+    for row in rows:
+        rate = sold.get(row["id"], 0) / days
+        row = dict(row, daily_sales=rate, days_left=max(row["stock"], 0) / rate if rate else None)
+        ranked.append(row)
+    ranked.sort(key=lambda r: (r["days_left"] is None, r["days_left"] or 0, r["stock"], r["id"]))
+    return ranked[:limit] if limit is not None else ranked
+
+
+def low_stock(conn, category=None, limit=None, days=None):
+    """Rows for GET /products/low-stock."""
+    if not days:
+        sql, params = low_stock_query(category, limit)
+        return conn.execute(sql, params).fetchall()
+
+    sql, params = low_stock_query(category)
+    rows = conn.execute(sql, params).fetchall()
+    sold = {}
+    for i in range(0, len(rows), SYNC_CHUNK_ROWS):
+        chunk = [row["id"] for row in rows[i:i + SYNC_CHUNK_ROWS]]
+        sql, params = velocity_query(chunk, days)
+        sold.update((r["product_id"], r["quantity"]) for r in conn.execute(sql, params).fetchall())
+    return with_velocity(rows, sold, days, limit)
+
+
+def check(conn):
+    """Compare the index with a full scan; returns (missing, extra) product ids."""
+    expected = {row["id"] for row in conn.execute(
+        f"SELECT id FROM products WHERE {TOTAL_STOCK} <= products.reorder_level").fetchall()}
+    actual = {row["product_id"] for row in conn.execute("SELECT product_id FROM low_stock").fetchall()}
+    return sorted(expected - actual), sorted(actual - expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage reorder levels and the low-stock index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    level = sub.add_parser("set", help="set a product's reorder level")
+    level.add_argument("product_id", type=int)
+    level.add_argument("--level", type=int, required=True)
+    sub.add_parser("rebuild", help="recompute the index from products")
+    sub.add_parser("check", help="compare the index with a full scan")
+    args = parser.parse_args()
+
+    from migrations import migrate
+    from storage import get_conn
+
+    with get_conn() as conn:
+        migrate(conn)
+
+        if args.command == "set":
+            if args.level < 0:
+                parser.error("--level must be at least 0")
+            low = set_level(conn, args.product_id, args.level)
+            if low is None:
+                print(f"Product {args.product_id} not found.")
+                return 1
+            print(f"Product {args.product_id}: reorder level {args.level}"
+                  f"{', low on stock' if low else ''}.")
+            return 0
+        if args.command == "rebuild":
+            print(f"{rebuild(conn)} product(s) at or below their reorder level.")
+            return 0
+
+        missing, extra = check(conn)
+    if missing:
+        print(f"Missing from the index: {missing}")
+    if extra:
+        print(f"In the index but above their level: {extra}")
+    print("Low-stock index is consistent." if not (missing or extra)
+          else f"{len(missing) + len(extra)} mismatched product(s).")
+    return 1 if missing or extra else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
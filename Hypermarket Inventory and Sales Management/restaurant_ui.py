@@ -4,9 +4,12 @@
 import streamlit as st
 import requests
 import pandas as pd
+import time
 from datetime import datetime
 import plotly.express as px  # For the pie chart
 
+import api_client as api
+
 
 API_BASE_URL = "http://127.0.0.1:8000"
 
@@ -15,6 +18,7 @@ st.title("🛒 Hypermarket Inventory and Sales Management System")
 
 st.sidebar.header("Configuration & Navigation")
 api_url = st.sidebar.text_input("FastAPI base URL", API_BASE_URL)
+api.begin_rerun()
 
 section = st.sidebar.radio("Choose View", [
     "Products 🛒",
@@ -43,38 +47,227 @@ def show_response(resp: requests.Response, method: str, endpoint: str):
 
 
 def fetch_products(category=None):
-    url = f"{api_url}/products"
-    params = {}
+    params = {'format': 'arrow'}
     if category:
         params['category'] = category
     
     try:
-        resp = requests.get(url, params=params)
-        if resp.status_code == 200:
-            return pd.DataFrame(resp.json())
-        else:
-            st.error(f"Failed to fetch products: {resp.status_code}")
-            return pd.DataFrame()
+        return api.get_frame(api_url, "/products", params)
+    except api.APIError as e:
+        st.error(f"Failed to fetch products: {e.status_code}")
+        return pd.DataFrame()
     except Exception as e:
         st.error(f"Error: {e}")
         return pd.DataFrame()
 
 
-def fetch_sales():
-    resp = requests.get(f"{api_url}/sales")
-    if resp.status_code == 200:
-        return pd.DataFrame(resp.json())
-    else:
-        st.error(f"Failed to fetch sales: {resp.status_code}")
+def search_products(q, limit=20):
+    # Ranked, index-backed matches from the API: a handful of rows per
+    # keystroke instead of the whole catalog
+    try:
+        return api.get_json(api_url, "/products/search", {'q': q, 'limit': limit})
+    except api.APIError as e:
+        st.error(f"Failed to search products: {e.status_code}")
+        return []
+
+
+def fetch_low_stock(category=None, days=None):
+    # Served from the API's low-stock index: only the products at or below
+    # their reorder level come back, not the whole catalog
+    params = {}
+    if category:
+        params['category'] = category
+    if days:
+        params['days'] = days
+    try:
+        return pd.DataFrame(api.get_json(api_url, "/products/low-stock", params))
+    except api.APIError as e:
+        st.error(f"Failed to fetch low-stock products: {e.status_code}")
+        return None
+    except Exception as e:
+        st.error(f"Error: {e}")
+        return None
+
+
+SALE_COLUMNS = ['id', 'product_id', 'quantity', 'total_amount', 'sale_date']
+# Local chunks are merged once there are this many, so appends stay O(new rows)
+MAX_SALE_CHUNKS = 32
+
+
+def new_sales_copy():
+    return {
+        'api_url': api_url,
+        'cursor': '0',
+        'chunks': [],
+        'total_sales': 0.0,
+        'total_quantity': 0,
+        'sale_count': 0,
+        'product_sales': {},  # product_id -> sales held locally
+    }
+
+
+def apply_sales_delta(local, delta):
+    added = pd.DataFrame(delta['sales'], columns=SALE_COLUMNS)
+    if not added.empty:
+        added['sale_date'] = pd.to_datetime(added['sale_date'], format='ISO8601')
+        local['chunks'].append(added)
+        local['total_sales'] += float(added['total_amount'].sum())
+        local['total_quantity'] += int(added['quantity'].sum())
+        local['sale_count'] += len(added)
+        for pid, n in added['product_id'].value_counts().items():
+            local['product_sales'][pid] = local['product_sales'].get(pid, 0) + int(n)
+
+    # The server only reports deletions of sales it had already sent us
+    gone = set()
+    for d in delta['deleted']:
+        gone.add(d['sale_id'])
+        local['total_sales'] -= d['total_amount']
+        local['total_quantity'] -= d['quantity']
+        local['sale_count'] -= 1
+        left = local['product_sales'].get(d['product_id'], 0) - 1
+        if left > 0:
+            local['product_sales'][d['product_id']] = left
+        else:
+            local['product_sales'].pop(d['product_id'], None)
+    if gone:
+        low, high = min(gone), max(gone)
+        # Only chunks whose id range overlaps the deletions are rewritten
+        local['chunks'] = [
+            c[~c['id'].isin(gone)] if c['id'].iloc[0] <= high and c['id'].iloc[-1] >= low else c
+            for c in local['chunks']
+        ]
+        local['chunks'] = [c for c in local['chunks'] if not c.empty]
+
+    if len(local['chunks']) > MAX_SALE_CHUNKS:
+        local['chunks'] = [pd.concat(local['chunks'], ignore_index=True)]
+    return len(added), len(gone)
+
+
+def sync_sales():
+    """Pull only the sales added or deleted since the last sync; returns (added, deleted)."""
+    local = st.session_state.get('sales_copy')
+    if local is None or local['api_url'] != api_url:
+        local = st.session_state['sales_copy'] = new_sales_copy()
+
+    added = deleted = 0
+    while True:
+        try:
+            resp = api.request("GET", api_url, "/sales/changes", params={'since': local['cursor']})
+        except Exception as e:
+            st.error(f"Error: {e}")
+            break
+        if resp.status_code != 200:
+            st.error(f"Failed to fetch sales: {resp.status_code}")
+            break
+        delta = resp.json()
+        n_added, n_deleted = apply_sales_delta(local, delta)
+        added += n_added
+        deleted += n_deleted
+        local['cursor'] = delta['next']
+        if not delta['more']:
+            break
+    return added, deleted
+
+
+def analytics_params(category=None, start=None, end=None, top=None):
+    params = {}
+    if category:
+        params['category'] = category
+    if start:
+        params['start'] = start.isoformat()
+    if end:
+        params['end'] = end.isoformat()
+    if top:
+        params['top'] = int(top)
+    return params
+
+
+def fetch_summary(category=None, start=None, end=None):
+    # Totals are aggregated by the API, so this is one small JSON object
+    try:
+        return api.get_json(api_url, "/analytics/summary", analytics_params(category, start, end))
+    except api.APIError as e:
+        st.error(f"Failed to fetch summary: {e.status_code}")
+        return None
+
+
+def show_summary(slot, summary):
+    with slot.container():
+        if not summary or summary['sale_count'] == 0 or summary['total_products'] == 0:
+            st.warning("No data available to generate the dashboard.")
+            return
+
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+
+            with col1:
+                st.metric("Total Sales", f"₹{summary['total_sales']:,.2f}")
+            with col2:
+                st.metric("Total Quantity Sold", f"{summary['total_quantity']:,}")
+            with col3:
+                st.metric("Total Products", f"{summary['total_products']:,}")
+            with col4:
+                st.metric("Total Categories", f"{summary['total_categories']:,}")
+
+
+def live_summary(slot, status, category=None, start=None, end=None):
+    """Keep the dashboard totals current from GET /live; runs until a rerun stops the script."""
+    while True:
+        refetch = False
+        try:
+            # Subscribe before reading the totals so no sale falls in between
+            with api.LiveEvents(api_url) as events:
+                resp = api.request("GET", api_url, "/analytics/summary",
+                                   params=analytics_params(category, start, end))
+                if resp.status_code != 200:
+                    raise api.APIError(resp)
+                summary = resp.json()
+                show_summary(slot, summary)
+                updated = datetime.now()
+
+                for item in events:
+                    # Touching the page on every tick lets Streamlit stop us on a rerun
+                    status.caption(f"🟢 Live · updated {updated:%H:%M:%S}")
+                    if item is None:
+                        continue
+                    event, data = item
+                    if event == 'reset' or (event == 'stock' and
+                                            any(p['stock'] is None for p in data)):
+                        # Updates were dropped, or a deleted product took its
+                        # sales with it: start over from fresh totals
+                        refetch = True
+                        break
+                    if event != 'sales':
+                        continue
+                    sold = data['categories'].get(category) if category else \
+                        [data['count'], data['quantity'], data['amount']]
+                    if sold:
+                        summary['sale_count'] += sold[0]
+                        summary['total_quantity'] += sold[1]
+                        summary['total_sales'] += sold[2]
+                        show_summary(slot, summary)
+                        updated = datetime.now()
+        except (requests.RequestException, api.APIError) as e:
+            status.warning(f"Live updates interrupted ({e}); reconnecting")
+        if not refetch:
+            time.sleep(2)
+
+
+def fetch_sales_by_product(category=None, start=None, end=None, top=None):
+    try:
+        return pd.DataFrame(api.get_json(api_url, "/analytics/sales-by-product",
+                                         analytics_params(category, start, end, top)))
+    except api.APIError as e:
+        st.error(f"Failed to fetch sales by product: {e.status_code}")
         return pd.DataFrame()
 
 
 if section == "Products 🛒":
     st.header("🧾 Products Management")
 
-    tab_list, tab_create, tab_update, tab_patch, tab_delete = st.tabs([
+    tab_list, tab_create, tab_update, tab_patch, tab_delete, tab_low = st.tabs([
         "List 📋", "Create ➕", "Full Update (PUT) 🔄",
-        "Partial Update (PATCH) ✏️", "Delete 🗑️"
+        "Partial Update (PATCH) ✏️", "Delete 🗑️", "Low Stock ⚠️"
     ])
 
     with tab_list:
@@ -123,7 +316,7 @@ if section == "Products 🛒":
                 "category": category or None
             }
             try:
-                resp = requests.post(f"{api_url}/products", json=payload)
+                resp = api.send("POST", api_url, "/products", json=payload)
                 show_response(resp, "POST", "/products")
             except Exception as e:
                 st.error(f"Error: {e}")
@@ -156,7 +349,7 @@ if section == "Products 🛒":
             }
             try:
                 endpoint = f"/products/{int(pid)}"
-                resp = requests.put(f"{api_url}{endpoint}", json=payload)
+                resp = api.send("PUT", api_url, endpoint, json=payload)
                 if resp.status_code == 404:
                     st.error(f"❌ Product with ID {pid} not found!")
                 show_response(resp, "PUT", endpoint)
@@ -201,8 +394,7 @@ if section == "Products 🛒":
             else:
                 try:
                     endpoint = f"/products/{int(pid2)}"
-                    resp = requests.patch(f"{api_url}{endpoint}",
-                                          json=patch_payload)
+                    resp = api.send("PATCH", api_url, endpoint, json=patch_payload)
 
                     if resp.status_code == 404:
                         st.error(f"❌ Product with ID {pid2} not found!")
@@ -227,7 +419,7 @@ if section == "Products 🛒":
             if st.button("Delete product 🗑️"):
                 try:
                     endpoint = f"/products/{int(pid3)}"
-                    resp = requests.delete(f"{api_url}{endpoint}")
+                    resp = api.send("DELETE", api_url, endpoint)
 
                     if resp.status_code == 404:
                         st.error(f"❌ Product with ID {pid3} not found!")
@@ -240,6 +432,39 @@ if section == "Products 🛒":
             st.warning(
                 "Please confirm the deletion by checking the box above.")
 
+    with tab_low:
+        st.subheader("Low Stock & Reorder Levels")
+
+        low_category = st.text_input("Category (optional)", "", key="low_category")
+        use_velocity = st.checkbox("Rank by days of stock left", key="low_velocity")
+        days = st.number_input("Sales window (days)", min_value=1, max_value=365, value=14,
+                               step=1, format="%d", key="low_days", disabled=not use_velocity)
+
+        if st.button("Show Low Stock ⚠️"):
+            low = fetch_low_stock(low_category.strip() or None, int(days) if use_velocity else None)
+            if low is not None and low.empty:
+                st.success("Every product is above its reorder level.")
+            elif low is not None:
+                if not use_velocity:
+                    low = low.drop(columns=['daily_sales', 'days_left'])
+                st.dataframe(low, use_container_width=True)
+
+        with st.form("reorder_level"):
+            pid4 = st.number_input("Product ID", min_value=1, step=1, format="%d", key="reorder_pid")
+            level = st.number_input("Reorder level", min_value=0, step=1, format="%d",
+                                    key="reorder_level")
+            level_submit = st.form_submit_button("Set Reorder Level ⚠️")
+
+        if level_submit:
+            try:
+                endpoint = f"/products/{int(pid4)}/reorder-level"
+                resp = api.send("PUT", api_url, endpoint, json={"reorder_level": int(level)})
+                if resp.status_code == 404:
+                    st.error(f"❌ Product with ID {pid4} not found!")
+                show_response(resp, "PUT", endpoint)
+            except Exception as e:
+                st.error(f"Error: {e}")
+
 
 
 
@@ -252,32 +477,51 @@ elif section == "Sales 💳":
     with tab_s_list:
         st.subheader("All Sales")
         if st.button("Refresh Sales List 🔄"):
-            sdf = fetch_sales()
-            if not sdf.empty:
-                st.dataframe(sdf, use_container_width=True)
+            added, deleted = sync_sales()
+            st.caption(f"Synced {added} new and {deleted} deleted sale(s).")
+
+        local = st.session_state.get('sales_copy')
+        if local is not None:
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Total Sales", f"₹{local['total_sales']:,.2f}")
+            with col2:
+                st.metric("Total Quantity Sold", f"{local['total_quantity']:,}")
+            with col3:
+                st.metric("Sales", f"{local['sale_count']:,}")
+            with col4:
+                st.metric("Products Sold", f"{len(local['product_sales']):,}")
+
+            if local['chunks']:
+                if len(local['chunks']) > 1:
+                    local['chunks'] = [pd.concat(local['chunks'], ignore_index=True)]
+                st.dataframe(local['chunks'][0], use_container_width=True)
             else:
                 st.write("No sales records available.")
-                st.dataframe(sdf.columns.to_frame().T, use_container_width=True)  # Show only column names
+                st.dataframe(pd.DataFrame(columns=SALE_COLUMNS), use_container_width=True)  # Show only column names
 
 
 
 
     with tab_s_create:
         st.subheader("Create New Sale")
-        prod_df = fetch_products()
-        if prod_df.empty:
-            st.warning("No products available. Create products first.")
+        query = st.text_input("Find Product (name or category)", "", key="sale_product_search",
+                              placeholder="Start typing, e.g. man").strip()
+        matches = search_products(query) if query else []
+        if not query:
+            st.info("Type part of a product name or category to pick a product.")
+        elif not matches:
+            st.warning(f"No products match '{query}'.")
         else:
             prod_options = {
-                row['name'] + f" (id={row['id']}, stock={row['stock']})":
-                int(row['id'])
-                for _, row in prod_df.iterrows()
+                f"{p['name']} (id={p['id']}, stock={p['stock']})": p
+                for p in matches
             }
             
             sel = st.selectbox("Select Product", list(prod_options.keys()))
-            selected_pid = prod_options[sel]
+            selected_product = prod_options[sel]
+            selected_pid = selected_product['id']
             
-            selected_product = prod_df.loc[prod_df['id'] == selected_pid].iloc[0]
             price = selected_product['price']
             stock = selected_product['stock']
             
@@ -298,7 +542,7 @@ elif section == "Sales 💳":
                 }
                 try:
 
-                    resp = requests.post(f"{api_url}/sales", json=payload)
+                    resp = api.send("POST", api_url, "/sales", json=payload)
                     if resp.status_code == 400:
                         st.error(f"Transaction failed: {resp.json()['detail']}")
                     show_response(resp, "POST", "/sales")
@@ -313,47 +557,40 @@ elif section == "Sales 💳":
 elif section == "List & Charts 📊":
     st.header("📈 Sales Dashboard")
 
-    col1, col2, col3, col4 = st.columns(4)
-
-    prod_df = fetch_products()
-    sdf = fetch_sales()
-
-    if sdf.empty or prod_df.empty:
-        st.warning("No data available to generate the dashboard.")
+    fcol1, fcol2, fcol3 = st.columns(3)
+    with fcol1:
+        dash_category = st.text_input("Category (optional)", "", key="dash_category").strip() or None
+    with fcol2:
+        dash_start = st.date_input("From", value=None, key="dash_start")
+    with fcol3:
+        dash_end = st.date_input("To", value=None, key="dash_end")
+
+    # New sales are stamped now, so they only move totals whose range includes today
+    today = datetime.now().date()
+    live_in_range = (dash_start is None or dash_start <= today) and (dash_end is None or dash_end >= today)
+    live = st.toggle("Live updates", key="dash_live", disabled=not live_in_range,
+                     help="Update the sales totals as sales come in (the range must include today); "
+                          "product and category counts refresh on the next reload")
+    live_status = st.empty()
+    summary_slot = st.empty()
+
+    if live and live_in_range:
+        # Filled in by live_summary() once the rest of the page is drawn
+        live_status.caption("🟡 Connecting…")
     else:
-        total_sales = sdf['total_amount'].sum()
-        total_quantity = sdf['quantity'].sum()
-        total_products = len(prod_df)
-        total_categories = prod_df['category'].nunique()
-        container = st.container(border=True)
-
-        with container:
-
-            col1, col2, col3, col4 = st.columns(4)
-
-            with col1:
-                st.metric("Total Sales", f"₹{total_sales:,.2f}")
-            with col2:
-                st.metric("Total Quantity Sold", f"{total_quantity:,}")
-            with col3:
-                st.metric("Total Products", f"{total_products:,}")
-            with col4:
-                st.metric("Total Categories", f"{total_categories:,}")
+        show_summary(summary_slot, fetch_summary(dash_category, dash_start, dash_end))
 
 
 
     st.subheader("Sales Breakdown by Product")
     chart_type = st.selectbox("Select Chart Type", ["Pie", "Bar", "Line"], key="chart_type")
+    top_n = st.number_input("Top products (the rest are grouped as Others)",
+                            min_value=1, value=10, step=1, key="top_n")
 
     if st.button("Generate Chart 📊"):
-        if not sdf.empty:
-            grouped = sdf.groupby('product_id').agg({
-                'total_amount': 'sum',
-                'quantity': 'sum'
-            }).reset_index()
-
-            grouped = grouped.merge(prod_df[['id', 'name']], left_on='product_id', right_on='id', how='left')
+        grouped = fetch_sales_by_product(dash_category, dash_start, dash_end, top_n)
 
+        if not grouped.empty:
             st.write("Aggregated Sales Data")
             st.dataframe(grouped, use_container_width=True)
 
@@ -386,3 +623,16 @@ elif section == "List & Charts 📊":
         else:
             st.warning("No data available to generate the selected chart.")
 
+
+# Requests that reached the API during this rerun (cached reads don't count)
+backend_calls = api.calls()
+st.sidebar.caption(f"Backend calls this rerun: {len(backend_calls)}")
+if backend_calls:
+    with st.sidebar.expander("Show calls"):
+        for method, path, status in backend_calls:
+            st.text(f"{method} {path} -> {status}")
+
+
+if section == "List & Charts 📊" and live and live_in_range:
+    # Blocks here; any widget change reruns the script and stops it
+    live_summary(summary_slot, live_status, dash_category, dash_start, dash_end)
@@ -0,0 +1,211 @@
+# daily_product_sales: the sales fact table rolled up to one row per
+# (day, product). create_sale, the basket checkout and delete_product keep it
+# current inside their own transactions, so reports read days x products
+# rows instead of rescanning every sale.
+#
+#   python rollup.py rebuild [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+#   python rollup.py check
+
+import argparse
+import sys
+from datetime import timedelta
+
+
+def create_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS daily_product_sales (
+            day TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            category TEXT,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            total_amount REAL NOT NULL DEFAULT 0,
+            sale_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, product_id),
+            FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS ix_daily_product_sales_product
+        ON daily_product_sales (product_id)
+    """)
+
+
+def needs_backfill(conn):
+    # True when sales exist but the rollup was never filled (e.g. a new table)
+    if conn.execute("SELECT 1 FROM daily_product_sales LIMIT 1").fetchone():
+        return False
+    return conn.execute("SELECT 1 FROM sales LIMIT 1").fetchone() is not None
+
+
+def sale_day(sale_date):
+    return str(sale_date)[:10]
+
+
+# The statements are exposed so backend_async.py can run them on its own
+# connections; the helpers below are for DB-API cursors
+
+RECORD_SQL = """
+    INSERT INTO daily_product_sales (day, product_id, category, quantity, total_amount, sale_count)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (day, product_id) DO UPDATE SET
+        category = excluded.category,
+        quantity = daily_product_sales.quantity + excluded.quantity,
+        total_amount = daily_product_sales.total_amount + excluded.total_amount,
+        sale_count = daily_product_sales.sale_count + excluded.sale_count
+"""
+
+# Null-safe "category changed" test that both SQLite and Postgres accept
+SET_CATEGORY_SQL = """
+    UPDATE daily_product_sales SET category=?
+    WHERE product_id=?
+      AND (category <> ? OR (category IS NULL) <> (CAST(? AS TEXT) IS NULL))
+"""
+
+FORGET_SQL = "DELETE FROM daily_product_sales WHERE product_id=?"
+
+
+def rollup_rows(sales):
+    """Fold (sale_date, product_id, category, quantity, total_amount) tuples into RECORD_SQL rows."""
+    totals = {}
+    for sale_date, product_id, category, quantity, amount in sales:
+        key = (sale_day(sale_date), product_id)
+        row = totals.setdefault(key, [category, 0, 0.0, 0])
+        row[1] += quantity
+        row[2] += amount
+        row[3] += 1
+    return [(day, pid, *row) for (day, pid), row in totals.items()]
+
+
+def record_sales(cur, sales):
+    cur.executemany(RECORD_SQL, rollup_rows(sales))
+
+
+def set_category_params(product_id, category):
+    return (category, product_id, category, category)
+
+
+def set_category(cur, product_id, category):
+    cur.execute(SET_CATEGORY_SQL, set_category_params(product_id, category))
+
+
+def forget_product(cur, product_id):
+    cur.execute(FORGET_SQL, (product_id,))
+
+
+def _range(column, start, end):
+    clauses, params = [], []
+    if start:
+        clauses.append(f"{column} >= ?")
+        params.append(str(start))
+    if end:
+        clauses.append(f"{column} <= ?")
+        params.append(str(end))
+    return clauses, params
+
+
+def _hot_start(conn, start):
+    # Days the archiver moved out of sales (sales_archive.py) can't be
+    # recomputed from it; their rollup rows are kept as they are
+    import sales_archive
+
+    archived = sales_archive.archived_through(conn)
+    if archived is None or (start and str(start) > str(archived)):
+        return start
+    return str(archived + timedelta(days=1))
+
+
+def rebuild(conn, start=None, end=None):
+    """Recompute the rollup from sales for the given days (all days by default)."""
+    start = _hot_start(conn, start)
+    conn.begin()
+    count = fill(conn, start, end)
+    conn.commit()
+    return count
+
+
+def fill(conn, start=None, end=None):
+    # rebuild() without the transaction handling, for use inside migrations
+    clauses, params = _range("day", start, end)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    conn.execute(f"DELETE FROM daily_product_sales{where}", params)
+
+    day = conn.backend.day("s.sale_date")
+    clauses, params = _range(day, start, end)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    cur = conn.execute(f"""
+        INSERT INTO daily_product_sales (day, product_id, category, quantity, total_amount, sale_count)
+        SELECT {day}, s.product_id, p.category,
+               SUM(s.quantity), SUM(s.total_amount), COUNT(*)
+        FROM sales s JOIN products p ON p.id = s.product_id
+        {where}
+        GROUP BY {day}, s.product_id, p.category
+    """, params)
+    return cur.rowcount
+
+
+def check(conn, start=None, end=None, tolerance=1e-6):
+    """Compare the rollup with a fresh aggregate of sales; returns the mismatching keys."""
+    start = _hot_start(conn, start)
+    day = conn.backend.day("s.sale_date")
+    clauses, params = _range(day, start, end)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    expected = {
+        (row["day"], row["product_id"]): row
+        for row in conn.execute(f"""
+            SELECT {day} AS day, s.product_id, p.category,
+                   SUM(s.quantity) AS quantity, SUM(s.total_amount) AS total_amount,
+                   COUNT(*) AS sale_count
+            FROM sales s JOIN products p ON p.id = s.product_id
+            {where}
+            GROUP BY {day}, s.product_id, p.category
+        """, params).fetchall()
+    }
+
+    clauses, params = _range("day", start, end)
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+    actual = {
+        (row["day"], row["product_id"]): row
+        for row in conn.execute(f"SELECT * FROM daily_product_sales{where}", params).fetchall()
+    }
+
+    problems = []
+    for key in sorted(expected.keys() | actual.keys()):
+        want, got = expected.get(key), actual.get(key)
+        if want is None or got is None:
+            problems.append({"day": key[0], "product_id": key[1], "expected": want, "actual": got})
+            continue
+        if (want["quantity"] != got["quantity"]
+                or want["sale_count"] != got["sale_count"]
+                or want["category"] != got["category"]
+                or abs(want["total_amount"] - got["total_amount"])
+                > tolerance * max(1.0, abs(want["total_amount"]))):
+            problems.append({"day": key[0], "product_id": key[1], "expected": want, "actual": got})
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or verify the daily_product_sales rollup")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--start", help="first day (YYYY-MM-DD), inclusive")
+    parser.add_argument("--end", help="last day (YYYY-MM-DD), inclusive")
+    args = parser.parse_args()
+
+    from migrations import migrate
+    from storage import get_conn
+
+    with get_conn() as conn:
+        migrate(conn)
+
+        if args.command == "rebuild":
+            print(f"Rebuilt {rebuild(conn, args.start, args.end)} rollup rows.")
+            return 0
+
+        problems = check(conn, args.start, args.end)
+    for problem in problems:
+        print(problem)
+    print("Rollup is consistent." if not problems else f"{len(problems)} mismatched rows.")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,887 @@
+# Hot / cold storage for sales
+#
+# The sales table keeps the last SALES_HOT_MONTHS calendar months (the
+# current one included). Older, closed months are moved by the archiver to
+# zstd-compressed Parquet files under SALES_ARCHIVE_DIR, one or more files
+# per month, each sorted by id, and listed in the sales_archive table:
+#
+#   python sales_archive.py run [--keep-months N] [--dry-run]
+#   python sales_archive.py status
+#   python sales_archive.py partition      # Postgres, once, in a maintenance window
+#
+# Run it from cron, daily or weekly, on a host that sees the same
+# SALES_ARCHIVE_DIR as the API workers.
+#
+# Postgres: `partition` rebuilds sales as a table partitioned by month
+# (sales_pYYYY_MM), with sales_default catching anything outside the
+# existing partitions. It copies the whole table under an exclusive lock,
+# so tills are blocked until it finishes; it is never run by the migrations
+# or on startup. Once sales is partitioned, each run also creates the
+# partitions for the coming PARTITIONS_AHEAD months and moves matching rows
+# out of sales_default, and archiving a month detaches and drops its
+# partition, so the hot table never pays for a bulk DELETE. Until then the
+# archiver deletes archived months like it does on SQLite.
+#
+# SQLite has no partitioning, and routing inserts to per-month tables would
+# touch every write path, so sales stays one table there. The archiver
+# deletes the archived month through the sale_date index, one month per
+# write transaction; schedule it off-peak.
+#
+# A month is exported first and then, in one transaction, checked to be
+# unchanged (row count and id sum), recorded in sales_archive and removed
+# from sales. Readers never see it twice or not at all. Archiving is not
+# deleting: nothing goes to sale_deletions, and the rollup keeps the
+# archived days, so the dashboard totals don't move.
+#
+# Reads merge archived rows back in by id (ArchiveQuery) whenever the query
+# reaches an archived month: GET /sales with no date range or one that
+# starts before the hot months, and /sales/changes from an old cursor.
+#
+# Deleting a product never rewrites the files. In delete_product's
+# transaction, forget_product reads the product's archived sales from the
+# files whose product id range covers it, so they are logged in
+# sale_deletions for /sales/changes right away, and records the product in
+# sales_archive_forgotten; reads skip its rows from then on. The next run
+# rewrites the files that hold them and clears the record in one
+# transaction (purge).
+
+import argparse
+import heapq
+import os
+import sys
+import time as clock
+import uuid
+from collections import Counter, deque
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from fastapi.concurrency import run_in_threadpool
+
+
+ARCHIVE_DIR = os.getenv("SALES_ARCHIVE_DIR", "archive")
+HOT_MONTHS = int(os.getenv("SALES_HOT_MONTHS", "3"))
+# Postgres partitions created ahead of the current month
+PARTITIONS_AHEAD = 2
+# Parquet row groups are pruned on their id / sale_date statistics
+ROW_GROUP_ROWS = 65536
+EXPORT_CHUNK_ROWS = 10000
+READ_BATCH_ROWS = 1000
+# Files no manifest row points at (a rolled-back delete, an interrupted
+# export) are removed by the next run once they are this old
+ORPHAN_SECONDS = 3600
+
+COLUMNS = ["id", "product_id", "quantity", "total_amount", "sale_date"]
+
+MANIFEST_SQL = "SELECT * FROM sales_archive ORDER BY min_id"
+
+INSERT_SQL = """
+    INSERT INTO sales_archive (path, period, row_count, min_id, max_id, first_sale, last_sale,
+                               min_product_id, max_product_id, archived_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# A purge replaces or drops a file only if no other run got to it first
+REPLACE_SQL = """
+    UPDATE sales_archive SET path=?, row_count=?, min_id=?, max_id=?, first_sale=?, last_sale=?,
+                             min_product_id=?, max_product_id=?
+    WHERE id=? AND path=?
+"""
+
+DROP_SQL = "DELETE FROM sales_archive WHERE id=? AND path=?"
+
+FORGOTTEN_SQL = "SELECT product_id FROM sales_archive_forgotten"
+
+FORGET_PRODUCT_SQL = "INSERT INTO sales_archive_forgotten (product_id, deleted_at) VALUES (?, ?)"
+
+
+class PeriodChanged(RuntimeError):
+    pass
+
+
+def create_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS sales_archive (
+            id {conn.backend.serial_pk},
+            path TEXT NOT NULL UNIQUE,
+            period TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            first_sale TEXT NOT NULL,
+            last_sale TEXT NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+    """)
+
+
+def create_forgotten_table(conn):
+    # Files archived before this have no product range (NULL): any of them
+    # may hold a deleted product's sales
+    conn.execute("ALTER TABLE sales_archive ADD COLUMN min_product_id INTEGER")
+    conn.execute("ALTER TABLE sales_archive ADD COLUMN max_product_id INTEGER")
+    deleted_at = "TIMESTAMP" if conn.backend.name == "postgres" else "TEXT"
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS sales_archive_forgotten (
+            product_id INTEGER PRIMARY KEY,
+            deleted_at {deleted_at} NOT NULL
+        )
+    """)
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(start):
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def previous_month(start):
+    return month_start(start - timedelta(days=1))
+
+
+def _as_datetime(value):
+    # SQLite hands sale_date back as ISO-8601 text
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+# Postgres partitions
+
+def partition_name(start):
+    return f"sales_p{start:%Y_%m}"
+
+
+def _exists(conn, name):
+    return conn.execute("SELECT to_regclass(?) IS NOT NULL AS found", (name,)).fetchone()["found"]
+
+
+def is_partitioned(conn):
+    if conn.backend.name != "postgres":
+        return False
+    return conn.execute("SELECT relkind = 'p' AS partitioned FROM pg_class "
+                        "WHERE oid = 'sales'::regclass").fetchone()["partitioned"]
+
+
+def partition(conn, now=None):
+    """Partition sales by month (the `partition` command); returns False if it already is."""
+    conn.backend.lock_migrations(conn.raw)
+    try:
+        conn.begin()
+        if is_partitioned(conn):
+            conn.rollback()
+            return False
+        partition_sales(conn, now)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.backend.unlock_migrations(conn.raw)
+    return True
+
+
+def partition_sales(conn, now=None):
+    """Rebuild the plain sales table as one partitioned by month (Postgres), in the caller's transaction."""
+    # One copy under an exclusive lock: every sale waits until it commits
+    conn.execute("LOCK TABLE sales IN ACCESS EXCLUSIVE MODE")
+    conn.execute("ALTER TABLE sales RENAME TO sales_unpartitioned")
+    conn.execute("ALTER TABLE sales_unpartitioned RENAME CONSTRAINT sales_pkey TO sales_unpartitioned_pkey")
+    conn.execute("DROP INDEX IF EXISTS ix_sales_product_id")
+    conn.execute("DROP INDEX IF EXISTS ix_sales_sale_date")
+    # Keep the id sequence when the old table goes
+    conn.execute("ALTER SEQUENCE sales_id_seq OWNED BY NONE")
+
+    # The partition key has to be part of the primary key
+    conn.execute("""
+        CREATE TABLE sales (
+            id INTEGER NOT NULL DEFAULT nextval('sales_id_seq'),
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            quantity INTEGER NOT NULL,
+            total_amount REAL NOT NULL,
+            sale_date TIMESTAMP NOT NULL,
+            PRIMARY KEY (id, sale_date)
+        ) PARTITION BY RANGE (sale_date)
+    """)
+    conn.execute("ALTER SEQUENCE sales_id_seq OWNED BY sales.id")
+    conn.execute("CREATE TABLE sales_default PARTITION OF sales DEFAULT")
+    conn.execute("CREATE INDEX ix_sales_product_id ON sales (product_id)")
+    conn.execute("CREATE INDEX ix_sales_sale_date ON sales (sale_date)")
+
+    first = conn.execute("SELECT MIN(sale_date) AS first FROM sales_unpartitioned").fetchone()["first"]
+    now = now or datetime.now()
+    start = month_start(first or now)
+    while start <= month_start(now):
+        _create_partition(conn, start)
+        start = next_month(start)
+    for _ in range(PARTITIONS_AHEAD):
+        _create_partition(conn, start)
+        start = next_month(start)
+
+    conn.execute("""
+        INSERT INTO sales (id, product_id, quantity, total_amount, sale_date)
+        SELECT id, product_id, quantity, total_amount, sale_date FROM sales_unpartitioned
+    """)
+    conn.execute("DROP TABLE sales_unpartitioned")
+
+
+def _create_partition(conn, start):
+    name = partition_name(start)
+    if _exists(conn, name):
+        return False
+    end = next_month(start)
+    # Rows that already landed in sales_default for this month move with it
+    conn.execute("LOCK TABLE sales_default IN SHARE ROW EXCLUSIVE MODE")
+    conn.execute(f"CREATE TABLE {name} (LIKE sales INCLUDING DEFAULTS)")
+    conn.execute(f"""
+        WITH moved AS (DELETE FROM sales_default WHERE sale_date >= ? AND sale_date < ? RETURNING *)
+        INSERT INTO {name} SELECT * FROM moved
+    """, (start, end))
+    conn.execute(f"ALTER TABLE sales ATTACH PARTITION {name} "
+                 f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')")
+    return True
+
+
+def ensure_partitions(conn, now=None):
+    """Create this month's and the next PARTITIONS_AHEAD months' partitions; returns the new names."""
+    created = []
+    conn.backend.lock_migrations(conn.raw)
+    try:
+        conn.begin()
+        start = month_start(now or datetime.now())
+        for _ in range(PARTITIONS_AHEAD + 1):
+            if _create_partition(conn, start):
+                created.append(partition_name(start))
+            start = next_month(start)
+        conn.commit()
+    finally:
+        conn.backend.unlock_migrations(conn.raw)
+    return created
+
+
+# Writing the archive
+
+def _new_path(period):
+    return f"sales-{period}-{uuid.uuid4().hex[:8]}.parquet"
+
+
+def _file_stats(table):
+    import pyarrow.compute as pc
+
+    ids = pc.min_max(table["id"]).as_py()
+    dates = pc.min_max(table["sale_date"]).as_py()
+    products = pc.min_max(table["product_id"]).as_py()
+    return {
+        "row_count": table.num_rows,
+        "min_id": ids["min"],
+        "max_id": ids["max"],
+        "first_sale": dates["min"].isoformat(),
+        "last_sale": dates["max"].isoformat(),
+        "min_product_id": products["min"],
+        "max_product_id": products["max"],
+    }
+
+
+def _write(path, batches):
+    """Write record batches (in id order) to path via a temp file; returns their stats."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    import arrow_export
+
+    schema = arrow_export.schema("sales", COLUMNS)
+    tmp = path + ".tmp"
+    stats = None
+    pending, pending_rows = [], 0
+
+    def flush():
+        nonlocal stats
+        table = pa.Table.from_batches(pending, schema=schema)
+        writer.write_table(table, row_group_size=ROW_GROUP_ROWS)
+        part = _file_stats(table)
+        if stats is None:
+            stats = part
+        else:
+            stats["row_count"] += part["row_count"]
+            stats["min_id"] = min(stats["min_id"], part["min_id"])
+            stats["max_id"] = max(stats["max_id"], part["max_id"])
+            stats["first_sale"] = min(stats["first_sale"], part["first_sale"])
+            stats["last_sale"] = max(stats["last_sale"], part["last_sale"])
+            stats["min_product_id"] = min(stats["min_product_id"], part["min_product_id"])
+            stats["max_product_id"] = max(stats["max_product_id"], part["max_product_id"])
+        pending.clear()
+
+    writer = pq.ParquetWriter(tmp, schema, compression="zstd")
+    try:
+        for batch in batches:
+            if batch.num_rows:
+                pending.append(batch)
+                pending_rows += batch.num_rows
+            if pending_rows >= ROW_GROUP_ROWS:
+                flush()
+                pending_rows = 0
+        if pending:
+            flush()
+    except BaseException:
+        writer.close()
+        os.remove(tmp)
+        raise
+    writer.close()
+    if stats is None:
+        os.remove(tmp)
+        return None
+    os.replace(tmp, path)
+    return stats
+
+
+def _period_sql(select):
+    return f"SELECT {select} FROM sales WHERE sale_date >= ? AND sale_date < ?"
+
+
+def export_period(conn, start, directory=ARCHIVE_DIR):
+    """Copy one month of sales to a new Parquet file; returns (path, stats, id sum) or None if empty."""
+    import arrow_export
+
+    schema = arrow_export.schema("sales", COLUMNS)
+    os.makedirs(directory, exist_ok=True)
+    rel = _new_path(f"{start:%Y-%m}")
+    id_sum = 0
+
+    def batches():
+        nonlocal id_sum
+        sql = _period_sql(", ".join(COLUMNS)) + " ORDER BY id"
+        for rows in conn.stream(sql, (start, next_month(start)), EXPORT_CHUNK_ROWS):
+            id_sum += sum(row["id"] for row in rows)
+            yield arrow_export.record_batch(rows, schema)
+
+    try:
+        stats = _write(os.path.join(directory, rel), batches())
+    finally:
+        # End the read transaction (Postgres streams through a named cursor)
+        conn.rollback()
+    return None if stats is None else (rel, stats, id_sum)
+
+
+def _remove_period(conn, start, end):
+    if conn.backend.name == "postgres":
+        name = partition_name(start)
+        if _exists(conn, name):
+            conn.execute(f"ALTER TABLE sales DETACH PARTITION {name}")
+            conn.execute(f"DROP TABLE {name}")
+    # Everything on SQLite; on Postgres, late rows sitting in sales_default
+    conn.execute("DELETE FROM sales WHERE sale_date >= ? AND sale_date < ?", (start, end))
+
+
+def archive_period(conn, start, directory=ARCHIVE_DIR):
+    """Move one month from sales to the archive; returns the rows moved (0 if it was empty)."""
+    end = next_month(start)
+    exported = export_period(conn, start, directory)
+    if exported is None:
+        return 0
+    rel, stats, id_sum = exported
+    path = os.path.join(directory, rel)
+
+    try:
+        conn.begin()
+        if conn.backend.name == "postgres":
+            # Holds off new sales for the check and the (metadata-only) drop
+            conn.execute("LOCK TABLE sales IN SHARE ROW EXCLUSIVE MODE")
+        now = conn.execute(_period_sql("COUNT(*) AS n, COALESCE(SUM(id), 0) AS ids"), (start, end)).fetchone()
+        if now["n"] != stats["row_count"] or now["ids"] != id_sum:
+            raise PeriodChanged(f"{start:%Y-%m} changed while it was being exported; run again")
+        conn.execute(INSERT_SQL, (rel, f"{start:%Y-%m}", stats["row_count"], stats["min_id"],
+                                  stats["max_id"], stats["first_sale"], stats["last_sale"],
+                                  stats["min_product_id"], stats["max_product_id"],
+                                  datetime.now().isoformat()))
+        _remove_period(conn, start, end)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        _remove_file(path)
+        raise
+    return stats["row_count"]
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # Still open somewhere (Windows); cleanup() gets it next run
+        pass
+
+
+def cleanup(conn, directory=ARCHIVE_DIR, min_age=ORPHAN_SECONDS):
+    """Remove archive files no manifest row points at; returns their names."""
+    if not os.path.isdir(directory):
+        return []
+    referenced = {row["path"] for row in conn.execute(MANIFEST_SQL).fetchall()}
+    conn.rollback()
+    removed = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if (name.startswith("sales-") and name not in referenced
+                and clock.time() - os.path.getmtime(path) > min_age):
+            _remove_file(path)
+            removed.append(name)
+    return removed
+
+
+def hot_cutoff(keep_months=HOT_MONTHS, now=None):
+    """First day of the oldest month that stays in the database."""
+    if keep_months < 1:
+        raise ValueError("keep_months must be at least 1: the current month is never archived")
+    cutoff = month_start(now or datetime.now())
+    for _ in range(keep_months - 1):
+        cutoff = previous_month(cutoff)
+    return cutoff
+
+
+def closed_months(conn, cutoff):
+    """[(month start, rows)] still in sales before cutoff, oldest first."""
+    first = conn.execute("SELECT MIN(sale_date) AS first FROM sales WHERE sale_date < ?",
+                         (cutoff,)).fetchone()["first"]
+    months = []
+    start = month_start(_as_datetime(first)) if first is not None else cutoff
+    while start < cutoff:
+        n = conn.execute(_period_sql("COUNT(*) AS n"), (start, next_month(start))).fetchone()["n"]
+        if n:
+            months.append((start, n))
+        start = next_month(start)
+    conn.rollback()
+    return months
+
+
+def run(conn, keep_months=HOT_MONTHS, directory=ARCHIVE_DIR, dry_run=False, now=None, log=print):
+    """Archive every month before the last keep_months; returns {period: rows moved (or to move)}."""
+    cutoff = hot_cutoff(keep_months, now)
+    if is_partitioned(conn) and not dry_run:
+        for name in ensure_partitions(conn, now):
+            log(f"created partition {name}")
+
+    if dry_run:
+        waiting = len(conn.execute(FORGOTTEN_SQL).fetchall())
+        conn.rollback()
+        if waiting:
+            log(f"would purge the archived sales of {waiting} deleted product(s)")
+    else:
+        try:
+            for pid, n in purge(conn, directory).items():
+                log(f"purged {n} archived sales of deleted product {pid}")
+        except PeriodChanged as exc:
+            log(str(exc))
+
+    moved = {}
+    for start, n in closed_months(conn, cutoff):
+        period = f"{start:%Y-%m}"
+        if dry_run:
+            moved[period] = n
+            log(f"{period}: would archive {n} sales")
+            continue
+        try:
+            moved[period] = archive_period(conn, start, directory)
+        except PeriodChanged as exc:
+            log(str(exc))
+            continue
+        log(f"{period}: archived {moved[period]} sales")
+
+    if not dry_run:
+        for name in cleanup(conn, directory):
+            log(f"removed orphaned {name}")
+    return moved
+
+
+def archived_through(conn):
+    """Last day of the newest archived month, or None when nothing is archived."""
+    row = conn.execute("SELECT MAX(period) AS period FROM sales_archive").fetchone()
+    if row["period"] is None:
+        return None
+    start = datetime.strptime(row["period"], "%Y-%m")
+    return (next_month(start) - timedelta(days=1)).date()
+
+
+# Product deletion
+
+def _may_hold(entry, product_ids):
+    low, high = entry["min_product_id"], entry["max_product_id"]
+    return low is None or any(low <= pid <= high for pid in product_ids)
+
+
+def _product_sales(manifest, product_id, directory):
+    # Reads only the files whose product range covers it, and of those
+    # only the row groups the product_id filter can't rule out
+    import pyarrow.dataset as ds
+
+    sales = []
+    for entry in manifest:
+        if _may_hold(entry, [product_id]):
+            dataset = ds.dataset(os.path.join(directory, entry["path"]), format="parquet")
+            sales.extend(dataset.to_table(columns=["id", "product_id", "quantity", "total_amount"],
+                                          filter=ds.field("product_id") == product_id).to_pylist())
+    return sales
+
+
+def forget_product(conn, product_id, directory=ARCHIVE_DIR):
+    """Hide a product's archived sales from reads, inside delete_product's transaction; returns them.
+
+    The files are left alone: the next run's purge() rewrites them.
+    """
+    sales = _product_sales(conn.execute(MANIFEST_SQL).fetchall(), product_id, directory)
+    if sales:
+        conn.execute(FORGET_PRODUCT_SQL, (product_id, datetime.now().isoformat()))
+    return sales
+
+
+async def forget_product_async(conn, product_id, deleted_at, directory=ARCHIVE_DIR):
+    manifest = await conn.fetchall(MANIFEST_SQL)
+    sales = await run_in_threadpool(_product_sales, manifest, product_id, directory)
+    if sales:
+        await conn.execute(FORGET_PRODUCT_SQL, (product_id, deleted_at))
+    return sales
+
+
+def _without_products(entry, product_ids, directory):
+    # (the products' archived sales, stats of the rewritten file or None)
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    path = os.path.join(directory, entry["path"])
+    wanted = pa.array(sorted(product_ids), pa.int64())
+    # One int column is enough to tell whether this file needs rewriting
+    column = pq.read_table(path, columns=["product_id"])["product_id"]
+    if not pc.any(pc.is_in(column, value_set=wanted)).as_py():
+        return [], None
+
+    table = pq.read_table(path)
+    mask = pc.is_in(table["product_id"], value_set=wanted)
+    removed = table.filter(mask).to_pylist()
+    kept = table.filter(pc.invert(mask))
+    if kept.num_rows == 0:
+        return removed, None
+    rel = _new_path(entry["period"])
+    stats = _write(os.path.join(directory, rel), kept.to_batches(max_chunksize=ROW_GROUP_ROWS))
+    stats["path"] = rel
+    return removed, stats
+
+
+def _replace_params(stats, entry):
+    return (stats["path"], stats["row_count"], stats["min_id"], stats["max_id"],
+            stats["first_sale"], stats["last_sale"], stats["min_product_id"],
+            stats["max_product_id"], entry["id"], entry["path"])
+
+
+def purge(conn, directory=ARCHIVE_DIR):
+    """Drop deleted products' sales from the archive files; returns {product_id: sales removed}.
+
+    The rewritten files replace the old ones and the products leave
+    sales_archive_forgotten in one transaction, so a failure leaves the
+    archive as it was. The sales were logged as deleted by forget_product.
+    """
+    forgotten = {row["product_id"] for row in conn.execute(FORGOTTEN_SQL).fetchall()}
+    manifest = conn.execute(MANIFEST_SQL).fetchall()
+    conn.rollback()
+    if not forgotten:
+        return {}
+
+    rewritten, removed, written = [], [], []
+    try:
+        for entry in manifest:
+            if not _may_hold(entry, forgotten):
+                continue
+            rows, stats = _without_products(entry, forgotten, directory)
+            if not rows:
+                continue
+            removed.extend(rows)
+            rewritten.append((entry, stats))
+            if stats is not None:
+                written.append(os.path.join(directory, stats["path"]))
+
+        conn.begin()
+        cur = conn.cursor()
+        for entry, stats in rewritten:
+            if stats is None:
+                cur.execute(DROP_SQL, (entry["id"], entry["path"]))
+            else:
+                cur.execute(REPLACE_SQL, _replace_params(stats, entry))
+            if cur.rowcount == 0:
+                raise PeriodChanged(f"{entry['path']} changed while it was being purged; run again")
+        # Products deleted since the read above wait for the next run
+        cur.executemany("DELETE FROM sales_archive_forgotten WHERE product_id=?",
+                        [(pid,) for pid in forgotten])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        for path in written:
+            _remove_file(path)
+        raise
+
+    for entry, _ in rewritten:
+        _remove_file(os.path.join(directory, entry["path"]))
+    counts = Counter(row["product_id"] for row in removed)
+    return {pid: counts[pid] for pid in sorted(forgotten)}
+
+
+# Reading
+
+class Manifest(list):
+    """The manifest rows, plus the deleted products whose archived sales reads skip."""
+
+    def __init__(self, entries, forgotten):
+        super().__init__(entries)
+        self.forgotten = frozenset(forgotten)
+
+
+# The forgotten products are read first: a purge committing in between then
+# only drops rows that are skipped anyway
+def load_manifest(conn):
+    forgotten = [row["product_id"] for row in conn.execute(FORGOTTEN_SQL).fetchall()]
+    return Manifest(conn.execute(MANIFEST_SQL).fetchall(), forgotten)
+
+
+async def load_manifest_async(conn):
+    forgotten = [row["product_id"] for row in await conn.fetchall(FORGOTTEN_SQL)]
+    return Manifest(await conn.fetchall(MANIFEST_SQL), forgotten)
+
+
+def _by_id(row):
+    return row["id"]
+
+
+def _dedupe(rows):
+    # A month archived between reading the hot table and the manifest shows
+    # up in both; the copies are identical
+    last = None
+    for row in rows:
+        if row["id"] != last:
+            last = row["id"]
+            yield row
+
+
+def _prepend(first, chunks):
+    yield first
+    yield from chunks
+
+
+def _chunks(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ArchiveQuery:
+    """The archived part of a sales read, merged with the hot rows by id.
+
+    columns must include id. Read the hot rows first and the manifest after
+    them, so a month archived in between is found in one or the other (and
+    then only once).
+    """
+
+    def __init__(self, columns, after=None, through=None, product_id=None, start=None, end=None,
+                 text_dates=False, directory=ARCHIVE_DIR):
+        self.columns = list(columns)
+        self.after = after
+        self.through = through
+        self.product_id = product_id
+        # Inclusive calendar days, like backend.date_range
+        self.start = datetime.combine(start, time.min) if start else None
+        self.end = datetime.combine(end + timedelta(days=1), time.min) if end else None
+        # Match what the hot table returns: text on SQLite, datetime on Postgres
+        self.text_dates = text_dates and "sale_date" in self.columns
+        self.directory = directory
+
+    def entries(self, manifest):
+        """The manifest rows this query has to read (manifest from load_manifest)."""
+        if self.product_id is not None and self.product_id in manifest.forgotten:
+            return []
+        return [
+            entry for entry in manifest
+            if (self.after is None or entry["max_id"] > self.after)
+            and (self.through is None or entry["min_id"] <= self.through)
+            and (self.start is None or datetime.fromisoformat(entry["last_sale"]) >= self.start)
+            and (self.end is None or datetime.fromisoformat(entry["first_sale"]) < self.end)
+            and (self.product_id is None or entry["min_product_id"] is None
+                 or entry["min_product_id"] <= self.product_id <= entry["max_product_id"])
+        ]
+
+    def _filter(self, forgotten):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        conditions = []
+        if self.after is not None:
+            conditions.append(ds.field("id") > self.after)
+        if self.through is not None:
+            conditions.append(ds.field("id") <= self.through)
+        if self.product_id is not None:
+            conditions.append(ds.field("product_id") == self.product_id)
+        elif forgotten:
+            conditions.append(~ds.field("product_id").isin(sorted(forgotten)))
+        if self.start is not None:
+            conditions.append(ds.field("sale_date") >= pa.scalar(self.start, pa.timestamp("us")))
+        if self.end is not None:
+            conditions.append(ds.field("sale_date") < pa.scalar(self.end, pa.timestamp("us")))
+        expr = None
+        for condition in conditions:
+            expr = condition if expr is None else expr & condition
+        return expr
+
+    def _file_rows(self, entry, forgotten):
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(os.path.join(self.directory, entry["path"]), format="parquet")
+        # Row groups whose id / sale_date range misses the filter are skipped
+        for batch in dataset.to_batches(columns=self.columns, filter=self._filter(forgotten),
+                                        batch_size=READ_BATCH_ROWS, use_threads=False):
+            rows = batch.to_pylist()
+            if self.text_dates:
+                for row in rows:
+                    row["sale_date"] = row["sale_date"].isoformat()
+            yield from rows
+
+    def rows(self, manifest):
+        """Matching archived rows in id order, read lazily."""
+        files = [self._file_rows(entry, manifest.forgotten) for entry in self.entries(manifest)]
+        return heapq.merge(*files, key=_by_id)
+
+    def page(self, manifest, hot_rows, limit):
+        """A page of hot rows (id order, at most limit) with the archived rows merged in."""
+        if not self.entries(manifest):
+            return hot_rows
+        merged = _dedupe(heapq.merge(hot_rows, self.rows(manifest), key=_by_id))
+        return list(merged if limit is None else islice(merged, limit))
+
+    def stream(self, load_manifest, hot_chunks, chunk_size):
+        """Chunks of hot rows (id order) with the archived rows merged in.
+
+        The manifest is loaded once the hot query has started: the open
+        cursor still sees rows archived after that, so none go missing.
+        """
+        hot_chunks = iter(hot_chunks)
+        first = next(hot_chunks, [])
+        manifest = load_manifest()
+        if not self.entries(manifest):
+            if first:
+                yield first
+            yield from hot_chunks
+            return
+        hot = (row for rows in _prepend(first, hot_chunks) for row in rows)
+        yield from _chunks(_dedupe(heapq.merge(hot, self.rows(manifest), key=_by_id)), chunk_size)
+
+    async def stream_async(self, load_manifest, hot_chunks, chunk_size):
+        """stream() for an async iterator of hot chunks; Parquet is read on a worker thread."""
+        hot_chunks = hot_chunks.__aiter__()
+        try:
+            first = await hot_chunks.__anext__()
+        except StopAsyncIteration:
+            first = []
+        manifest = await load_manifest()
+        if not self.entries(manifest):
+            if first:
+                yield first
+            async for rows in hot_chunks:
+                yield rows
+            return
+
+        archived = _chunks(self.rows(manifest), chunk_size)
+        hot, cold = deque(first), deque()
+        hot_done = cold_done = False
+        out, last = [], None
+        while True:
+            while not hot and not hot_done:
+                try:
+                    hot.extend(await hot_chunks.__anext__())
+                except StopAsyncIteration:
+                    hot_done = True
+            while not cold and not cold_done:
+                rows = await run_in_threadpool(next, archived, None)
+                if rows is None:
+                    cold_done = True
+                else:
+                    cold.extend(rows)
+            if not hot and not cold:
+                break
+            source = cold if not hot or (cold and cold[0]["id"] < hot[0]["id"]) else hot
+            row = source.popleft()
+            if row["id"] != last:
+                last = row["id"]
+                out.append(row)
+                if len(out) >= chunk_size:
+                    yield out
+                    out = []
+        if out:
+            yield out
+
+
+def last_id_at(manifest, at, directory=ARCHIVE_DIR):
+    """Highest archived sale id sold at or before `at` (ISO text), 0 if none."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    best = 0
+    moment = datetime.fromisoformat(at)
+    for entry in manifest:
+        if entry["max_id"] <= best or datetime.fromisoformat(entry["first_sale"]) > moment:
+            continue
+        if datetime.fromisoformat(entry["last_sale"]) <= moment:
+            best = entry["max_id"]
+            continue
+        dataset = ds.dataset(os.path.join(directory, entry["path"]), format="parquet")
+        ids = dataset.to_table(columns=["id"], filter=ds.field("sale_date")
+                               <= pa.scalar(moment, pa.timestamp("us")))["id"]
+        if len(ids):
+            best = max(best, pc.max(ids).as_py())
+    return best
+
+
+def status(conn, now=None):
+    archived = conn.execute(MANIFEST_SQL).fetchall()
+    forgotten = [row["product_id"] for row in conn.execute(FORGOTTEN_SQL).fetchall()]
+    hot = closed_months(conn, next_month(month_start(now or datetime.now())))
+    return archived, hot, forgotten
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move closed months of sales to Parquet files")
+    parser.add_argument("command", choices=["run", "status", "partition"])
+    parser.add_argument("--keep-months", type=int, default=HOT_MONTHS,
+                        help=f"months kept in the database, current one included (default {HOT_MONTHS})")
+    parser.add_argument("--dry-run", action="store_true", help="list what would be archived")
+    args = parser.parse_args()
+
+    from migrations import migrate
+    from storage import get_conn
+
+    with get_conn() as conn:
+        migrate(conn)
+
+        if args.command == "partition":
+            if conn.backend.name != "postgres":
+                print("Partitioning needs Postgres; on SQLite sales stays one table.")
+                return 1
+            print("Partitioned sales by month." if partition(conn) else "Sales is already partitioned.")
+            return 0
+
+        if args.command == "run":
+            moved = run(conn, args.keep_months, dry_run=args.dry_run)
+            if not moved:
+                print("Nothing to archive.")
+            else:
+                verb = "Would archive" if args.dry_run else "Archived"
+                print(f"{verb} {sum(moved.values())} sales from {len(moved)} month(s) to {ARCHIVE_DIR}.")
+            return 0
+
+        archived, hot, forgotten = status(conn)
+    for entry in archived:
+        print(f"{entry['period']}  archived  {entry['row_count']:>10}  ids {entry['min_id']}-{entry['max_id']}"
+              f"  {entry['path']}")
+    for start, n in hot:
+        print(f"{start:%Y-%m}  hot       {n:>10}")
+    if forgotten:
+        print(f"Deleted products waiting for the next run to purge their archived sales: {sorted(forgotten)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
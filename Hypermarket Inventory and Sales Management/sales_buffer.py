@@ -0,0 +1,315 @@
+# Group-commit ingestion for POST /sales
+#
+#   SALES_WRITE_MODE=buffered     # default "sync": one commit per sale
+#   SALES_FLUSH_ROWS=500          # flush once this many sales are queued
+#   SALES_FLUSH_MS=0              # ... or once the oldest has waited this long
+#   SALES_FLUSH_RETRIES=2         # retries of a flush that hit a database error
+#   SALES_SUBMIT_TIMEOUT=30       # seconds a request waits for its flush
+#
+# In buffered mode a sale is queued and its request waits. A flusher thread
+# takes the whole queue, and in one transaction on its own writer connection
+# runs each sale's guarded stock decrement, writes the sale rows with one
+# multi-row INSERT (plus the rollup) and commits. Only then is every waiting
+# request answered, with its sale row (id included) and the real remaining
+# stock, or its own stock error, so a sale is only ever reported once it is
+# committed and two tills can still never both sell the last unit.
+#
+# The transaction is open only while a flush runs, so other writers never
+# wait for the window. A flush that fails is rolled back and retried as a
+# whole; if it keeps failing, its requests get FlushFailed (a 503) rather
+# than an acknowledgement, and the flusher backs off before the next batch.
+# A request whose flush has not finished within SALES_SUBMIT_TIMEOUT gets
+# FlushFailed too; if its sale was still queued it is withdrawn first.
+#
+# With the default window of 0 a flush starts as soon as the writer is free,
+# and the sales that arrive while it writes form the next batch, so batches
+# grow with load and a quiet till is not kept waiting. A longer window makes
+# bigger batches only when many requests are in flight: each one holds its
+# threadpool worker until its flush commits.
+
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from storage import Connection, get_pool
+from catalog_events import publish
+import reorder
+import rollup
+import stock_shards
+
+
+WRITE_MODE = os.getenv("SALES_WRITE_MODE", "sync")
+FLUSH_ROWS = int(os.getenv("SALES_FLUSH_ROWS", "500"))
+FLUSH_MS = float(os.getenv("SALES_FLUSH_MS", "0"))
+FLUSH_RETRIES = int(os.getenv("SALES_FLUSH_RETRIES", "2"))
+SUBMIT_TIMEOUT = float(os.getenv("SALES_SUBMIT_TIMEOUT", "30"))
+RETRY_DELAY = 0.05
+MAX_BACKOFF = 5.0
+INSERT_CHUNK_ROWS = 1000
+
+log = logging.getLogger(__name__)
+
+
+class BufferClosed(Exception):
+    pass
+
+
+class FlushFailed(Exception):
+    pass
+
+
+class _Pending:
+    # One queued sale and the request thread waiting for its flush
+    def __init__(self, product_id, quantity, reject):
+        self.product_id = product_id
+        self.quantity = quantity
+        self.reject = reject
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class SalesBuffer:
+    def __init__(self, backend, flush_rows=FLUSH_ROWS, flush_ms=FLUSH_MS, retries=FLUSH_RETRIES,
+                 timeout=SUBMIT_TIMEOUT):
+        self.backend = backend
+        self.conn = Connection(backend.connect(), backend)
+        self.timeout = timeout
+        self.flush_rows = flush_rows
+        self.window = flush_ms / 1000
+        self.retries = retries
+        self.flushes = 0
+        self.flushed = 0
+        self.retried = 0
+        self.failed = 0
+        self._queue = []
+        self._opened = None
+        self._closed = False
+        self._wake = threading.Condition()
+        # Held while a flush writes, so flush() and the flusher take turns
+        self._writer = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="sales-buffer", daemon=True)
+        self._thread.start()
+
+    def submit(self, product_id, quantity, reject):
+        """Queue a sale and wait for its flush to commit; returns (sale row, remaining_stock).
+
+        When the stock decrement matches nothing, raises reject(cursor, product_id, quantity);
+        when the flush cannot be committed, raises FlushFailed.
+        """
+        pending = _Pending(product_id, quantity, reject)
+        with self._wake:
+            if self._closed:
+                raise BufferClosed("sales buffer is shut down")
+            if self._opened is None:
+                self._opened = time.monotonic()
+            self._queue.append(pending)
+            if len(self._queue) == 1 or len(self._queue) >= self.flush_rows:
+                self._wake.notify()
+
+        if not pending.done.wait(self.timeout):
+            with self._wake:
+                if pending in self._queue:
+                    self._queue.remove(pending)
+                    raise FlushFailed("sale was not recorded, please retry")
+            # Already being written: its outcome is not known yet
+            raise FlushFailed("sale was not confirmed in time; check before retrying")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def flush(self):
+        """Commit whatever is queued now instead of waiting for the window."""
+        with self._wake:
+            batch = self._take_locked()
+        self._commit(batch)
+
+    def _take_locked(self):
+        batch, self._queue, self._opened = self._queue, [], None
+        return batch
+
+    def _commit(self, batch):
+        """Write a batch and answer its requests whatever happens; returns whether it committed."""
+        if not batch:
+            return True
+        outcomes, committed = None, False
+        try:
+            with self._writer:
+                for attempt in range(self.retries + 1):
+                    try:
+                        outcomes = self._write(batch)
+                        committed = True
+                        break
+                    except Exception as exc:
+                        self._rollback()
+                        if attempt < self.retries:
+                            self.retried += 1
+                            log.warning("sales buffer flush failed (%s), retrying", exc)
+                            time.sleep(RETRY_DELAY * (attempt + 1))
+                            continue
+                        log.exception("sales buffer flush failed, %d sales rejected", len(batch))
+        finally:
+            if outcomes is None:
+                # Nothing was acknowledged, so nothing is lost: the tills see the error
+                self.failed += len(batch)
+                outcomes = [(None, FlushFailed("sale was not recorded, please retry"))] * len(batch)
+            for pending, (result, error) in zip(batch, outcomes):
+                pending.result, pending.error = result, error
+                pending.done.set()
+        return committed
+
+    def _rollback(self):
+        # Never raises: a connection that can't roll back is dropped, and
+        # the next _write() connects again
+        if self.conn is None:
+            return
+        try:
+            self.conn.rollback()
+        except Exception:
+            log.exception("sales buffer rollback failed, dropping the connection")
+            try:
+                self.conn.raw.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def _write(self, batch):
+        # One transaction for the whole batch; returns (result, error) per sale
+        if self.conn is None:
+            self.conn = Connection(self.backend.connect(), self.backend)
+        self.conn.begin()
+        cur = self.conn.cursor()
+        # Stamped inside the transaction, not at submit: /sales/changes
+        # assumes a sale commits within SETTLE_SECONDS of its sale_date
+        sale_date = datetime.now().isoformat()
+        outcomes, accepted = [], []
+        for pending in batch:
+            product = stock_shards.take(cur, pending.product_id, pending.quantity)
+            if not product:
+                outcomes.append((None, pending.reject(cur, pending.product_id, pending.quantity)))
+                continue
+            sale = {
+                "product_id": pending.product_id,
+                "quantity": pending.quantity,
+                "total_amount": float(product["price"]) * pending.quantity,
+                "sale_date": sale_date,
+            }
+            accepted.append((sale, product))
+            outcomes.append(((sale, product["stock"]), None))
+
+        for i in range(0, len(accepted), INSERT_CHUNK_ROWS):
+            chunk = accepted[i:i + INSERT_CHUNK_ROWS]
+            cur.execute(f"""
+                INSERT INTO sales (product_id, quantity, total_amount, sale_date)
+                VALUES {", ".join("(?, ?, ?, ?)" for _ in chunk)}
+                RETURNING id
+            """, [sale[k] for sale, _ in chunk
+                  for k in ("product_id", "quantity", "total_amount", "sale_date")])
+            # Ids are drawn in VALUES order, but RETURNING may list them in any order
+            for (sale, _), row in zip(chunk, sorted(cur.fetchall(), key=lambda row: row["id"])):
+                sale["id"] = row["id"]
+        rollup.record_sales(cur, [
+            (sale["sale_date"], sale["product_id"], product["category"],
+             sale["quantity"], sale["total_amount"])
+            for sale, product in accepted
+        ])
+        # One event (and low-stock test) per product, with its latest stock
+        # and what this flush sold
+        products = {}
+        for sale, product in accepted:
+            latest = products.setdefault(sale["product_id"], [product, [0, 0, 0.0]])
+            latest[0] = product
+            latest[1][0] += 1
+            latest[1][1] += sale["quantity"]
+            latest[1][2] += sale["total_amount"]
+        reorder.record_stock(cur, [(pid, product["stock"], product["reorder_level"])
+                                   for pid, (product, _) in products.items()])
+        for pid, (product, sold) in products.items():
+            publish(self.conn, "changed", pid, product["category"], stock=product["stock"], sold=sold)
+        self.conn.commit()
+
+        self.flushes += 1
+        self.flushed += len(accepted)
+        return outcomes
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._wake:
+                if not self._queue:
+                    if self._closed:
+                        return
+                    self._wake.wait()
+                    continue
+                remaining = self._opened + self.window - time.monotonic()
+                if remaining > 0 and len(self._queue) < self.flush_rows and not self._closed:
+                    self._wake.wait(remaining)
+                    continue
+                batch = self._take_locked()
+            # Sales keep queueing for the next flush while this one writes
+            try:
+                committed = self._commit(batch)
+            except Exception:
+                log.exception("sales buffer flusher error")
+                committed = False
+            if committed:
+                failures = 0
+            else:
+                # The database is down: don't spin on it, the queued requests wait or time out
+                failures += 1
+                time.sleep(min(RETRY_DELAY * 2 ** failures, MAX_BACKOFF))
+
+    def stats(self):
+        with self._wake:
+            return {
+                "mode": "buffered",
+                "queued": len(self._queue),
+                "flushes": self.flushes,
+                "flushed": self.flushed,
+                "retried": self.retried,
+                "failed": self.failed,
+                "flush_rows": self.flush_rows,
+                "flush_ms": self.window * 1000,
+            }
+
+    def close(self):
+        """Stop accepting sales, commit the queue and close the writer connection."""
+        with self._wake:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.notify()
+        self._thread.join()
+        if self.conn is not None:
+            self.conn.raw.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def enabled():
+    return WRITE_MODE == "buffered"
+
+
+def get():
+    """The process-wide buffer, or None when SALES_WRITE_MODE is not "buffered"."""
+    global _buffer
+    if not enabled():
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = SalesBuffer(get_pool().backend, FLUSH_ROWS, FLUSH_MS)
+            atexit.register(stop)
+        return _buffer
+
+
+def stop():
+    global _buffer
+    with _buffer_lock:
+        buffer, _buffer = _buffer, None
+    if buffer is not None:
+        buffer.close()
@@ -0,0 +1,184 @@
+# Delta feed behind GET /sales/changes
+#
+# Clients that keep the sales history locally (the Streamlit Sales tab) ask
+# for what changed since their last sync instead of downloading it again:
+#
+#   new sales   sales.id above the client's cursor
+#   deletions   sale_deletions rows, written by delete_product in the same
+#               transaction that deletes the product's sales, carrying the
+#               quantity and amount so totals can be adjusted without a lookup
+#
+# Every response hands back a cursor "<sale id>.<deletion id>" to pass as
+# ?since= next time. To start, since= also takes a bare sale id ("I have
+# every sale up to here": all deletions of those sales are returned) or an
+# ISO timestamp ("I have every sale up to this time"). While the deletions
+# for a bare sale id take more than one page, the cursor carries that id and
+# the deletion horizon of the first page as two more fields, so later pages
+# keep skipping deletions of sales the client never held.
+#
+# Months moved to Parquet by the archiver (sales_archive.py) are still part
+# of the feed: archiving is not deleting, so it logs nothing here, and sales
+# below the cursor that now live in the archive are merged back in by id.
+#
+# SQLite commits one writer at a time, so ids become visible in order.
+# Postgres can commit a lower id after a higher one, so there the feed only
+# hands out ids below the oldest row younger than SETTLE_SECONDS. This holds
+# as long as no sale or delete transaction runs longer than that, counted
+# from the moment it stamps sale_date / deleted_at; every writer, the
+# buffered-sales flush included, stamps them inside its transaction.
+
+import os
+import re
+from datetime import datetime, timedelta
+
+import sales_archive
+
+
+SETTLE_SECONDS = float(os.getenv("SALES_CHANGES_SETTLE_SECONDS", "2"))
+
+SALE_COLUMNS = "id, product_id, quantity, total_amount, sale_date"
+DELETION_COLUMNS = "sale_id, product_id, quantity, total_amount"
+
+_CURSOR = re.compile(r"^(\d+)(?:\.(\d+)(?:\.(\d+)\.(\d+))?)?$")
+
+
+def create_table(conn):
+    deleted_at = "TIMESTAMP" if conn.backend.name == "postgres" else "TEXT"
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS sale_deletions (
+            id {conn.backend.serial_pk},
+            sale_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            total_amount REAL NOT NULL,
+            deleted_at {deleted_at} NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_sale_deletions_sale_id ON sale_deletions (sale_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_sale_deletions_deleted_at ON sale_deletions (deleted_at)")
+
+
+# Run before the product's sales are deleted; params (deleted_at, product_id).
+# Exposed so backend_async.py can run it on its own connections.
+RECORD_SQL = """
+    INSERT INTO sale_deletions (sale_id, product_id, quantity, total_amount, deleted_at)
+    SELECT id, product_id, quantity, total_amount, ? FROM sales WHERE product_id = ?
+"""
+
+
+def record_product_deletion(cur, product_id):
+    cur.execute(RECORD_SQL, (datetime.now().isoformat(), product_id))
+
+
+# A deleted product's archived sales (sales_archive.forget_product), one row
+# each; params (sale_id, product_id, quantity, total_amount, deleted_at)
+RECORD_ARCHIVED_SQL = """
+    INSERT INTO sale_deletions (sale_id, product_id, quantity, total_amount, deleted_at)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def archived_deletion_rows(sales, deleted_at):
+    return [(s["id"], s["product_id"], s["quantity"], s["total_amount"], deleted_at) for s in sales]
+
+
+def record_archived_deletion(cur, sales):
+    if sales:
+        cur.executemany(RECORD_ARCHIVED_SQL, archived_deletion_rows(sales, datetime.now().isoformat()))
+
+
+def parse_since(since):
+    """?since= -> (sale id, deletion id or None, timestamp or None, bound or None); raises ValueError.
+
+    bound is (held sale id, deletion horizon): deletions up to the horizon
+    count only for sales up to the held id.
+    """
+    match = _CURSOR.match(since.strip())
+    if match:
+        deletion = match.group(2)
+        bound = (int(match.group(3)), int(match.group(4))) if match.group(3) is not None else None
+        return int(match.group(1)), int(deletion) if deletion is not None else None, None, bound
+    return 0, 0, datetime.fromisoformat(since.strip()).isoformat(), None
+
+
+# The statements behind changes(), exposed for check_query_plans.py
+
+# Positions for an ISO timestamp cursor; params (timestamp,)
+SALES_AT_SQL = "SELECT COALESCE(MAX(id), 0) AS n FROM sales WHERE sale_date <= ?"
+DELETIONS_AT_SQL = "SELECT COALESCE(MAX(id), 0) AS n FROM sale_deletions WHERE deleted_at <= ?"
+
+# params (after, through, limit)
+SALES_SQL = f"""
+    SELECT {SALE_COLUMNS} FROM sales WHERE id > ? AND id <= ? ORDER BY id LIMIT ?
+"""
+DELETIONS_SQL = f"""
+    SELECT id, {DELETION_COLUMNS} FROM sale_deletions
+    WHERE id > ? AND id <= ? ORDER BY id LIMIT ?
+"""
+# params (after, through, horizon, held sale id, limit)
+BOUNDED_DELETIONS_SQL = f"""
+    SELECT id, {DELETION_COLUMNS} FROM sale_deletions
+    WHERE id > ? AND id <= ? AND (id > ? OR sale_id <= ?) ORDER BY id LIMIT ?
+"""
+
+
+def horizon_query(backend_name, table, column, now=None):
+    """(SQL, params) for the highest id in table whose transaction has certainly committed."""
+    if backend_name != "postgres":
+        return f"SELECT COALESCE(MAX(id), 0) AS n FROM {table}", ()
+    cutoff = ((now or datetime.now()) - timedelta(seconds=SETTLE_SECONDS)).isoformat()
+    return f"""
+        SELECT COALESCE((SELECT MIN(id) FROM {table} WHERE {column} > ?) - 1,
+                        (SELECT MAX(id) FROM {table}), 0) AS n
+    """, (cutoff,)
+
+
+def _scalar(conn, sql, params=()):
+    return conn.execute(sql, params).fetchone()["n"]
+
+
+def changes(conn, since, limit, directory=sales_archive.ARCHIVE_DIR):
+    """Sales added and deleted after `since` (from parse_since), at most `limit` of each."""
+    sale_id, deletion_id, at, bound = since
+    if at is not None:
+        sale_id = _scalar(conn, SALES_AT_SQL, (at,))
+        archived = conn.execute(sales_archive.MANIFEST_SQL).fetchall()
+        sale_id = max(sale_id, sales_archive.last_id_at(archived, at, directory))
+        deletion_id = _scalar(conn, DELETIONS_AT_SQL, (at,))
+
+    # Horizons first, so rows committed while we read wait for the next sync
+    sales_top = _scalar(conn, *horizon_query(conn.backend.name, "sales", "sale_date"))
+    deletions_top = _scalar(conn, *horizon_query(conn.backend.name, "sale_deletions", "deleted_at"))
+
+    sales = conn.execute(SALES_SQL, (sale_id, sales_top, limit)).fetchall()
+
+    # Archived sales are settled, so they move the horizon too (the hot
+    # table may even be empty); read the manifest after the hot rows
+    manifest = sales_archive.load_manifest(conn)
+    sales_top = max([sales_top] + [entry["max_id"] for entry in manifest])
+    archive = sales_archive.ArchiveQuery(sales_archive.COLUMNS, after=sale_id, through=sales_top,
+                                         text_dates=conn.backend.name == "sqlite", directory=directory)
+    sales = archive.page(manifest, sales, limit)
+
+    if deletion_id is None:
+        # A bare sale id: every deletion logged so far of a sale the client may hold
+        bound, deletion_id = (sale_id, deletions_top), 0
+    if bound is not None:
+        held, horizon = bound
+        deleted = conn.execute(BOUNDED_DELETIONS_SQL,
+                               (deletion_id, deletions_top, horizon, held, limit)).fetchall()
+    else:
+        deleted = conn.execute(DELETIONS_SQL, (deletion_id, deletions_top, limit)).fetchall()
+
+    more = len(sales) == limit or len(deleted) == limit
+    next_sale = sales[-1]["id"] if len(sales) == limit else max(sale_id, sales_top)
+    next_deletion = deleted[-1]["id"] if len(deleted) == limit else max(deletion_id, deletions_top)
+    cursor = f"{next_sale}.{next_deletion}"
+    if bound is not None and next_deletion < bound[1]:
+        cursor += f".{bound[0]}.{bound[1]}"
+    return {
+        "sales": sales,
+        "deleted": [{key: row[key] for key in row if key != "id"} for row in deleted],
+        "next": cursor,
+        "more": more,
+    }
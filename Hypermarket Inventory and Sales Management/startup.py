@@ -0,0 +1,129 @@
+# Worker startup, run from the FastAPI lifespan hook rather than at import
+#
+# Importing backend.py or backend_async.py opens no database connection.
+# When a worker starts serving, run() does the following:
+#
+#   schema      one SELECT against schema_migrations, no DDL
+#   pool        opens DB_POOL_WARM connections in parallel
+#   background  starts the catalog invalidation listener and the stock
+#               shard rebalancer, and has SIGINT / SIGTERM end the /live
+#               event streams so they don't hold up shutdown
+#
+# stop() runs from the lifespan shutdown: it ends any /live streams still
+# open and commits the sales still queued in buffered mode.
+#
+# It then logs each step and the whole cold start, from process start to
+# ready, next to uvicorn's own startup lines. metrics exports the same
+# numbers as app_startup_seconds{phase}, one series per worker.
+#
+#   DB_AUTO_MIGRATE=1 (default)  a database that is behind is migrated here
+#   DB_AUTO_MIGRATE=0            the worker refuses to start instead; run
+#                                python migrations.py as a deploy step
+#   DB_POOL_WARM=N               connections opened before serving
+#                                (default: the pool size)
+
+import asyncio
+import logging
+import os
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+import catalog_events
+import live_feed
+import metrics
+import migrations
+import sales_buffer
+import stock_shards
+import storage
+from catalog_cache import catalog
+
+
+AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1").lower() not in ("0", "false", "no")
+POOL_WARM = int(os.getenv("DB_POOL_WARM", str(storage.POOL_SIZE)))
+
+# uvicorn prints this logger at INFO ("Application startup complete.")
+log = logging.getLogger("uvicorn.error")
+
+
+def _process_started():
+    # Wall-clock time this process was spawned, so interpreter start and
+    # imports count towards cold start; Linux only
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, counted after the parenthesised command name
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+STARTED = _process_started() or time.time()
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+def check_schema():
+    """Make sure the database is at migrations.LATEST_VERSION; returns the versions applied."""
+    with storage.get_conn() as conn:
+        pending = migrations.pending_versions(conn)
+        if not pending:
+            return []
+        if not AUTO_MIGRATE:
+            raise SchemaOutOfDate(
+                f"database schema is missing migrations {pending} "
+                f"(latest is {migrations.LATEST_VERSION}); run: python migrations.py"
+            )
+        log.info("applying migrations %s", pending)
+        return migrations.migrate(conn)
+
+
+def start_background():
+    # Other workers' product writes invalidate our catalog cache from here on
+    catalog_events.start(catalog)
+    stock_shards.start_rebalancer()
+    live_feed.reopen()
+    live_feed.close_on_signals(asyncio.get_running_loop())
+
+
+async def run(async_pool=None):
+    """Get this worker ready to serve; returns {phase: seconds}.
+
+    async_pool is backend_async's pool. It is warmed instead of the sync
+    pool, which that app only touches for shared routes and sharded sales
+    and which keeps the connection the schema check opened.
+    """
+    phases = {}
+
+    clock = time.perf_counter()
+    await run_in_threadpool(check_schema)
+    phases["schema"] = time.perf_counter() - clock
+
+    clock = time.perf_counter()
+    if async_pool is not None:
+        await async_pool.warm(POOL_WARM)
+    else:
+        await run_in_threadpool(storage.get_pool().warm, POOL_WARM)
+    phases["pool"] = time.perf_counter() - clock
+
+    clock = time.perf_counter()
+    start_background()
+    phases["background"] = time.perf_counter() - clock
+
+    phases["ready"] = time.time() - STARTED
+    for phase, seconds in phases.items():
+        metrics.STARTUP.labels(phase).set(seconds)
+    log.info("worker %d ready in %.0f ms (schema %.1f ms, pool %.1f ms, background %.1f ms)",
+             os.getpid(), phases["ready"] * 1000, phases["schema"] * 1000,
+             phases["pool"] * 1000, phases["background"] * 1000)
+    return phases
+
+
+async def stop():
+    """Lifespan shutdown: end open /live streams, then commit queued sales."""
+    live_feed.close()
+    await run_in_threadpool(sales_buffer.stop)
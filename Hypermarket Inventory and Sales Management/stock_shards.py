@@ -0,0 +1,289 @@
+# Sharded stock counters for hot SKUs
+#
+#   python stock_shards.py enable 42 --shards 8
+#   python stock_shards.py disable 42
+#   python stock_shards.py rebalance [42]
+#   python stock_shards.py status
+#
+# Every sale of a product normally takes that product's row lock, so a
+# promotional item selling hundreds of times a second serializes on it.
+# Flagging the product (products.shard_count > 0) spreads its stock over
+# shard_count rows in stock_shards: a sale decrements a random shard and
+# falls back to the fullest one, then to products.stock (the unsharded
+# reserve), and only when stock is spread too thin to cover the sale does it
+# pool everything under the product lock.
+#
+# The product's real stock is products.stock plus its shards; every read
+# that returns a product selects TOTAL_STOCK so ProductRead.stock stays
+# exact. Setting stock outright (PUT, PATCH, bulk edits, imports) writes
+# products.stock and zeroes the shards with RESET_SQL. rebalance() evens the
+# shards out again, and runs every STOCK_REBALANCE_SECONDS in each worker.
+
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+
+
+REBALANCE_SECONDS = float(os.getenv("STOCK_REBALANCE_SECONDS", "60"))
+
+log = logging.getLogger(__name__)
+
+TOTAL_STOCK = """CASE WHEN products.shard_count = 0 THEN products.stock
+    ELSE products.stock + (SELECT COALESCE(SUM(s.stock), 0) FROM stock_shards s
+                           WHERE s.product_id = products.id) END"""
+
+PRODUCT_COLUMNS = f"products.id, products.name, products.price, {TOTAL_STOCK} AS stock, products.category"
+
+RESET_SQL = "UPDATE stock_shards SET stock = 0 WHERE product_id = ?"
+
+# The statements are exposed so backend_async.py can run them on its own
+# connections; take() and the helpers below are for DB-API cursors
+
+STOCK_SQL = f"SELECT {TOTAL_STOCK} AS stock FROM products WHERE id=?"
+
+# What take() needs once the guarded decrement has missed; params (product_id,)
+SHARDING_SQL = "SELECT price, category, shard_count, reorder_level FROM products WHERE id=?"
+
+# The guarded decrement of an unsharded product; params from take_params()
+TAKE_SQL = """
+    UPDATE products SET stock = stock - ?
+    WHERE id = ? AND stock >= ? AND shard_count = 0
+    RETURNING price, stock, category, reorder_level
+"""
+
+# One shard, picked at random; params (quantity, product_id, shard, quantity)
+TAKE_SHARD_SQL = """
+    UPDATE stock_shards SET stock = stock - ?
+    WHERE product_id = ? AND shard = ? AND stock >= ?
+    RETURNING shard
+"""
+
+# The fullest shard that covers the sale; params (quantity, product_id, quantity, product_id, quantity)
+TAKE_FULLEST_SQL = """
+    UPDATE stock_shards SET stock = stock - ?
+    WHERE product_id = ? AND stock >= ? AND shard = (
+        SELECT shard FROM stock_shards WHERE product_id = ? AND stock >= ?
+        ORDER BY stock DESC LIMIT 1
+    )
+    RETURNING shard
+"""
+
+
+def create_table(conn):
+    conn.execute("ALTER TABLE products ADD COLUMN shard_count INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stock_shards (
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            shard INTEGER NOT NULL,
+            stock INTEGER NOT NULL,
+            PRIMARY KEY (product_id, shard)
+        )
+    """)
+
+
+def select_columns(names):
+    """Product column names -> SELECT expressions, with stock summed over shards."""
+    return [f"{TOTAL_STOCK} AS stock" if name == "stock" else name for name in names]
+
+
+def reset(cur, product_id):
+    cur.execute(RESET_SQL, (product_id,))
+
+
+def take_params(product_id, quantity):
+    return (quantity, product_id, quantity)
+
+
+def take(cur, product_id, quantity):
+    """Decrement stock for one sale; returns {price, stock, category, reorder_level} or None.
+
+    stock is what is left in total. None means the product does not exist or
+    cannot cover the sale, with nothing changed.
+    """
+    # Unsharded products: the same single guarded statement as ever
+    cur.execute(TAKE_SQL, take_params(product_id, quantity))
+    product = cur.fetchone()
+    if product:
+        return product
+
+    cur.execute(SHARDING_SQL, (product_id,))
+    product = cur.fetchone()
+    if not product or not product["shard_count"]:
+        return None
+
+    taken = cur.execute(TAKE_SHARD_SQL, (quantity, product_id, random.randrange(product["shard_count"]),
+                                         quantity)).fetchone()
+    if not taken:
+        taken = cur.execute(TAKE_FULLEST_SQL, (quantity, product_id, quantity, product_id,
+                                               quantity)).fetchone()
+    if not taken:
+        taken = cur.execute("""
+            UPDATE products SET stock = stock - ?
+            WHERE id = ? AND stock >= ?
+            RETURNING id
+        """, (quantity, product_id, quantity)).fetchone()
+    if not taken and not _pool_and_take(cur, product_id, quantity):
+        return None
+
+    cur.execute(STOCK_SQL, (product_id,))
+    return {"price": product["price"], "stock": cur.fetchone()["stock"],
+            "category": product["category"], "reorder_level": product["reorder_level"]}
+
+
+def _locked_totals(cur, product_id):
+    # Product row first, then its shards: the same order as rebalance()
+    for_update = cur.backend.for_update
+    cur.execute(f"SELECT stock, shard_count FROM products WHERE id=?{for_update}", (product_id,))
+    product = cur.fetchone()
+    cur.execute(f"SELECT shard, stock FROM stock_shards WHERE product_id=? ORDER BY shard{for_update}",
+                (product_id,))
+    return product, cur.fetchall()
+
+
+def _pool_and_take(cur, product_id, quantity):
+    # Enough stock in total but no single counter can cover the sale
+    product, shards = _locked_totals(cur, product_id)
+    total = product["stock"] + sum(s["stock"] for s in shards)
+    if total < quantity:
+        return False
+    cur.execute(RESET_SQL, (product_id,))
+    cur.execute("UPDATE products SET stock=? WHERE id=?", (total - quantity, product_id))
+    return True
+
+
+def _spread(cur, product_id, shard_count):
+    product, shards = _locked_totals(cur, product_id)
+    if product is None:
+        return None
+    total = product["stock"] + sum(s["stock"] for s in shards)
+    if not shard_count:
+        cur.execute("DELETE FROM stock_shards WHERE product_id=?", (product_id,))
+        cur.execute("UPDATE products SET stock=?, shard_count=0 WHERE id=?", (total, product_id))
+        return total
+
+    share, extra = divmod(total, shard_count)
+    cur.execute("DELETE FROM stock_shards WHERE product_id=? AND shard >= ?", (product_id, shard_count))
+    cur.executemany("""
+        INSERT INTO stock_shards (product_id, shard, stock) VALUES (?, ?, ?)
+        ON CONFLICT (product_id, shard) DO UPDATE SET stock = excluded.stock
+    """, [(product_id, shard, share + (1 if shard < extra else 0)) for shard in range(shard_count)])
+    cur.execute("UPDATE products SET stock=0, shard_count=? WHERE id=?", (shard_count, product_id))
+    # Concurrent shard sales can each miss the other's decrement (reorder.py)
+    import reorder
+    reorder.sync(cur, product_id)
+    return total
+
+
+def set_shards(conn, product_id, shard_count):
+    """Shard a product's stock over shard_count counters (0 folds it back); returns total stock."""
+    conn.begin()
+    total = _spread(conn.cursor(), product_id, shard_count)
+    conn.commit()
+    return total
+
+
+def rebalance(conn, product_id=None):
+    """Even out the shards of one or every sharded product; returns how many were rebalanced."""
+    if product_id is None:
+        pids = [row["id"] for row in
+                conn.execute("SELECT id FROM products WHERE shard_count > 0").fetchall()]
+        conn.commit()
+    else:
+        pids = [product_id]
+
+    done = 0
+    for pid in pids:
+        # One short transaction per product so sales are held up only briefly
+        conn.begin()
+        cur = conn.cursor()
+        cur.execute("SELECT shard_count FROM products WHERE id=?", (pid,))
+        row = cur.fetchone()
+        if row and row["shard_count"]:
+            _spread(cur, pid, row["shard_count"])
+            done += 1
+        conn.commit()
+    return done
+
+
+_rebalancer = None
+
+
+def start_rebalancer(interval=REBALANCE_SECONDS):
+    """Rebalance every sharded product each `interval` seconds on a daemon thread."""
+    global _rebalancer
+    if _rebalancer is not None or interval <= 0:
+        return
+
+    from storage import get_conn
+
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                with get_conn() as conn:
+                    rebalance(conn)
+            except Exception:
+                log.exception("stock shard rebalance failed")
+
+    thread = threading.Thread(target=run, name="stock-rebalancer", daemon=True)
+    thread.start()
+    _rebalancer = (thread, stop)
+
+
+def stop_rebalancer():
+    global _rebalancer
+    if _rebalancer is not None:
+        thread, stop = _rebalancer
+        stop.set()
+        thread.join()
+        _rebalancer = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage sharded stock counters")
+    sub = parser.add_subparsers(dest="command", required=True)
+    enable = sub.add_parser("enable", help="spread a product's stock over N counters")
+    enable.add_argument("product_id", type=int)
+    enable.add_argument("--shards", type=int, default=8)
+    disable = sub.add_parser("disable", help="fold a product's counters back into products.stock")
+    disable.add_argument("product_id", type=int)
+    again = sub.add_parser("rebalance", help="even out the counters now")
+    again.add_argument("product_id", type=int, nargs="?")
+    sub.add_parser("status", help="list sharded products")
+    args = parser.parse_args()
+
+    from storage import get_conn
+
+    with get_conn() as conn:
+        if args.command == "enable":
+            if args.shards < 1:
+                parser.error("--shards must be at least 1")
+            total = set_shards(conn, args.product_id, args.shards)
+        elif args.command == "disable":
+            total = set_shards(conn, args.product_id, 0)
+        elif args.command == "rebalance":
+            print(f"Rebalanced {rebalance(conn, args.product_id)} product(s).")
+            return 0
+        else:
+            rows = conn.execute(f"""
+                SELECT id, name, shard_count, products.stock AS reserve, {TOTAL_STOCK} AS stock
+                FROM products WHERE shard_count > 0 ORDER BY id
+            """).fetchall()
+            for row in rows:
+                print(f"{row['id']:>8}  {row['name']:<30} shards {row['shard_count']:>3}  "
+                      f"stock {row['stock']:>8}  reserve {row['reserve']:>6}")
+            return 0
+
+    if total is None:
+        print(f"Product {args.product_id} not found.")
+        return 1
+    print(f"Product {args.product_id}: {total} in stock.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
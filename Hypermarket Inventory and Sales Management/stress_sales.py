@@ -0,0 +1,114 @@
+# Concurrency stress test for POST /sales
+#
+#   python stress_sales.py                      # scratch SQLite file
+#   python stress_sales.py --sales 5000 --workers 64
+#   python stress_sales.py --database-url postgresql://...   # throwaway DB only!
+#
+# Fires many parallel sales at a single product and checks that stock never
+# goes negative and that every unit sold has exactly one sale row. The same
+# load is then replayed through the old read-check-insert-update path for a
+# throughput (and overselling) comparison.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+def legacy_create_sale(get_conn, product_id, quantity):
+    # The pre-pooling create_sale flow: four round trips and no row lock
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM products WHERE id=?", (product_id,))
+        product = cur.fetchone()
+        if not product or quantity > product["stock"]:
+            return False
+        cur.execute("""
+            INSERT INTO sales (product_id, quantity, total_amount, sale_date)
+            VALUES (?, ?, ?, ?)
+        """, (product_id, quantity, product["price"] * quantity, datetime.now().isoformat()))
+        cur.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (quantity, product_id))
+        conn.commit()
+        cur.execute("SELECT * FROM products WHERE id=?", (product_id,))
+        cur.fetchone()
+        return True
+
+
+def run(label, sell, args, get_conn):
+    with get_conn() as conn:
+        row = conn.execute("""
+            INSERT INTO products (name, price, stock, category)
+            VALUES (?, ?, ?, ?)
+            RETURNING id
+        """, (f"stress-{label}", 9.99, args.stock, "stress")).fetchone()
+        conn.commit()
+    pid = row["id"]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(lambda _: sell(pid, args.quantity), range(args.sales)))
+    elapsed = time.perf_counter() - start
+
+    with get_conn() as conn:
+        stock = conn.execute("SELECT stock FROM products WHERE id=?", (pid,)).fetchone()["stock"]
+        sold = conn.execute(
+            "SELECT COUNT(*) AS n, COALESCE(SUM(quantity), 0) AS qty FROM sales WHERE product_id=?",
+            (pid,),
+        ).fetchone()
+
+    ok = sum(results)
+    consistent = stock >= 0 and sold["qty"] == args.stock - stock and sold["n"] == ok
+    print(
+        f"{label:>8}: {args.sales / elapsed:8.0f} sales/s  "
+        f"accepted={ok:<6} rejected={args.sales - ok:<6} "
+        f"final_stock={stock:<6} sale_rows={sold['n']:<6} "
+        f"{'OK' if consistent else 'INCONSISTENT'}"
+    )
+    return consistent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency stress test for POST /sales")
+    parser.add_argument("--sales", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "stress.db")
+    os.environ["DATABASE_URL"] = url
+
+    from fastapi import HTTPException
+
+    import storage
+    storage.set_pool(storage.ConnectionPool(storage.backend_from_url(url), size=args.workers))
+
+    from backend import SaleBase, create_sale, init_db
+    init_db()
+
+    def sell(pid, quantity):
+        try:
+            create_sale(SaleBase(product_id=pid, quantity=quantity))
+            return True
+        except HTTPException as exc:
+            if exc.status_code != 400:
+                raise
+            return False
+
+    print(f"{args.sales} sales x {args.quantity} against stock {args.stock}, "
+          f"{args.workers} workers, {storage.get_pool().backend.name}")
+    consistent = run("guarded", sell, args, storage.get_conn)
+    if not args.skip_legacy:
+        run("legacy", lambda pid, q: legacy_create_sale(storage.get_conn, pid, q), args, storage.get_conn)
+
+    storage.get_pool().close()
+    return 0 if consistent else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())